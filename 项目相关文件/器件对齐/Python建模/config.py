@@ -22,6 +22,17 @@ WEIGHTS_DIR_FULL = os.path.join(PROJECT_DIR, "weights_full")   # full-run weight
 WEIGHTS_DIR_QUICK = os.path.join(PROJECT_DIR, "weights_quick") # quick-run weights
 WEIGHTS_DIR = WEIGHTS_DIR_FULL                                # ANN鏉冮噸淇濆瓨 (榛樿 full)
 DATA_DIR    = os.path.join(PROJECT_DIR, "data")               # MNIST鏁版嵁
+# Content-addressed cache of prepared datasets (data_utils.prepare_all_datasets): per-method
+# uint8 splits + gain / scale / projection params as .npy, keyed by config fields and MNIST raw files.
+DATASET_CACHE_DIR = os.path.join(DATA_DIR, "cache")
+# Nested stratified evaluation subsets (data_utils.take_eval_subset): one stratified index order per
+# split is stored here; a subset of size n is its first n indices, so small ⊂ medium ⊂ full.
+SUBSET_INDEX_DIR = os.path.join(DATASET_CACHE_DIR, "subsets")
+EVAL_SUBSET_SIZES = {"small": 500, "medium": 2000, "full": 0}
+DATASET_CACHE_ENABLE = os.environ.get("SNN_DATASET_CACHE", "1").strip().lower() in ("1", "true", "yes")
+# Threads for the non-projection downsample + input-gain step when all methods are prepared at
+# once (0 = sequential, -1 = one per CPU core). Each method's output is deterministic either way.
+DATA_PREP_WORKERS = int(os.environ.get("SNN_DATA_PREP_WORKERS", "-1").strip() or -1)
 
 # I-V 鏁版嵁鏂囦欢璺緞锛堝鏋滄湁鐨勮瘽锛岀敤浜庡姞杞界湡瀹炲櫒浠舵暟鎹級
 # I-V 数据与器件插件路径（支持多种目录布局 + 环境变量覆盖）
@@ -67,6 +78,23 @@ D2D_VARIATION = 0.05       # Die-to-Die 鍙樺寲鎬?5%
 C2C_VARIATION = 0.03       # Cell-to-Cell 鍙樺寲鎬?3%
 READ_NOISE_SIGMA = 0.0005  # 璇诲櫔澹版爣鍑嗗樊 (鍗犵數瀵艰寖鍥寸殑 0.05%)
 DRIFT_COEFF = 0.005        # 鐢靛婕傜Щ绯绘暟
+# Multi-macro tiling: [O, D] is split into ARRAY_ROWS x (ARRAY_COLS/2) tiles,
+# per-tile ADC, row tiles summed digitally. "auto" = only when > 1 macro; "on" / "off".
+TILE_MAPPING = os.environ.get("SNN_TILE_MAPPING", "auto").strip().lower()
+# Sparse MAC: all-zero weight columns (pruned inputs) are not driven and are dropped from the
+# MAC / tile plan; all-zero tiles are not read on the ideal tiled path.
+SPARSE_SKIP_ZERO_INPUTS = True
+# Read-noise model when add_noise=True:
+#   "signal": READ_NOISE_SIGMA * ADC full scale per read (legacy)
+#   "state":  per-cell sigma(G) = READ_NOISE_SIGMA * G_max + READ_NOISE_STATE_COEFF * G
+READ_NOISE_MODEL = "signal"
+READ_NOISE_STATE_COEFF = 0.01
+# Random telegraph noise: per-cell two-state Markov chain, advanced once per bit-plane step.
+RTN_ENABLE = False
+RTN_AMPLITUDE = 0.02         # relative dG/G while a trap is occupied
+RTN_P_CAPTURE = 0.05         # per-step empty -> occupied probability
+RTN_P_EMIT = 0.05            # per-step occupied -> empty probability
+RTN_ACTIVE_FRACTION = 0.1    # fraction of cells with an active trap
 
 # =====================================================
 # 浠跨湡鍙鐜版€?
@@ -78,6 +106,13 @@ RANDOM_SEED = 42
 # =====================================================
 USE_MEMRISTOR_PLUGIN = True      # True: 灏濊瘯鍔犺浇鍣ㄤ欢缁?memristor_plugin.py
 PLUGIN_LEVELS_FOR_4BIT = True    # True: 4-bit 閲忓寲浼樺厛浣跨敤鍣ㄤ欢鐢靛绂绘暎绾?
+# Optimized conductance level set (level_optimizer.py output, .pt).
+# Empty = use the device's log-spaced levels. Env override: SNN_OPTIMIZED_LEVELS_PATH.
+OPTIMIZED_LEVELS_PATH = os.environ.get("SNN_OPTIMIZED_LEVELS_PATH", "").strip()
+# Population of measured I-V curves (directory or multi-sheet workbook). When set, the
+# plugin simulator's D2D/C2C variation is fitted from it instead of the 5%/3% defaults.
+# Env override: SNN_IV_BATCH_PATH.
+IV_BATCH_PATH = os.environ.get("SNN_IV_BATCH_PATH", "").strip()
 
 # =====================================================
 # ADC 閲忓寲閰嶇疆
@@ -124,6 +159,14 @@ THRESHOLD_RATIO_CANDIDATES = [
     6.0 / 255.0, 8.0 / 255.0, 12.0 / 255.0,
 ]
 THRESHOLD_CALIBRATE_SAMPLES = 2000
+# Full-grid sweep ladder ([3b-1]): evaluate every combination on the first subset (names from
+# EVAL_SUBSET_SIZES or sizes), keep those within SWEEP_ESCALATE_MARGIN of the rung's best (at least
+# SWEEP_ESCALATE_MIN_KEEP) for the next rung; the last rung is always the full tuning split.
+# In the saved full_grid, subset accuracies are screen_acc; snn_acc is only set on full-split finalists.
+# Empty = every combination on the full split.
+SWEEP_SUBSET_LADDER = [s for s in os.environ.get("SNN_SWEEP_SUBSET_LADDER", "").replace(",", " ").split()]
+SWEEP_ESCALATE_MARGIN = 0.02
+SWEEP_ESCALATE_MIN_KEEP = 10
 
 # =====================================================
 # Training-side robustness (QAT / noise / IR-drop proxy)
@@ -143,12 +186,21 @@ POST_QUANT_FINE_TUNE_EPOCHS = 5
 PROJ_DIM = 64
 PROJ_PCA_SAMPLES = 10000
 PROJ_PCA_CENTER = True
+# PCA basis: "streaming" accumulates the covariance over the full train set in
+# float64 chunks (bounded memory, deterministic); "lowrank" subsamples
+# PROJ_PCA_SAMPLES rows and runs torch.pca_lowrank.
+PROJ_PCA_MODE = os.environ.get("SNN_PROJ_PCA_MODE", "streaming").strip().lower()
+PROJ_PCA_CHUNK = 8192
 PROJ_SCALE_METHOD = "minmax"  # minmax | p99
 PROJ_SCALE_PERCENTILE = 0.99
 PROJ_SUP_EPOCHS = 10
 PROJ_SUP_LR = 0.02
 PROJ_SUP_BATCH_SIZE = 256
 PROJ_SUP_USE_BIAS = False
+# Fixed-point projection for the on-board preprocessor (flash_preprocess --fixed-point):
+# per-column int8 weights, int32 accumulators, int64 multiplier/shift requantization.
+FIXED_PROJ_WEIGHT_BITS = 8
+FIXED_PROJ_CALIB_SAMPLES = 10000
 
 # =====================================================
 # SNN 鍥哄畾鍙傛暟
@@ -191,6 +243,76 @@ ANN_EPOCHS     = 30        # 璁粌杞暟 (MNIST 鍗曞眰30杞冻澶
 ANN_LR         = 0.01      # 瀛︿範鐜?
 ANN_MOMENTUM   = 0.9       # SGD 鍔ㄩ噺
 ANN_BATCH_SIZE = 128       # 鎵瑰ぇ灏?
+# Trainer: "sgd" = minibatch SGD+momentum (above), "lbfgs" = full-batch L-BFGS.
+# L-BFGS float phase ignores ANN_EPOCHS (runs up to LBFGS_MAX_ITER iterations);
+# the QAT phase runs one outer step per epoch with LBFGS_QAT_ITERS inner iterations.
+ANN_TRAIN_MODE = os.environ.get("SNN_ANN_TRAIN_MODE", "sgd").strip().lower()
+LBFGS_MAX_ITER = 100
+LBFGS_QAT_ITERS = 5
+LBFGS_L2 = 1e-4            # small L2 keeps the (convex) problem bounded when separable
+# Train all DOWNSAMPLE_METHODS together as one [M, 10, 64] batched model (SGD mode only).
+# Methods share one shuffle order, so results differ from sequential runs by sampling order.
+ANN_TRAIN_BATCHED = os.environ.get("SNN_ANN_TRAIN_BATCHED", "0").strip().lower() in ("1", "true", "yes")
+# Methods that are not batched are trained in a spawn process pool with this many workers
+# (0 = sequential in-process, -1 = one per CPU core). Each worker gets cores // workers torch threads
+# and its own seed (RANDOM_SEED + method index), so results differ from sequential runs by RNG stream.
+ANN_TRAIN_WORKERS = int(os.environ.get("SNN_ANN_TRAIN_WORKERS", "0").strip() or 0)
+# Early stopping on val_loader_float (SGD / batched trainers): check validation accuracy every
+# EARLY_STOP_EVAL_EVERY epochs (quantized and noise-free in the QAT phase), stop after
+# EARLY_STOP_PATIENCE checks without an improvement > EARLY_STOP_MIN_DELTA, restore the best weights.
+EARLY_STOP_ENABLE = os.environ.get("SNN_EARLY_STOP", "1").strip().lower() in ("1", "true", "yes")
+EARLY_STOP_EVAL_EVERY = 1
+EARLY_STOP_PATIENCE = 5
+EARLY_STOP_MIN_DELTA = 0.0
+# Hardware-in-the-loop fine-tune after QAT: train through the differentiable bit-plane
+# MAC -> ADC -> LIF forward (STE + surrogate spikes) at the baseline ADC/T and the primary scheme,
+# threshold ratio calibrated on val first. Best val spike accuracy (real snn_inference on
+# HIL_VAL_SAMPLES) is kept, pre-HIL weights included, even with EARLY_STOP_ENABLE off. 0 = disabled.
+HIL_FINETUNE_EPOCHS = int(os.environ.get("SNN_HIL_EPOCHS", "0").strip() or 0)
+HIL_LR = 0.003
+HIL_ADC_BITS = 8
+HIL_TIMESTEPS = 1
+HIL_SURROGATE_SLOPE = 5.0
+HIL_VAL_SAMPLES = 2000
+# Resumable training: each trained method's weights get a <method>.meta.json config fingerprint
+# (training config + data digest). With TRAIN_RESUME, run_training skips methods whose saved
+# weights match the current fingerprint and resumes interrupted sequential / process-pool
+# training from WEIGHTS_DIR/checkpoints/<method>.pt (model, optimizer momentum, epoch, RNG states),
+# written every CHECKPOINT_EVERY epochs. Batched training checkpoints the stacked [M, 10, D] state
+# to WEIGHTS_DIR/checkpoints/batched.pt and hands finished phases to the per-method checkpoints.
+# --skip-train retrains methods whose fingerprint no longer matches (weights without one load as before).
+TRAIN_RESUME = os.environ.get("SNN_TRAIN_RESUME", "1").strip().lower() in ("1", "true", "yes")
+CHECKPOINT_EVERY = 1
+# Magnitude pruning after QAT: zero PRUNE_SPARSITY of the weights, then fine-tune with the mask
+# fixed for PRUNE_FINETUNE_EPOCHS (quantized forward when QAT_ENABLE; HIL fine-tune keeps the mask).
+# "unstructured" prunes single cells, "input" prunes whole input rows (word lines), which then are
+# neither programmed nor driven. 0 = disabled.
+PRUNE_SPARSITY = float(os.environ.get("SNN_PRUNE_SPARSITY", "0").strip() or 0)
+PRUNE_STRUCTURE = os.environ.get("SNN_PRUNE_STRUCTURE", "unstructured").strip().lower()
+PRUNE_FINETUNE_EPOCHS = 3
+PRUNE_LR = 0.002
+# Hyperparameter scan (run_all.py --hparam-scan): every combination below is trained as one
+# [K, 10, D] ensemble per method and ranked on val (float / quantized / noisy-quantized accuracy).
+# Results go to RESULTS_DIR/hparam_scan_<method>.csv. Empty HPARAM_SCAN_METHODS = all methods.
+HPARAM_SCAN_GRID = {
+    "lr": [0.005, 0.01, 0.02],
+    "momentum": [0.8, 0.9],
+    "noise_std": [0.0, 0.02, 0.05],
+    "ir_drop_coeff": [0.0, 0.05],
+}
+HPARAM_SCAN_METHODS = []
+HPARAM_SCAN_NOISE_TRIALS = 5
+# Event-camera input (event_stream.py): (x, y, t, p) .npy recordings binned into EVENT_TIMESTEPS
+# count frames, scaled by EVENT_COUNT_GAIN to uint8 and reduced with DOWNSAMPLE_METHODS[EVENT_METHOD].
+# EVENT_WINDOW = 0: one file is one sample; > 0: cut long recordings into windows of this many t units.
+EVENT_SENSOR_SIZE = (34, 34)    # (H, W), N-MNIST
+EVENT_TIMESTEPS = 8
+EVENT_WINDOW = 0
+EVENT_POLARITY = "sum"          # sum | on | off
+EVENT_COUNT_GAIN = 32
+EVENT_METHOD = "avgpool_8x8"
+EVENT_CHUNK_EVENTS = 1 << 20
+EVENT_BATCH_SIZE = 256
 
 # =====================================================
 # 蹇€熸ā寮?(--quick 鍛戒护琛屽弬鏁版椂浣跨敤)
@@ -14,11 +14,18 @@
 """
 
 import os
+import gzip
+import json
+from collections.abc import Mapping
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
-from torchvision import datasets, transforms
 from torch.utils.data import DataLoader, TensorDataset
 import config as cfg
 
@@ -150,6 +157,13 @@ def _stratified_train_val_split(labels, val_size, seed):
     return train_idx, val_idx
 
 
+def _pca_mode():
+    mode = str(getattr(cfg, "PROJ_PCA_MODE", "lowrank")).strip().lower()
+    if mode not in ("lowrank", "streaming"):
+        raise ValueError(f"不支持的 PROJ_PCA_MODE: {mode} (可选 lowrank | streaming)")
+    return mode
+
+
 def _compute_pca_basis(train_x, out_dim, max_samples=None, center=True, generator=None):
     if max_samples is not None and max_samples > 0 and train_x.shape[0] > max_samples:
         if generator is None:
@@ -167,11 +181,76 @@ def _compute_pca_basis(train_x, out_dim, max_samples=None, center=True, generato
         mean = torch.zeros(train_x.shape[1], dtype=train_x.dtype)
 
     q = min(out_dim, x_use.shape[1])
+    # pca_lowrank 是随机算法：用固定种子且不消耗全局 RNG，缓存命中与否后续训练完全一致
+    rng_state = torch.random.get_rng_state()
+    torch.manual_seed(cfg.RANDOM_SEED + 654)
     _, _, v = torch.pca_lowrank(x_use, q=q, center=False)
+    torch.random.set_rng_state(rng_state)
     components = v[:, :out_dim]  # [D, out_dim]
     return mean, components
 
 
+def _iter_row_chunks(x, chunk_size, dtype=torch.float64):
+    """按行切块产出 [n, D] 浮点矩阵；uint8 图像 (如 [N, 28, 28]) 按块展平并 /255，不建整份 float 副本。"""
+    chunk_size = max(1, int(chunk_size))
+    for start in range(0, x.shape[0], chunk_size):
+        chunk = torch.as_tensor(x[start:start + chunk_size])
+        chunk = chunk.reshape(chunk.shape[0], -1)
+        if chunk.dtype == torch.uint8:
+            chunk = chunk.to(dtype) / 255.0
+        else:
+            chunk = chunk.to(dtype)
+        yield chunk
+
+
+def streaming_pca_basis(chunks, out_dim, center=True):
+    """
+    流式 PCA：逐块累加 Σx 和 ΣxxT (float64)，最后对 D×D 协方差矩阵做 eigh。
+    内存只取决于特征维 D 和块大小，与样本数无关，可以吃下整个训练集或更大的本地数据。
+    结果确定：同样的数据和分块顺序得到同样的分量；每个分量绝对值最大的元素取正号。
+    返回 (mean[D], components[D, out_dim])，均为 float32，与 _compute_pca_basis 格式一致。
+    """
+    n = 0
+    total = None
+    gram = None
+    for chunk in chunks:
+        chunk = chunk.to(torch.float64)
+        if total is None:
+            dim = chunk.shape[1]
+            total = torch.zeros(dim, dtype=torch.float64)
+            gram = torch.zeros(dim, dim, dtype=torch.float64)
+        n += chunk.shape[0]
+        total += chunk.sum(dim=0)
+        gram += chunk.t() @ chunk
+    if n == 0:
+        raise ValueError("streaming_pca_basis: 没有样本")
+
+    if center:
+        mean = total / n
+        cov = gram - n * torch.outer(mean, mean)
+    else:
+        mean = torch.zeros_like(total)
+        cov = gram
+    cov = 0.5 * (cov + cov.t())
+
+    q = min(int(out_dim), cov.shape[0])
+    _, evecs = torch.linalg.eigh(cov)          # 特征值升序
+    components = evecs[:, -q:].flip(1)         # 取最大的 q 个，按方差降序
+    pivot = components.abs().argmax(dim=0)
+    signs = torch.sign(components[pivot, torch.arange(q)])
+    signs[signs == 0] = 1.0
+    components = components * signs
+    return mean.float(), components.float()
+
+
+def _project_rows(x, mean, components, chunk_size):
+    """按块计算 (x - mean) @ components，x 可以是 uint8 图像。"""
+    if x is None:
+        return None
+    parts = [(chunk - mean) @ components for chunk in _iter_row_chunks(x, chunk_size, torch.float32)]
+    return torch.cat(parts, dim=0)
+
+
 def _scale_projected_features(train_feat, test_feat, val_feat=None):
     method = getattr(cfg, "PROJ_SCALE_METHOD", "minmax")
     if method == "p99":
@@ -254,26 +333,302 @@ def _save_projection_params(method_name, params):
     return path
 
 
-def prepare_all_datasets(quick_mode=False):
+# ---- MNIST 原始 IDX 文件读取 (不依赖 torchvision) ----
+# IDX 格式: 2 字节 0 + 1 字节数据类型 (0x08 = uint8) + 1 字节维数 n，随后 n 个大端 uint32 维度，
+# 再是按行优先存放的数据。文件直接 np.memmap (写时复制)，torch.from_numpy 零拷贝。
+
+_IDX_UINT8 = 0x08
+_MNIST_FILES = {
+    True: ("train-images-idx3-ubyte", "train-labels-idx1-ubyte"),
+    False: ("t10k-images-idx3-ubyte", "t10k-labels-idx1-ubyte"),
+}
+
+
+def _mnist_raw_dir(root=None):
+    return os.path.join(root if root is not None else cfg.DATA_DIR, "MNIST", "raw")
+
+
+def _ensure_idx_file(path):
+    """原始文件不存在但有 .gz 时解压一次（写临时文件再 rename）；都没有返回 False。"""
+    if os.path.exists(path):
+        return True
+    gz_path = path + ".gz"
+    if not os.path.exists(gz_path):
+        return False
+    tmp_path = path + f".tmp{os.getpid()}"
+    with gzip.open(gz_path, "rb") as src, open(tmp_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(tmp_path, path)
+    return True
+
+
+def read_idx_file(path, expected_ndim=None):
     """
-    Prepare all datasets for each downsample method.
+    内存映射一个 uint8 IDX 文件，校验魔数、维数和文件长度。
+    返回 torch.uint8 张量（与 np.memmap 共享内存，写时复制，不会改动磁盘文件）。
     """
-    print("\n[Step 1/4] Prepare MNIST data...")
+    with open(path, "rb") as f:
+        header = f.read(4)
+        if len(header) != 4 or header[0] != 0 or header[1] != 0:
+            raise ValueError(f"not an IDX file: {path}")
+        if header[2] != _IDX_UINT8:
+            raise ValueError(f"unsupported IDX data type 0x{header[2]:02x} (expected uint8): {path}")
+        ndim = header[3]
+        if expected_ndim is not None and ndim != expected_ndim:
+            raise ValueError(f"IDX file has {ndim} dims, expected {expected_ndim}: {path}")
+        dims_raw = f.read(4 * ndim)
+        if len(dims_raw) != 4 * ndim:
+            raise ValueError(f"truncated IDX header: {path}")
+    shape = tuple(int(d) for d in np.frombuffer(dims_raw, dtype=">u4"))
+    offset = 4 + 4 * ndim
+    expected_size = offset + int(np.prod(shape, dtype=np.int64))
+    actual_size = os.path.getsize(path)
+    if actual_size != expected_size:
+        raise ValueError(
+            f"IDX file size mismatch: {path} has {actual_size} bytes, header implies {expected_size}")
+    if 0 in shape:
+        return torch.empty(shape, dtype=torch.uint8)
+    return torch.from_numpy(np.memmap(path, dtype=np.uint8, mode="c", offset=offset, shape=shape))
+
+
+def load_mnist_raw(train=True, root=None):
+    """
+    读 MNIST 一个 split: 返回 (images uint8 [N, 28, 28]，与原始文件共享内存；labels int64 [N])。
+    只在原始文件 (或 .gz) 缺失时才用 torchvision 下载；已有文件时不会联网。
+    """
+    raw_dir = _mnist_raw_dir(root)
+    image_name, label_name = _MNIST_FILES[bool(train)]
+    image_path = os.path.join(raw_dir, image_name)
+    label_path = os.path.join(raw_dir, label_name)
+    if not (_ensure_idx_file(image_path) and _ensure_idx_file(label_path)):
+        from torchvision import datasets
+        print(f"  MNIST raw files not found in {raw_dir}, downloading via torchvision...")
+        datasets.MNIST(root if root is not None else cfg.DATA_DIR, train=bool(train), download=True)
+        if not (_ensure_idx_file(image_path) and _ensure_idx_file(label_path)):
+            raise FileNotFoundError(f"MNIST raw files still missing after download: {raw_dir}")
+    images = read_idx_file(image_path, expected_ndim=3)
+    labels = read_idx_file(label_path, expected_ndim=1).long()
+    if images.shape[0] != labels.shape[0]:
+        raise ValueError(
+            f"MNIST image/label count mismatch: {images.shape[0]} vs {labels.shape[0]} ({raw_dir})")
+    return images, labels
+
+
+# ---- 预处理结果磁盘缓存 ----
+# 每个方法的 uint8 train/val/test、标签、gain、scale 信息和投影参数按内容寻址存放在
+# DATASET_CACHE_DIR/<方法名>-<key>/ 下，key = 相关配置字段 + MNIST 原始文件内容的 sha256。
+# 配置或原始数据一变 key 就变，旧目录自然失效；.npy 以 mmap_mode='c' 打开 (写时复制，不改磁盘)。
+
+_CACHE_SPLITS = ("train", "val", "test")
+_RAW_DIGEST_CACHE = {}
+
+
+def _mnist_raw_digest():
+    """MNIST 原始 IDX 文件内容的 sha256；文件不全 (首次下载前) 时返回 None。"""
+    raw_dir = _mnist_raw_dir()
+    names = _MNIST_FILES[True] + _MNIST_FILES[False]
+    paths = [os.path.join(raw_dir, n) for n in names]
+    if not all(_ensure_idx_file(path) for path in paths):
+        return None
+    stamp = tuple((path, os.path.getsize(path), os.path.getmtime(path)) for path in paths)
+    hit = _RAW_DIGEST_CACHE.get(stamp)
+    if hit is not None:
+        return hit
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    _RAW_DIGEST_CACHE[stamp] = h.hexdigest()
+    return _RAW_DIGEST_CACHE[stamp]
+
+
+def _dataset_cache_key(name, target_size, method, quick_mode, raw_digest):
+    """单个方法的缓存 key: 只包含会改变该方法 uint8 输出的配置字段。"""
+    fields = {
+        "name": name,
+        "target_size": target_size,
+        "method": method,
+        "quick": bool(quick_mode),
+        "raw": raw_digest,
+        "seed": cfg.RANDOM_SEED,
+        "val_samples": int(getattr(cfg, "VAL_SAMPLES", 0) or 0),
+    }
+    if quick_mode:
+        fields["quick_test_samples"] = cfg.QUICK_TEST_SAMPLES
+        fields["quick_subset"] = "stratified"
+    if method in ("proj_pca", "proj_sup"):
+        keys = ["PROJ_DIM", "PROJ_SCALE_METHOD", "PROJ_SCALE_PERCENTILE"]
+        if method == "proj_pca":
+            keys += ["PROJ_PCA_CENTER"]
+            if _pca_mode() == "streaming":
+                keys += ["PROJ_PCA_MODE", "PROJ_PCA_CHUNK"]
+            else:
+                keys += ["PROJ_PCA_SAMPLES"]
+        else:
+            keys += ["PROJ_SUP_EPOCHS", "PROJ_SUP_LR", "PROJ_SUP_BATCH_SIZE", "PROJ_SUP_USE_BIAS",
+                     "ANN_BATCH_SIZE", "ANN_LR", "ANN_MOMENTUM"]
+    else:
+        keys = ["AUTO_INPUT_GAIN", "INPUT_GAIN_PERCENTILE", "INPUT_GAIN_MAX"]
+    fields["config"] = {k: getattr(cfg, k, None) for k in keys}
+    text = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:20]
+
+
+def _dataset_cache_path(name, key):
+    cache_dir = getattr(cfg, "DATASET_CACHE_DIR", os.path.join(cfg.DATA_DIR, "cache"))
+    return os.path.join(cache_dir, f"{name}-{key}")
+
+
+def _load_cached_method(path):
+    """读取缓存目录；不完整或损坏时返回 None。"""
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        entry = dict(meta)
+        for split in _CACHE_SPLITS:
+            if not meta["has_" + split]:
+                entry[split + "_flat"] = None
+                entry[split + "_labels"] = None
+                continue
+            entry[split + "_flat"] = torch.from_numpy(
+                np.load(os.path.join(path, f"{split}.npy"), mmap_mode="c"))
+            entry[split + "_labels"] = torch.from_numpy(
+                np.load(os.path.join(path, f"{split}_labels.npy"), mmap_mode="c"))
+        entry["proj_params"] = None
+        if meta["has_proj_params"]:
+            entry["proj_params"] = torch.load(os.path.join(path, "proj_params.pt"))
+    except (OSError, ValueError, KeyError, RuntimeError):
+        return None
+    return entry
+
+
+def _save_cached_method(path, entry):
+    """写缓存: 先写临时目录再整体 rename，中断不会留下半个缓存。"""
+    tmp_path = path + f".tmp{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    meta = {"input_dim": int(entry["input_dim"]), "gain": float(entry["gain"]),
+            "scale_info": entry["scale_info"], "has_proj_params": entry["proj_params"] is not None}
+    for split in _CACHE_SPLITS:
+        flat = entry[split + "_flat"]
+        meta["has_" + split] = flat is not None
+        if flat is None:
+            continue
+        np.save(os.path.join(tmp_path, f"{split}.npy"), flat.cpu().numpy().astype(np.uint8))
+        np.save(os.path.join(tmp_path, f"{split}_labels.npy"), entry[split + "_labels"].cpu().numpy())
+    if entry["proj_params"] is not None:
+        torch.save(entry["proj_params"], os.path.join(tmp_path, "proj_params.pt"))
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
 
-    train_mnist = datasets.MNIST(cfg.DATA_DIR, train=True, download=True)
-    test_mnist = datasets.MNIST(cfg.DATA_DIR, train=False, download=True)
+# ---------------------------------------------------------------------------
+# 分层嵌套评估子集（按 split 持久化的索引顺序）
+# ---------------------------------------------------------------------------
+_SUBSET_ORDERS = {}
 
-    train_images_28 = train_mnist.data
-    train_labels = train_mnist.targets
-    test_images_28 = test_mnist.data
-    test_labels = test_mnist.targets
+
+def _labels_digest(labels):
+    arr = np.ascontiguousarray(torch.as_tensor(labels).cpu().numpy().astype(np.int64))
+    return hashlib.sha256(arr.tobytes()).hexdigest()[:16]
+
+
+def _stratified_order(labels, seed):
+    """
+    每类内部随机排列，再按 (类内名次 + 随机相位) / 类样本数 交错排序：
+    任意前 n 个都近似按类别比例分层，不同 n 的子集天然嵌套。
+    """
+    labels_np = torch.as_tensor(labels).cpu().numpy()
+    rng = np.random.default_rng(seed)
+    key = np.empty(labels_np.shape[0], dtype=np.float64)
+    for c in np.unique(labels_np):
+        members = rng.permutation(np.flatnonzero(labels_np == c))
+        key[members] = (np.arange(members.size) + rng.random()) / members.size
+    return np.argsort(key, kind="stable").astype(np.int64)
+
+
+def subset_order(labels, split="val", seed=None):
+    """
+    split 的分层评估顺序 (LongTensor [N])；按 (split, 标签内容, seed) 存在 SUBSET_INDEX_DIR，
+    跨进程、跨方法（同一 split 标签相同）复用，同样的输入总是得到同样的顺序。
+    """
+    if seed is None:
+        seed = int(getattr(cfg, "RANDOM_SEED", 42)) + 20260207
+    key = (str(split), _labels_digest(labels), int(seed))
+    order = _SUBSET_ORDERS.get(key)
+    if order is not None:
+        return order
+
+    n = int(torch.as_tensor(labels).shape[0])
+    path = os.path.join(getattr(cfg, "SUBSET_INDEX_DIR", os.path.join(cfg.DATA_DIR, "subsets")),
+                        f"{key[0]}_{key[1]}_{key[2]}.npy")
+    order_np = None
+    if os.path.exists(path):
+        try:
+            order_np = np.load(path)
+            if order_np.shape != (n,):
+                order_np = None
+        except (OSError, ValueError):
+            order_np = None
+    if order_np is None:
+        order_np = _stratified_order(labels, seed)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + f".tmp{os.getpid()}.npy"
+            np.save(tmp_path, order_np)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            print(f"  [WARNING] subset index write failed for {path}: {exc}")
+    order = _SUBSET_ORDERS[key] = torch.from_numpy(order_np)
+    return order
+
+
+def resolve_subset_size(size):
+    """子集大小：整数，或 EVAL_SUBSET_SIZES 中的名字；0 / None = 整个 split。"""
+    if isinstance(size, str) and size.strip().isdigit():
+        size = int(size)
+    if isinstance(size, str):
+        names = getattr(cfg, "EVAL_SUBSET_SIZES", {})
+        if size not in names:
+            raise KeyError(f"unknown eval subset: {size} (EVAL_SUBSET_SIZES={sorted(names)})")
+        size = names[size]
+    return int(size or 0)
+
+
+def eval_subset_indices(labels, size, split="val", seed=None):
+    """前 size 个分层索引；size 为 0 / 'full' 或不小于样本数时返回 None（用整个 split）。"""
+    size = resolve_subset_size(size)
+    n = int(torch.as_tensor(labels).shape[0])
+    if size <= 0 or size >= n:
+        return None
+    return subset_order(labels, split, seed)[:size]
+
+
+def take_eval_subset(images, labels, size, split="val", seed=None):
+    """(images, labels) 的嵌套分层子集；整个 split 时原样返回。"""
+    idx = eval_subset_indices(labels, size, split, seed)
+    if idx is None:
+        return images, labels
+    return images[idx], labels[idx]
+
+
+def _load_mnist_splits(quick_mode):
+    """读 MNIST、quick 截断、分层划分 train/val；返回 dict (val 可能为 None)。"""
+    train_images_28, train_labels = load_mnist_raw(train=True)
+    test_images_28, test_labels = load_mnist_raw(train=False)
 
     if quick_mode:
+        # 分层子集（不是前 n 张），quick 结果的类别分布与完整数据一致
         n = cfg.QUICK_TEST_SAMPLES
-        test_images_28 = test_images_28[:n]
-        test_labels = test_labels[:n]
-        train_images_28 = train_images_28[:n * 10]
-        train_labels = train_labels[:n * 10]
+        test_images_28, test_labels = take_eval_subset(test_images_28, test_labels, n, split="mnist_test")
+        train_images_28, train_labels = take_eval_subset(
+            train_images_28, train_labels, n * 10, split="mnist_train")
 
     # Stratified train/val split (for threshold calibration)
     val_images_28 = None
@@ -290,23 +645,46 @@ def prepare_all_datasets(quick_mode=False):
         train_images_28 = train_images_28[train_idx]
         train_labels = train_labels[train_idx]
 
-    all_datasets = {}
-
-    proj_methods = {"proj_pca", "proj_sup"}
-    need_proj = any(method in proj_methods for _, method in cfg.DOWNSAMPLE_METHODS.values())
-    if need_proj:
-        train_flat_784 = _flatten_images(train_images_28)
-        test_flat_784 = _flatten_images(test_images_28)
-        val_flat_784 = _flatten_images(val_images_28) if val_images_28 is not None else None
-
-    for name, (target_size, method) in cfg.DOWNSAMPLE_METHODS.items():
-        scale_info = None
-        scale_params = None
-        proj_param_path = None
-
-        if method in proj_methods:
-            proj_dim = int(getattr(cfg, "PROJ_DIM", target_size))
-            if method == "proj_pca":
+    return {
+        "train_images_28": train_images_28, "train_labels": train_labels,
+        "val_images_28": val_images_28, "val_labels": val_labels,
+        "test_images_28": test_images_28, "test_labels": test_labels,
+    }
+
+
+def _flat_784(split, which):
+    """投影方法共用的 [N, 784] float 输入（每个 split 只展平一次）。"""
+    key = which + "_flat_784"
+    if key not in split:
+        images = split[which + "_images_28"]
+        split[key] = _flatten_images(images) if images is not None else None
+    return split[key]
+
+
+def _prepare_method(name, target_size, method, split, quick_mode):
+    """对一个降采样方法做预处理，返回可写入缓存的 entry dict。"""
+    train_labels = split["train_labels"]
+    scale_info = None
+    proj_params = None
+
+    if method in ("proj_pca", "proj_sup"):
+        proj_dim = int(getattr(cfg, "PROJ_DIM", target_size))
+        if method == "proj_pca":
+            if _pca_mode() == "streaming":
+                # 直接从 uint8 图像分块累加协方差，不需要 [N, 784] float 副本
+                chunk = int(getattr(cfg, "PROJ_PCA_CHUNK", 8192))
+                mean, components = streaming_pca_basis(
+                    _iter_row_chunks(split["train_images_28"], chunk),
+                    proj_dim,
+                    center=bool(getattr(cfg, "PROJ_PCA_CENTER", True)),
+                )
+                train_feat = _project_rows(split["train_images_28"], mean, components, chunk)
+                test_feat = _project_rows(split["test_images_28"], mean, components, chunk)
+                val_feat = _project_rows(split["val_images_28"], mean, components, chunk)
+            else:
+                train_flat_784 = _flat_784(split, "train")
+                test_flat_784 = _flat_784(split, "test")
+                val_flat_784 = _flat_784(split, "val")
                 gen = torch.Generator().manual_seed(cfg.RANDOM_SEED + 321)
                 mean, components = _compute_pca_basis(
                     train_flat_784,
@@ -318,95 +696,303 @@ def prepare_all_datasets(quick_mode=False):
                 train_feat = (train_flat_784 - mean) @ components
                 test_feat = (test_flat_784 - mean) @ components
                 val_feat = (val_flat_784 - mean) @ components if val_flat_784 is not None else None
-                train_flat, test_flat, val_flat, scale_info, scale_params = _scale_projected_features(
-                    train_feat, test_feat, val_feat
-                )
-                proj_param_path = _save_projection_params(name, {
-                    "method": "proj_pca",
-                    "proj_dim": proj_dim,
-                    "mean": mean,
-                    "components": components,
-                    "scale_params": scale_params,
-                    "center": bool(getattr(cfg, "PROJ_PCA_CENTER", True)),
-                })
-            else:
-                W_proj, b_proj = _train_supervised_projection(
-                    train_flat_784, train_labels, proj_dim, quick_mode=quick_mode
-                )
-                train_feat = train_flat_784 @ W_proj.t()
-                test_feat = test_flat_784 @ W_proj.t()
-                val_feat = val_flat_784 @ W_proj.t() if val_flat_784 is not None else None
-                if b_proj is not None:
-                    train_feat = train_feat + b_proj
-                    test_feat = test_feat + b_proj
-                    if val_feat is not None:
-                        val_feat = val_feat + b_proj
-                train_flat, test_flat, val_flat, scale_info, scale_params = _scale_projected_features(
-                    train_feat, test_feat, val_feat
-                )
-                proj_param_path = _save_projection_params(name, {
-                    "method": "proj_sup",
-                    "proj_dim": proj_dim,
-                    "weight": W_proj,
-                    "bias": b_proj,
-                    "scale_params": scale_params,
-                })
-
-            gain = 1.0
-            input_dim = proj_dim
+            train_flat, test_flat, val_flat, scale_info, scale_params = _scale_projected_features(
+                train_feat, test_feat, val_feat
+            )
+            proj_params = {
+                "method": "proj_pca",
+                "proj_dim": proj_dim,
+                "mean": mean,
+                "components": components,
+                "scale_params": scale_params,
+                "center": bool(getattr(cfg, "PROJ_PCA_CENTER", True)),
+            }
         else:
-            train_flat = downsample_batch(train_images_28, target_size, method)
-            test_flat = downsample_batch(test_images_28, target_size, method)
-            val_flat = downsample_batch(val_images_28, target_size, method) if val_images_28 is not None else None
-
-            # Optional input gain (contrast stretch)
-            gain = 1.0
-            if getattr(cfg, 'AUTO_INPUT_GAIN', False):
-                try:
-                    p = torch.quantile(train_flat.float(), float(cfg.INPUT_GAIN_PERCENTILE))
-                    if p > 1.0:
-                        gain = min(float(cfg.INPUT_GAIN_MAX), 255.0 / float(p))
-                except Exception as _gain_err:
-                    print(f"  [WARNING] AUTO_INPUT_GAIN: gain calculation failed ({_gain_err}), using gain=1.0")
-                    gain = 1.0
-            if gain > 1.0 + 1e-6:
-                train_flat = torch.clamp(train_flat.float() * gain, 0, 255).round().byte()
-                test_flat = torch.clamp(test_flat.float() * gain, 0, 255).round().byte()
-                if val_flat is not None:
-                    val_flat = torch.clamp(val_flat.float() * gain, 0, 255).round().byte()
-
-            input_dim = target_size * target_size
-
-        train_loader = DataLoader(
-            TensorDataset(train_flat.float() / 255.0, train_labels),
+            train_flat_784 = _flat_784(split, "train")
+            test_flat_784 = _flat_784(split, "test")
+            val_flat_784 = _flat_784(split, "val")
+            W_proj, b_proj = _train_supervised_projection(
+                train_flat_784, train_labels, proj_dim, quick_mode=quick_mode
+            )
+            train_feat = train_flat_784 @ W_proj.t()
+            test_feat = test_flat_784 @ W_proj.t()
+            val_feat = val_flat_784 @ W_proj.t() if val_flat_784 is not None else None
+            if b_proj is not None:
+                train_feat = train_feat + b_proj
+                test_feat = test_feat + b_proj
+                if val_feat is not None:
+                    val_feat = val_feat + b_proj
+            train_flat, test_flat, val_flat, scale_info, scale_params = _scale_projected_features(
+                train_feat, test_feat, val_feat
+            )
+            proj_params = {
+                "method": "proj_sup",
+                "proj_dim": proj_dim,
+                "weight": W_proj,
+                "bias": b_proj,
+                "scale_params": scale_params,
+            }
+
+        gain = 1.0
+        input_dim = proj_dim
+    else:
+        train_images_28 = split["train_images_28"]
+        val_images_28 = split["val_images_28"]
+        train_flat = downsample_batch(train_images_28, target_size, method)
+        test_flat = downsample_batch(split["test_images_28"], target_size, method)
+        val_flat = downsample_batch(val_images_28, target_size, method) if val_images_28 is not None else None
+
+        # Optional input gain (contrast stretch)
+        gain = 1.0
+        if getattr(cfg, 'AUTO_INPUT_GAIN', False):
+            try:
+                p = torch.quantile(train_flat.float(), float(cfg.INPUT_GAIN_PERCENTILE))
+                if p > 1.0:
+                    gain = min(float(cfg.INPUT_GAIN_MAX), 255.0 / float(p))
+            except Exception as _gain_err:
+                print(f"  [WARNING] AUTO_INPUT_GAIN: gain calculation failed ({_gain_err}), using gain=1.0")
+                gain = 1.0
+        if gain > 1.0 + 1e-6:
+            train_flat = torch.clamp(train_flat.float() * gain, 0, 255).round().byte()
+            test_flat = torch.clamp(test_flat.float() * gain, 0, 255).round().byte()
+            if val_flat is not None:
+                val_flat = torch.clamp(val_flat.float() * gain, 0, 255).round().byte()
+
+        input_dim = target_size * target_size
+
+    return {
+        "train_flat": train_flat, "train_labels": train_labels,
+        "val_flat": val_flat, "val_labels": split["val_labels"] if val_flat is not None else None,
+        "test_flat": test_flat, "test_labels": split["test_labels"],
+        "input_dim": input_dim, "gain": gain, "scale_info": scale_info,
+        "proj_params": proj_params,
+    }
+
+
+def resolve_prep_workers(num_jobs, workers=None):
+    """
+    数据预处理线程数: workers (默认 cfg.DATA_PREP_WORKERS)；0 = 顺序执行，负数 = 全部核。
+    不会超过任务数，也不会超过 CPU 核数。
+    """
+    if workers is None:
+        workers = int(getattr(cfg, "DATA_PREP_WORKERS", 0))
+    cores = os.cpu_count() or 1
+    if workers < 0:
+        workers = cores
+    return max(0, min(int(workers), int(num_jobs), cores))
+
+
+class Uint8TensorDataset(TensorDataset):
+    """
+    (uint8 输入, 标签) 的 TensorDataset：只常驻 uint8 张量，取样本 / batch 时才转成 [0, 1] float
+    （与预先 .float() / 255.0 逐位相同）。tensors 仍是底层 (uint8, labels)，
+    需要整份 float 输入的快速路径用 float_tensors() 取一次性副本。
+    """
+    @staticmethod
+    def batch_to_float(x):
+        return x.float() / 255.0
+
+    def __getitem__(self, index):
+        images, labels = self.tensors[:2]
+        return self.batch_to_float(images[index]), labels[index]
+
+    def float_tensors(self):
+        images, labels = self.tensors[:2]
+        return self.batch_to_float(images), labels
+
+
+_FLOAT_KEYS = ("train_loader", "test_loader_float", "val_loader_float")
+
+
+class DatasetEntry(dict):
+    """
+    单个方法的数据集 dict。train_loader / test_loader_float / val_loader_float 在第一次访问时
+    才创建，底层是 Uint8TensorDataset：只引用 uint8 张量，float batch 在迭代时即时生成，
+    不再常驻 float 副本。release_float() 后再访问会重新创建。
+    """
+    def __missing__(self, key):
+        if key not in _FLOAT_KEYS:
+            raise KeyError(key)
+        self._build_float()
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _build_float(self):
+        self["train_loader"] = DataLoader(
+            Uint8TensorDataset(self["train_images_uint8"], self["train_labels"]),
             batch_size=cfg.ANN_BATCH_SIZE, shuffle=True
         )
-
-        test_loader_float = DataLoader(
-            TensorDataset(test_flat.float() / 255.0, test_labels),
+        self["test_loader_float"] = DataLoader(
+            Uint8TensorDataset(self["test_images_uint8"], self["test_labels"]),
             batch_size=cfg.ANN_BATCH_SIZE, shuffle=False
         )
         val_loader_float = None
-        if val_flat is not None and val_labels is not None:
+        if self["val_images_uint8"] is not None and self["val_labels"] is not None:
             val_loader_float = DataLoader(
-                TensorDataset(val_flat.float() / 255.0, val_labels),
+                Uint8TensorDataset(self["val_images_uint8"], self["val_labels"]),
                 batch_size=cfg.ANN_BATCH_SIZE, shuffle=False
             )
+        self["val_loader_float"] = val_loader_float
+
+    def release_float(self):
+        """丢掉 loader 对象（uint8 张量仍保留）。"""
+        for key in _FLOAT_KEYS:
+            self.pop(key, None)
+
 
-        all_datasets[name] = {
-            'train_loader':      train_loader,
-            'train_images_uint8': train_flat,
+class LazyDatasets(Mapping):
+    """
+    按方法惰性构建的数据集表（prepare_all_datasets 的返回值）。
+
+    - 键为 DOWNSAMPLE_METHODS 中的方法名（可用 methods 过滤），遍历键不会触发构建
+    - 某个方法第一次被访问时才读缓存或做预处理；各方法共享一次 MNIST 读取与 train/val 划分，
+      全部方法都构建后共享的 28×28 / 784 维数据随即释放
+    - input_dim(name) 不需要构建即可得到
+    """
+    def __init__(self, quick_mode=False, methods=None):
+        specs = dict(cfg.DOWNSAMPLE_METHODS)
+        if methods is not None:
+            wanted = set(methods)
+            unknown = sorted(wanted - set(specs))
+            if unknown:
+                raise KeyError(f"unknown downsample methods: {unknown}")
+            specs = {name: spec for name, spec in specs.items() if name in wanted}
+        self.quick_mode = bool(quick_mode)
+        self._specs = specs
+        self._use_cache = bool(getattr(cfg, "DATASET_CACHE_ENABLE", True))
+        self._raw_digest = _mnist_raw_digest() if self._use_cache else None
+        self._split = None
+        self._split_lock = threading.Lock()
+        self._entries = {}
+        self._prebuilt = {}
+
+    def __len__(self):
+        return len(self._specs)
+
+    def __iter__(self):
+        return iter(self._specs)
+
+    def __contains__(self, name):
+        return name in self._specs
+
+    def __getitem__(self, name):
+        if name not in self._specs:
+            raise KeyError(name)
+        entry = self._entries.get(name)
+        if entry is None:
+            entry = self._entries[name] = self._build(name)
+            if len(self._entries) == len(self._specs):
+                self.release_split()
+        return entry
+
+    def input_dim(self, name):
+        target_size, method = self._specs[name]
+        if method in ("proj_pca", "proj_sup"):
+            return int(getattr(cfg, "PROJ_DIM", target_size))
+        return int(target_size * target_size)
+
+    def materialize(self):
+        """立即构建全部方法（按配置顺序打印）；非投影方法先在线程池里并行读缓存/预处理。"""
+        self._prebuild_parallel([name for name in self._specs if name not in self._entries])
+        for name in self._specs:
+            self[name]
+        return self
+
+    def _prebuild_parallel(self, names):
+        """
+        非投影方法的降采样与增益估计互相独立且是确定性的 (torch 算子会释放 GIL)，
+        用 DATA_PREP_WORKERS 个线程并行算好后暂存；打印与投影参数写出仍由 _build 按配置顺序完成。
+        投影方法 (proj_sup 依赖全局 RNG) 保持顺序构建。
+        """
+        names = [name for name in names if self._specs[name][1] not in ("proj_pca", "proj_sup")]
+        workers = resolve_prep_workers(len(names))
+        if workers <= 1:
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(self._load_or_prepare, names))
+        self._prebuilt.update(zip(names, results))
+
+    def release_float(self, names=None):
+        """释放已构建方法的 float loader；之后访问会按需重建。"""
+        for name in (self._entries if names is None else names):
+            if name in self._entries:
+                self._entries[name].release_float()
+
+    def release_split(self):
+        """释放共享的 MNIST 原图与 784 维展平数据。"""
+        self._split = None
+
+    def release(self, name):
+        """整个丢掉某方法（再次访问时从磁盘缓存重新读取）。"""
+        self._entries.pop(name, None)
+
+    def _shared_split(self):
+        with self._split_lock:
+            if self._split is None:
+                self._split = _load_mnist_splits(self.quick_mode)
+                if self._use_cache and self._raw_digest is None:
+                    # 首次运行刚下载完原始文件
+                    self._raw_digest = _mnist_raw_digest()
+            return self._split
+
+    def _cache_path(self, name):
+        if not self._use_cache or self._raw_digest is None:
+            return None
+        target_size, method = self._specs[name]
+        return _dataset_cache_path(
+            name, _dataset_cache_key(name, target_size, method, self.quick_mode, self._raw_digest))
+
+    def _load_or_prepare(self, name):
+        """读缓存，未命中则预处理并写缓存；返回 (entry, from_cache, warning)。不打印，可在线程里调用。"""
+        target_size, method = self._specs[name]
+        cache_path = self._cache_path(name)
+        entry = _load_cached_method(cache_path) if cache_path is not None else None
+        if entry is not None:
+            return entry, True, None
+
+        entry = _prepare_method(name, target_size, method, self._shared_split(), self.quick_mode)
+        warning = None
+        cache_path = self._cache_path(name)
+        if cache_path is not None:
+            try:
+                _save_cached_method(cache_path, entry)
+            except OSError as exc:
+                warning = f"  [WARNING] dataset cache write failed for {name}: {exc}"
+        return entry, False, warning
+
+    def _build(self, name):
+        prebuilt = self._prebuilt.pop(name, None)
+        entry, from_cache, warning = prebuilt if prebuilt is not None else self._load_or_prepare(name)
+        if warning:
+            print(warning)
+
+        proj_param_path = None
+        if entry["proj_params"] is not None:
+            # 投影参数总是写到当前 WEIGHTS_DIR（flash_preprocess 等按 WEIGHTS_DIR 读取）
+            proj_param_path = _save_projection_params(name, entry["proj_params"])
+
+        train_labels, test_labels, val_labels = (
+            entry["train_labels"], entry["test_labels"], entry["val_labels"])
+        input_dim = int(entry["input_dim"])
+        gain = float(entry["gain"])
+        scale_info = entry["scale_info"]
+
+        ds = DatasetEntry({
+            'train_images_uint8': entry["train_flat"],
             'train_labels':       train_labels,
-            'test_images_uint8': test_flat,
+            'test_images_uint8': entry["test_flat"],
             'test_labels':       test_labels,
-            'val_images_uint8':  val_flat,
+            'val_images_uint8':  entry["val_flat"],
             'val_labels':        val_labels,
-            'test_loader_float': test_loader_float,
-            'val_loader_float':  val_loader_float,
             'input_dim':         input_dim,
             'input_gain':        gain,
             'proj_params_path':  proj_param_path,
-        }
+        })
 
         msg = (
             f"  {name:20s} ({input_dim} dims): "
@@ -415,6 +1001,21 @@ def prepare_all_datasets(quick_mode=False):
         )
         if scale_info is not None:
             msg += f", scale={scale_info}"
+        if from_cache:
+            msg += " [cached]"
         print(msg)
+        return ds
 
-    return all_datasets
+
+def prepare_all_datasets(quick_mode=False, methods=None):
+    """
+    Prepare datasets for each downsample method (optionally only `methods`).
+
+    Returns a LazyDatasets mapping: a method is built on first access, all methods share one
+    MNIST load / train-val split, and float loaders are created only when first used.
+    Each method's uint8 splits, gain, scale info and projection params are cached on disk
+    (DATASET_CACHE_ENABLE / DATASET_CACHE_DIR), keyed by the relevant config fields and the
+    MNIST raw files; when every requested method hits, MNIST is not even loaded.
+    """
+    print("\n[Step 1/4] Prepare MNIST data...")
+    return LazyDatasets(quick_mode=quick_mode, methods=methods)
@@ -0,0 +1,227 @@
+"""
+==========================================================
+  SNN SoC Python 建模 - 事件流数据接入
+==========================================================
+功能：
+  1. 读取事件相机录制 (x, y, t, polarity)，按时间分成 T 帧事件计数图
+  2. 计数图按 DOWNSAMPLE_METHODS 中的方法降采样或投影到 64 (或 49) 维 WL 输入
+  3. 输出 uint8 [N, T, D]（snn_inference 可直接使用）或 bit-plane [N, T, PIXEL_BITS, D]
+
+文件格式：NumPy .npy，结构化数组 (字段 x, y, t, p) 或整数数组 [M, 4] (列依次为 x, y, t, p)，
+按 t 升序。文件用 mmap 打开、按 EVENT_CHUNK_EVENTS 条一块读取，多 GB 的录制也不会整体读入内存。
+
+样本划分：
+  - window=0:  整个文件是一个样本（如 N-MNIST 每个样本一个文件），时长均分成 T 帧
+  - window>0:  长录制按固定时长 window (与 t 同单位) 切成连续样本，每个样本再均分成 T 帧
+"""
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import config as cfg
+import data_utils
+
+EVENT_FIELDS = ("x", "y", "t", "p")
+
+
+def _event_columns(events, start, stop):
+    """取 [start, stop) 条事件，返回 int64 的 (x, y, t, p)。"""
+    block = events[start:stop]
+    if block.dtype.names is not None:
+        missing = [f for f in EVENT_FIELDS if f not in block.dtype.names]
+        if missing:
+            raise ValueError(f"event file is missing fields: {missing}")
+        return tuple(np.asarray(block[f], dtype=np.int64) for f in EVENT_FIELDS)
+    block = np.asarray(block, dtype=np.int64)
+    return block[:, 0], block[:, 1], block[:, 2], block[:, 3]
+
+
+def open_events(path):
+    """mmap 打开事件文件并检查格式；返回 numpy memmap。"""
+    events = np.load(path, mmap_mode="r")
+    if events.dtype.names is None and (events.ndim != 2 or events.shape[1] != 4):
+        raise ValueError(f"{path}: expected a structured (x, y, t, p) array or [M, 4], got {events.shape}")
+    return events
+
+
+def iter_event_chunks(path, chunk_events=None):
+    """逐块产出 (x, y, t, p)，每块最多 chunk_events 条。"""
+    if chunk_events is None:
+        chunk_events = int(getattr(cfg, "EVENT_CHUNK_EVENTS", 1 << 20))
+    events = open_events(path)
+    last_t = None
+    for start in range(0, events.shape[0], max(1, int(chunk_events))):
+        x, y, t, p = _event_columns(events, start, start + chunk_events)
+        if t.size and ((last_t is not None and t[0] < last_t) or np.any(np.diff(t) < 0)):
+            raise ValueError(f"{path}: events must be sorted by t")
+        if t.size:
+            last_t = t[-1]
+        yield x, y, t, p
+
+
+def iter_event_windows(path, window, chunk_events=None):
+    """
+    长录制按固定时长切样本：对每个窗口 yield (x, y, t_rel, p)，t_rel 相对窗口起点；
+    窗口从第一条事件开始连续编号，没有事件的窗口也会产出（空数组）。
+    """
+    window = int(window)
+    if window <= 0:
+        raise ValueError(f"window must be positive: {window}")
+    t0 = None
+    next_win = 0
+    pending = None
+    for x, y, t, p in iter_event_chunks(path, chunk_events):
+        if t.size == 0:
+            continue
+        if t0 is None:
+            t0 = int(t[0])
+        if pending is not None:
+            x, y, t, p = (np.concatenate([a, b]) for a, b in zip(pending, (x, y, t, p)))
+        win = (t - t0) // window
+        last = int(win[-1])                      # 最后一个窗口可能延续到下一块
+        for w in range(next_win, last):
+            s, e = np.searchsorted(win, [w, w + 1])
+            yield x[s:e], y[s:e], t[s:e] - t0 - w * window, p[s:e]
+        s = int(np.searchsorted(win, last))
+        pending = (x[s:], y[s:], t[s:], p[s:])
+        next_win = last
+    if pending is not None:
+        x, y, t, p = pending
+        yield x, y, t - t0 - next_win * window, p
+
+
+def bin_events(x, y, t_rel, p, duration, timesteps=None, sensor_size=None, polarity=None):
+    """
+    事件 → 计数图 int64 [T, H, W]。t_rel ∈ [0, duration) 均分成 T 段；
+    polarity: 'sum' (两种极性都计) | 'on' (p > 0) | 'off' (p <= 0)。超出传感器范围的事件丢弃。
+    """
+    if timesteps is None:
+        timesteps = int(getattr(cfg, "EVENT_TIMESTEPS", 8))
+    if sensor_size is None:
+        sensor_size = getattr(cfg, "EVENT_SENSOR_SIZE", (34, 34))
+    if polarity is None:
+        polarity = getattr(cfg, "EVENT_POLARITY", "sum")
+    height, width = int(sensor_size[0]), int(sensor_size[1])
+    keep = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    if polarity == "on":
+        keep &= p > 0
+    elif polarity == "off":
+        keep &= p <= 0
+    elif polarity != "sum":
+        raise ValueError(f"unknown EVENT_POLARITY: {polarity}")
+    duration = max(1, int(duration))
+    frame = np.minimum(t_rel[keep] * timesteps // duration, timesteps - 1)
+    idx = (frame * height + y[keep]) * width + x[keep]
+    counts = np.bincount(idx, minlength=timesteps * height * width)
+    return counts.reshape(timesteps, height, width)
+
+
+def counts_to_uint8(counts, gain=None):
+    """计数图 → uint8 强度：min(count × EVENT_COUNT_GAIN, 255)。"""
+    if gain is None:
+        gain = float(getattr(cfg, "EVENT_COUNT_GAIN", 32))
+    return np.clip(np.asarray(counts, dtype=np.float64) * gain, 0, 255).round().astype(np.uint8)
+
+
+def reduce_frames(frames_uint8, method_name=None, proj_params=None):
+    """
+    uint8 [n, T, H, W] → uint8 [n, T, D]：按 DOWNSAMPLE_METHODS[method_name] 降采样，
+    投影方法先把帧缩放到 28×28 再用 flash_preprocess 的投影参数。
+    """
+    if method_name is None:
+        method_name = getattr(cfg, "EVENT_METHOD", "avgpool_8x8")
+    if method_name not in cfg.DOWNSAMPLE_METHODS:
+        raise KeyError(f"unknown downsample method: {method_name}")
+    target_size, method = cfg.DOWNSAMPLE_METHODS[method_name]
+    frames = torch.as_tensor(np.asarray(frames_uint8))
+    n, steps, height, width = frames.shape
+    flat = frames.reshape(n * steps, height, width)
+
+    if method in ("proj_pca", "proj_sup"):
+        import flash_preprocess
+        if (height, width) != (28, 28):
+            flat = F.interpolate(flat.float().unsqueeze(1), size=(28, 28), mode="bilinear",
+                                 align_corners=False).squeeze(1)
+            flat = torch.clamp(flat, 0, 255).round().byte()
+        out = flash_preprocess.project_and_quantize(flat, method_name, params=proj_params)
+    else:
+        out = data_utils.downsample_batch(flat, target_size, method)
+        if out.shape[1] != target_size * target_size:
+            raise ValueError(f"{method_name} does not support a {height}x{width} sensor")
+    return out.reshape(n, steps, -1)
+
+
+def to_bitplanes(frames_uint8, bits=None):
+    """uint8 [..., D] → 0/1 uint8 [..., bits, D]，第 0 个 plane 为 MSB（与 snn_inference 的 bit 顺序一致）。"""
+    if bits is None:
+        bits = cfg.PIXEL_BITS
+    x = torch.as_tensor(frames_uint8).long()
+    shifts = torch.arange(bits - 1, -1, -1).view(-1, 1)
+    return ((x.unsqueeze(-2) >> shifts) & 1).byte()
+
+
+def _emit(frames, method_name, proj_params, output):
+    out = reduce_frames(frames, method_name, proj_params)
+    if output == "bitplanes":
+        return to_bitplanes(out)
+    if output != "uint8":
+        raise ValueError(f"unknown output format: {output}")
+    return out
+
+
+def iter_event_frames(path, window=None, timesteps=None, sensor_size=None, polarity=None,
+                      method_name=None, proj_params=None, gain=None, batch_size=None,
+                      output="uint8", chunk_events=None):
+    """
+    事件文件 → 分批产出 uint8 [n, T, D]（output='bitplanes' 时为 [n, T, PIXEL_BITS, D]）。
+
+    window=0 时整个文件是一个样本（产出一批 n=1，帧时长 = 文件时长 / T）；
+    window>0 时按固定时长切成连续样本，每 batch_size 个样本产出一批。None = cfg.EVENT_WINDOW。
+    """
+    if window is None:
+        window = int(getattr(cfg, "EVENT_WINDOW", 0) or 0)
+    if timesteps is None:
+        timesteps = int(getattr(cfg, "EVENT_TIMESTEPS", 8))
+    if batch_size is None:
+        batch_size = int(getattr(cfg, "EVENT_BATCH_SIZE", 256))
+    binning = dict(timesteps=timesteps, sensor_size=sensor_size, polarity=polarity)
+
+    if window <= 0:
+        events = open_events(path)
+        if events.shape[0] == 0:
+            raise ValueError(f"{path}: no events")
+        t_first = int(_event_columns(events, 0, 1)[2][0])
+        t_last = int(_event_columns(events, events.shape[0] - 1, events.shape[0])[2][0])
+        duration = t_last - t_first + 1
+        counts = None
+        for x, y, t, p in iter_event_chunks(path, chunk_events):
+            part = bin_events(x, y, t - t_first, p, duration, **binning)
+            counts = part if counts is None else counts + part
+        yield _emit(counts_to_uint8(counts, gain)[None], method_name, proj_params, output)
+        return
+
+    batch = []
+    for x, y, t_rel, p in iter_event_windows(path, window, chunk_events):
+        batch.append(counts_to_uint8(bin_events(x, y, t_rel, p, window, **binning), gain))
+        if len(batch) == batch_size:
+            yield _emit(np.stack(batch), method_name, proj_params, output)
+            batch = []
+    if batch:
+        yield _emit(np.stack(batch), method_name, proj_params, output)
+
+
+def load_event_dataset(samples, **kwargs):
+    """
+    一文件一样本的数据集：samples 为 (path, label) 序列，返回 (uint8 [N, T, D], labels [N])。
+    其余参数同 iter_event_frames（window 固定为 0）。
+    """
+    kwargs["window"] = 0
+    frames, labels = [], []
+    for path, label in samples:
+        for batch in iter_event_frames(path, **kwargs):
+            frames.append(batch)
+            labels.extend([int(label)] * batch.shape[0])
+    if not frames:
+        raise ValueError("no event samples")
+    return torch.cat(frames, dim=0), torch.tensor(labels, dtype=torch.long)
@@ -17,6 +17,8 @@
       * interleaved(兼容旧格式):    col_pos=2*j, col_neg=2*j+1
   - level_pos/level_neg: 对应电导级编号
   - G_pos/G_neg: 目标电导值 (单位取决于器件模型, 通常是 S)
+  - --skip-zero: 差分对两个单元都停在擦除态 (最低电导级) 的行不导出，写阵列时直接跳过
+    (剪枝后的稀疏权重可以少编程很多单元)
 """
 
 import argparse
@@ -61,12 +63,13 @@ def _load_weight_tensor(method: str, weights_dir: str) -> torch.Tensor:
 def _get_level_table(device_sim, weight_bits: int, use_plugin_levels_4bit: bool) -> torch.Tensor:
     """
     构造电导级表:
-      - 4-bit 且允许时，优先使用器件离散级
+      - 位宽与电平表匹配 (默认 4-bit, 或优化电平表的位宽) 且允许时，使用离散级
+        (优化电平表优先于器件默认 log 间隔电平)
       - 其他情况，在线性区间 [g_min, g_max] 生成 2^bits 级
     """
-    if weight_bits == 4 and use_plugin_levels_4bit:
-        levels = torch.tensor(device_sim.conductance_levels, dtype=torch.float32)
-        levels = torch.sort(torch.unique(levels))[0]
+    table = snn_engine.get_device_level_table(device_sim, weight_bits)
+    if table is not None and use_plugin_levels_4bit:
+        levels = torch.sort(torch.unique(table.float()))[0]
         if levels.numel() < 2:
             raise RuntimeError("器件离散电导级数量异常，无法导出映射")
         return levels
@@ -81,8 +84,7 @@ def _get_level_table(device_sim, weight_bits: int, use_plugin_levels_4bit: bool)
 
 def _nearest_level_index(values: torch.Tensor, levels: torch.Tensor) -> torch.Tensor:
     """把 values 映射到最近的 level 索引。"""
-    diff = (values.unsqueeze(-1) - levels.view(1, 1, -1)).abs()
-    return diff.argmin(dim=-1)
+    return snn_engine.nearest_level_index(values, levels)
 
 
 def _resolve_diff_columns(j: int, num_outputs: int, col_map: str) -> Tuple[int, int]:
@@ -125,6 +127,7 @@ def export_weight_map(
     out_csv: str,
     weights_dir: str,
     col_map: str,
+    skip_zero: bool = False,
 ) -> None:
     w = _load_weight_tensor(method=method, weights_dir=weights_dir)
     num_outputs, num_inputs = int(w.shape[0]), int(w.shape[1])
@@ -151,6 +154,12 @@ def export_weight_map(
     idx_pos = _nearest_level_index(g_pos, levels)
     idx_neg = _nearest_level_index(g_neg, levels)
 
+    # 擦除态 = 最低电导级，停在擦除态的单元不需要编程
+    erased = int(torch.argmin(levels).item())
+    unprogrammed = int((idx_pos == erased).sum().item()) + int((idx_neg == erased).sum().item())
+    total_cells = 2 * num_outputs * num_inputs
+    skipped_rows = 0
+
     os.makedirs(os.path.dirname(out_csv) or ".", exist_ok=True)
     with open(out_csv, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
@@ -162,6 +171,9 @@ def export_weight_map(
                 j=j, num_outputs=num_outputs, col_map=col_map
             )
             for i in range(num_inputs):
+                if skip_zero and int(idx_pos[j, i]) == erased and int(idx_neg[j, i]) == erased:
+                    skipped_rows += 1
+                    continue
                 writer.writerow(
                     [
                         i,
@@ -182,6 +194,9 @@ def export_weight_map(
         print("  [WARN] interleaved 与当前 RTL 默认分组映射不一致，仅用于兼容旧流程。")
     print(f"  权重形状=[{num_outputs}, {num_inputs}]")
     print(f"  电导级数量={int(levels.numel())}")
+    print(f"  无需编程单元={unprogrammed}/{total_cells} ({unprogrammed / max(1, total_cells):.1%})")
+    if skip_zero:
+        print(f"  跳过行数={skipped_rows}/{num_outputs * num_inputs} (差分对均为擦除态)")
     print(f"  输出文件={out_csv}")
 
 
@@ -201,6 +216,12 @@ def main():
         default=None,
         help="输出 CSV 路径，默认 results/weight_map_<method>_w<bits>.csv",
     )
+    parser.add_argument(
+        "--levels",
+        type=str,
+        default=None,
+        help="优化电平表 (level_optimizer.py 输出 .pt)，默认按 config.OPTIMIZED_LEVELS_PATH",
+    )
     parser.add_argument(
         "--col-map",
         type=str,
@@ -211,8 +232,16 @@ def main():
             "或 interleaved(兼容旧格式: pos=2*j, neg=2*j+1)"
         ),
     )
+    parser.add_argument(
+        "--skip-zero",
+        action="store_true",
+        help="不导出差分对两个单元都停在擦除态 (最低电导级) 的行",
+    )
     args = parser.parse_args()
 
+    if args.levels:
+        snn_engine.load_level_set(args.levels)
+
     out_csv = args.out
     if out_csv is None:
         out_csv = os.path.join(
@@ -225,6 +254,7 @@ def main():
         out_csv=out_csv,
         weights_dir=args.weights_dir,
         col_map=args.col_map,
+        skip_zero=args.skip_zero,
     )
 
 
@@ -1,8 +1,8 @@
 ﻿import os
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import torch
-from torchvision import datasets
 import config as cfg
 import data_utils
 
@@ -71,6 +71,222 @@ def project_and_quantize(images_28x28, method_name, params=None):
     return _scale_features(feat, scale_params)
 
 
+# ---------------------------------------------------------------------------
+# Fixed-point projection (int8 weights, int32 accumulate, per-column mult/shift)
+# ---------------------------------------------------------------------------
+# Per output column j the whole float chain (flatten /255, center, project,
+# scale to 0..255) is folded into one affine map on raw pixels p (uint8):
+#     out_j = clamp((acc_j * mult_j + bias_j + 2^(shift_j-1)) >> shift_j, 0, 255)
+#     acc_j = sum_i p_i * weight[j, i]         (int8 weights, int32 accumulator)
+# mult_j is normalized to [2^30, 2^31); the product and bias need int64.
+
+_FIXED_MULT_BITS = 31
+
+
+def _affine_projection(params):
+    """Fold a projection + scale into out = p @ A + B on raw pixels (float64)."""
+    method = params.get("method")
+    if method == "proj_pca":
+        w = params["components"].double()                    # [784, D]
+        b = torch.zeros(w.shape[1], dtype=torch.float64)
+        if params.get("center", True):
+            b = -(params["mean"].double() @ w)
+    elif method == "proj_sup":
+        w = params["weight"].double().t()
+        b = params.get("bias", None)
+        b = b.double() if b is not None else torch.zeros(w.shape[1], dtype=torch.float64)
+    else:
+        raise ValueError(f"unknown projection method: {method}")
+
+    scale_params = params.get("scale_params", {"method": "minmax", "min": 0.0, "max": 1.0})
+    if scale_params.get("method", "minmax") == "p99":
+        max_abs = float(scale_params.get("max_abs", 1.0))
+        if max_abs < 1e-6:
+            max_abs = 1.0
+        gain, offset = 255.0 / (2 * max_abs), 127.5
+    else:
+        min_v = float(scale_params.get("min", 0.0))
+        rng = max(float(scale_params.get("max", 1.0)) - min_v, 1e-6)
+        gain, offset = 255.0 / rng, -min_v * 255.0 / rng
+    return w * (gain / 255.0), b * gain + offset
+
+
+def _integer_accumulate(pixels, weight_t):
+    """
+    Exact int32 p @ weight_t for uint8 pixels and int8 weights, vectorized with float32 BLAS:
+    inputs are split into blocks small enough that every partial sum stays below 2^24.
+    """
+    qmax = int(weight_t.abs().max().item()) if weight_t.numel() else 0
+    block = max(1, (1 << 24) // max(1, 255 * qmax))
+    x = pixels.float()
+    w = weight_t.float()
+    acc = None
+    for start in range(0, x.shape[1], block):
+        part = (x[:, start:start + block] @ w[start:start + block]).to(torch.int32)
+        acc = part if acc is None else acc + part
+    return acc
+
+
+def _apply_fixed_point(acc, fixed):
+    """int32 accumulators -> uint8 with the per-column multiplier / shift / bias."""
+    mult = fixed["multiplier"]
+    shift = fixed["shift"]
+    total = acc.long() * mult + fixed["bias"] + torch.bitwise_left_shift(torch.ones_like(shift), shift - 1)
+    return torch.clamp(torch.bitwise_right_shift(total, shift), 0, 255).byte()
+
+
+def calibrate_fixed_point_projection(params, calib_images=None, weight_bits=None):
+    """
+    Build the integer tables for a proj_pca / proj_sup params dict.
+
+    Weights are quantized per output column (max-abs to +-(2^(bits-1)-1)); multiplier/shift
+    reproduce the column scale. With calib_images, each column's bias is corrected by the mean
+    residual of the integer path against the float path (unclamped samples only), which removes
+    the systematic part of the weight rounding error.
+    """
+    if weight_bits is None:
+        weight_bits = int(getattr(cfg, "FIXED_PROJ_WEIGHT_BITS", 8))
+    weight_bits = int(weight_bits)
+    if not 2 <= weight_bits <= 8:
+        raise ValueError(f"weight_bits must be in [2, 8] for an int32 accumulator: {weight_bits}")
+    qmax = (1 << (weight_bits - 1)) - 1
+
+    A, B = _affine_projection(params)                            # [784, D], [D]
+    col_scale = A.abs().max(dim=0).values / qmax
+    col_scale = torch.where(col_scale > 0, col_scale, torch.ones_like(col_scale))
+    weight_t = torch.clamp(torch.round(A / col_scale), -qmax, qmax).to(torch.int8)
+
+    shift = (_FIXED_MULT_BITS - 1) - torch.floor(torch.log2(col_scale)).long()
+    shift = torch.clamp(shift, 1, 62)
+    mult = torch.round(col_scale * torch.pow(2.0, shift.double())).long()
+    overflow = mult >= (1 << _FIXED_MULT_BITS)                  # rounded up to 2^31
+    shift = shift - overflow.long()
+    mult = torch.where(overflow, torch.round(col_scale * torch.pow(2.0, shift.double())).long(), mult)
+    bias_real = B.clone()
+
+    if calib_images is not None:
+        pixels = _to_tensor(calib_images)
+        pixels = pixels.reshape(pixels.shape[0], -1)
+        acc = _integer_accumulate(pixels, weight_t).double()
+        approx = acc * (mult.double() / torch.pow(2.0, shift.double())) + bias_real
+        target = pixels.double() @ A + B
+        valid = (target > -0.5) & (target < 255.5)
+        resid = torch.where(valid, target - approx, torch.zeros_like(target))
+        count = valid.sum(dim=0).clamp_min(1).double()
+        bias_real = bias_real + resid.sum(dim=0) / count
+
+    bias = torch.round(bias_real * torch.pow(2.0, shift.double())).long()
+    return {
+        "method": params.get("method"),
+        "input_dim": int(A.shape[0]),
+        "proj_dim": int(A.shape[1]),
+        "weight_bits": weight_bits,
+        "weight": weight_t.t().contiguous(),                     # [D, 784] int8, row = output
+        "multiplier": mult,
+        "shift": shift,
+        "bias": bias,
+    }
+
+
+def project_and_quantize_fixed(images_28x28, method_name, fixed=None, params=None, chunk_size=None):
+    """Integer-only counterpart of project_and_quantize (same uint8 output layout)."""
+    if fixed is None:
+        if params is None:
+            params = load_projection_params(method_name)
+        fixed = calibrate_fixed_point_projection(params)
+    x = _to_tensor(images_28x28)
+    if x.dim() == 4:
+        x = x.squeeze(1)
+    x = x.reshape(x.shape[0], -1)
+    if chunk_size is None:
+        chunk_size = int(getattr(cfg, "PROJ_PCA_CHUNK", 8192))
+    weight_t = fixed["weight"].t()
+    out = [
+        _apply_fixed_point(_integer_accumulate(x[start:start + chunk_size], weight_t), fixed)
+        for start in range(0, x.shape[0], max(1, int(chunk_size)))
+    ]
+    return torch.cat(out, dim=0)
+
+
+def fixed_point_exactness_report(images_28x28, method_name, fixed=None, params=None):
+    """Compare the fixed-point path with the float path's uint8 output byte by byte."""
+    if params is None:
+        params = load_projection_params(method_name)
+    if fixed is None:
+        fixed = calibrate_fixed_point_projection(params)
+    ref = project_and_quantize(images_28x28, method_name, params=params).int()
+    got = project_and_quantize_fixed(images_28x28, method_name, fixed=fixed).int()
+    diff = (got - ref).abs()
+    max_diff = int(diff.max().item()) if diff.numel() else 0
+    return {
+        "samples": int(ref.shape[0]),
+        "elements": int(ref.numel()),
+        "byte_exact_fraction": float((diff == 0).float().mean().item()) if diff.numel() else 1.0,
+        "sample_exact_fraction": float((diff.amax(dim=1) == 0).float().mean().item()) if diff.numel() else 1.0,
+        "max_abs_diff": max_diff,
+        "diff_histogram": {d: int((diff == d).sum().item()) for d in range(max_diff + 1)},
+    }
+
+
+def _c_array(ctype, name, values, per_line=16):
+    values = [str(int(v)) for v in values]
+    lines = [", ".join(values[i:i + per_line]) for i in range(0, len(values), per_line)]
+    body = ",\n    ".join(lines)
+    return f"static const {ctype} {name}[{len(values)}] = {{\n    {body}\n}};\n"
+
+
+def export_fixed_point_tables(method_name, fixed, out_dir=None):
+    """Write the integer tables as <method>_fixed_proj.npz and a C header for firmware."""
+    if out_dir is None:
+        out_dir = cfg.RESULTS_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, f"{method_name}_fixed_proj")
+    np.savez(
+        base + ".npz",
+        weight=fixed["weight"].numpy().astype(np.int8),
+        multiplier=fixed["multiplier"].numpy().astype(np.int32),
+        shift=fixed["shift"].numpy().astype(np.int8),
+        bias=fixed["bias"].numpy().astype(np.int64),
+        weight_bits=np.int32(fixed["weight_bits"]),
+    )
+
+    prefix = "".join(c if c.isalnum() else "_" for c in method_name).upper()
+    guard = f"{prefix}_FIXED_PROJ_H"
+    text = [
+        f"/* {method_name}: fixed-point 784->{fixed['proj_dim']} projection (generated by flash_preprocess.py) */\n",
+        "/* out[j] = clamp((acc[j] * MULT[j] + BIAS[j] + ((int64_t)1 << (SHIFT[j] - 1))) >> SHIFT[j], 0, 255)\n",
+        " * acc[j] = sum_i pixel[i] * WEIGHT[j * INPUT_DIM + i]   (int32)\n",
+        " * The whole rounding expression is evaluated in int64 (SHIFT is ~40+); see the reference\n",
+        f" * implementation {prefix}_project() below. */\n",
+        f"#ifndef {guard}\n#define {guard}\n\n#include <stdint.h>\n\n",
+        f"#define {prefix}_INPUT_DIM {fixed['input_dim']}\n",
+        f"#define {prefix}_PROJ_DIM {fixed['proj_dim']}\n",
+        f"#define {prefix}_WEIGHT_BITS {fixed['weight_bits']}\n\n",
+        _c_array("int8_t", f"{prefix}_WEIGHT", fixed["weight"].reshape(-1).tolist()),
+        _c_array("int32_t", f"{prefix}_MULT", fixed["multiplier"].tolist()),
+        _c_array("int8_t", f"{prefix}_SHIFT", fixed["shift"].tolist()),
+        _c_array("int64_t", f"{prefix}_BIAS", fixed["bias"].tolist()),
+        "\n/* Reference implementation: pixels[INPUT_DIM] -> out[PROJ_DIM], bit-exact with\n",
+        " * project_and_quantize_fixed(). Non-positive sums clamp to 0 before the shift, so no\n",
+        " * right shift of a negative value is needed. */\n",
+        f"static inline void {prefix}_project(const uint8_t *pixels, uint8_t *out)\n{{\n",
+        f"    for (int j = 0; j < {prefix}_PROJ_DIM; ++j) {{\n",
+        f"        const int8_t *w = &{prefix}_WEIGHT[j * {prefix}_INPUT_DIM];\n",
+        "        int32_t acc = 0;\n",
+        f"        for (int i = 0; i < {prefix}_INPUT_DIM; ++i)\n",
+        "            acc += (int32_t)pixels[i] * w[i];\n",
+        f"        int64_t t = (int64_t)acc * {prefix}_MULT[j] + {prefix}_BIAS[j]\n",
+        f"                    + ((int64_t)1 << ({prefix}_SHIFT[j] - 1));\n",
+        f"        t = t <= 0 ? 0 : t >> {prefix}_SHIFT[j];\n",
+        "        out[j] = (uint8_t)(t > 255 ? 255 : t);\n",
+        "    }\n}\n",
+        f"\n#endif /* {guard} */\n",
+    ]
+    with open(base + ".h", "w", encoding="utf-8") as f:
+        f.write("".join(text))
+    return base + ".npz", base + ".h"
+
+
 def export_flash_inputs(method_name, split="test", out_path=None, weights_dir=None):
     """
     Export uint8 inputs for a given method/split, aligned with data_utils pipeline.
@@ -80,9 +296,9 @@ def export_flash_inputs(method_name, split="test", out_path=None, weights_dir=No
         raise ValueError(f"unsupported split: {split}")
 
     # Reuse the exact preprocessing/splitting logic from data_utils to avoid mismatch.
-    all_datasets = data_utils.prepare_all_datasets(quick_mode=False)
-    if method_name not in all_datasets:
+    if method_name not in cfg.DOWNSAMPLE_METHODS:
         raise ValueError(f"method not found in data pipeline: {method_name}")
+    all_datasets = data_utils.prepare_all_datasets(quick_mode=False, methods=[method_name])
 
     ds = all_datasets[method_name]
     if split == "test":
@@ -111,9 +327,9 @@ def verify_export_consistency(method_name, exported_path, split="test"):
     if split not in ("train", "test"):
         raise ValueError(f"unsupported split: {split}")
 
-    all_datasets = data_utils.prepare_all_datasets(quick_mode=False)
-    if method_name not in all_datasets:
+    if method_name not in cfg.DOWNSAMPLE_METHODS:
         raise ValueError(f"method not found in data pipeline: {method_name}")
+    all_datasets = data_utils.prepare_all_datasets(quick_mode=False, methods=[method_name])
 
     if split == "test":
         ref = all_datasets[method_name]["test_images_uint8"].cpu().numpy().astype(np.uint8)
@@ -133,6 +349,129 @@ def verify_export_consistency(method_name, exported_path, split="test"):
     return True, "byte-exact match"
 
 
+# ---------------------------------------------------------------------------
+# Streaming ingest of arbitrary image sets (bounded memory)
+# ---------------------------------------------------------------------------
+_STREAM_IMAGE_EXTS = (".png", ".npy")
+
+
+def _as_image_batch(arr, source):
+    """uint8 [28, 28] / [n, 28, 28] / [n, 784] -> uint8 [n, 28, 28]."""
+    arr = np.asarray(arr)
+    if arr.dtype != np.uint8:
+        raise ValueError(f"{source}: expected uint8 pixels, got {arr.dtype}")
+    if arr.shape[-2:] == (28, 28):
+        return arr.reshape(-1, 28, 28)
+    if arr.shape[-1] == 784:
+        return arr.reshape(-1, 28, 28)
+    raise ValueError(f"{source}: expected 28x28 images, got shape {arr.shape}")
+
+
+def _decode_image_file(path):
+    """Decode one PNG (converted to grayscale) or NPY file (one image or a batch)."""
+    if path.lower().endswith(".npy"):
+        return _as_image_batch(np.load(path), path)
+    from PIL import Image
+    with Image.open(path) as img:
+        return _as_image_batch(np.asarray(img.convert("L")), path)
+
+
+def _count_images(path):
+    if path.lower().endswith(".npy"):
+        return _as_image_batch(np.load(path, mmap_mode="r"), path).shape[0]
+    return 1
+
+
+def _iter_image_chunks(input_path, chunk_size, workers):
+    """
+    Yield uint8 [n, 28, 28] chunks from a large .npy (memory-mapped, sliced per chunk) or a directory
+    of PNG/NPY files (decoded by a thread pool, one chunk of files at a time).
+    """
+    if os.path.isfile(input_path):
+        images = _as_image_batch(np.load(input_path, mmap_mode="r"), input_path)
+        for start in range(0, images.shape[0], chunk_size):
+            yield np.array(images[start:start + chunk_size])
+        return
+
+    files = list_image_files(input_path)
+    if workers <= 1:
+        for start in range(0, len(files), chunk_size):
+            yield np.concatenate([_decode_image_file(f) for f in files[start:start + chunk_size]])
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(files), chunk_size):
+            yield np.concatenate(list(pool.map(_decode_image_file, files[start:start + chunk_size])))
+
+
+def list_image_files(input_dir):
+    """PNG/NPY files of an input directory in the (sorted) order stream_preprocess writes them."""
+    names = sorted(n for n in os.listdir(input_dir) if n.lower().endswith(_STREAM_IMAGE_EXTS))
+    if not names:
+        raise FileNotFoundError(f"no .png/.npy images in {input_dir}")
+    return [os.path.join(input_dir, n) for n in names]
+
+
+def stream_preprocess(method_name, input_path, out_path=None, chunk_size=None, workers=None,
+                      params=None, fixed=None):
+    """
+    Project an arbitrary image set chunk by chunk into a preallocated memory-mapped uint8 .npy.
+
+    input_path is a uint8 .npy ([N, 28, 28] or [N, 784], read via mmap) or a directory of PNG/NPY
+    files (sorted by name; a directory also gets <out>_files.txt mapping rows to files).
+    Uses project_and_quantize with the cached projection params, or the integer tables when fixed
+    is given. Returns (out_path, num_samples).
+    """
+    if params is None and fixed is None:
+        params = load_projection_params(method_name)
+    if chunk_size is None:
+        chunk_size = int(getattr(cfg, "PROJ_PCA_CHUNK", 8192))
+    chunk_size = max(1, int(chunk_size))
+
+    if os.path.isfile(input_path):
+        counts = None
+        total = _as_image_batch(np.load(input_path, mmap_mode="r"), input_path).shape[0]
+        workers = 0
+    else:
+        files = list_image_files(input_path)
+        counts = [_count_images(f) for f in files]
+        total = int(sum(counts))
+        workers = data_utils.resolve_prep_workers(len(files), workers)
+        # Chunks are counted in files; keep them near chunk_size images for batched NPY files
+        chunk_size = max(1, chunk_size * len(files) // max(1, total))
+    proj_dim = int(fixed["proj_dim"] if fixed is not None else params["proj_dim"])
+
+    if out_path is None:
+        stem = os.path.splitext(os.path.basename(os.path.normpath(input_path)))[0]
+        out_path = os.path.join(cfg.RESULTS_DIR, f"{method_name}_{stem}_uint8.npy")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+
+    out = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.uint8, shape=(total, proj_dim))
+    row = 0
+    for images in _iter_image_chunks(input_path, chunk_size, workers):
+        if fixed is not None:
+            feats = project_and_quantize_fixed(images, method_name, fixed=fixed)
+        else:
+            feats = project_and_quantize(images, method_name, params=params)
+        out[row:row + feats.shape[0]] = feats.numpy()
+        row += feats.shape[0]
+    out.flush()
+    del out
+
+    if counts is not None:
+        with open(os.path.splitext(out_path)[0] + "_files.txt", "w", encoding="utf-8") as f:
+            for path, count in zip(files, counts):
+                f.write(f"{os.path.basename(path)}\t{count}\n")
+    return out_path, row
+
+
+def fixed_point_calibration_images(num_samples=None):
+    """Raw MNIST train images used to calibrate the fixed-point bias correction."""
+    if num_samples is None:
+        num_samples = int(getattr(cfg, "FIXED_PROJ_CALIB_SAMPLES", 10000))
+    images, _ = data_utils.load_mnist_raw(train=True)
+    return images[:num_samples] if num_samples > 0 else images
+
+
 def main():
     parser = argparse.ArgumentParser(description="Export 64-dim projected inputs for flash")
     parser.add_argument("--method", required=True, help="proj_pca_64 or proj_sup_64")
@@ -140,8 +479,31 @@ def main():
     parser.add_argument("--out", default=None, help="output .npy path")
     parser.add_argument("--check-consistency", action="store_true",
                         help="verify export is byte-identical to data_utils pipeline output")
+    parser.add_argument("--fixed-point", action="store_true",
+                        help="calibrate and export the int8/int32 projection tables (.npz + C header) "
+                             "and report byte exactness against the float path on the MNIST split")
+    parser.add_argument("--input", default=None,
+                        help="stream an image set instead of an MNIST split: uint8 .npy ([N,28,28] or "
+                             "[N,784], read via mmap) or a directory of PNG/NPY files")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="images per streaming chunk (default config.PROJ_PCA_CHUNK)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="decode threads for --input directories (default config.DATA_PREP_WORKERS)")
     args = parser.parse_args()
 
+    if args.input:
+        fixed = None
+        if args.fixed_point:
+            fixed = calibrate_fixed_point_projection(
+                load_projection_params(args.method), calib_images=fixed_point_calibration_images())
+            for path in export_fixed_point_tables(args.method, fixed):
+                print(f"Saved: {path}")
+        out_path, count = stream_preprocess(
+            args.method, args.input, out_path=args.out, chunk_size=args.chunk_size,
+            workers=args.workers, fixed=fixed)
+        print(f"Saved: {out_path} ({count} samples{', fixed-point' if fixed is not None else ''})")
+        return
+
     out_path = export_flash_inputs(args.method, split=args.split, out_path=args.out)
     print(f"Saved: {out_path}")
     if args.check_consistency:
@@ -151,6 +513,20 @@ def main():
         else:
             print(f"Consistency check FAIL: {msg}")
             raise SystemExit(2)
+    if args.fixed_point:
+        params = load_projection_params(args.method)
+        fixed = calibrate_fixed_point_projection(params, calib_images=fixed_point_calibration_images())
+        npz_path, header_path = export_fixed_point_tables(args.method, fixed)
+        print(f"Saved: {npz_path}")
+        print(f"Saved: {header_path}")
+        images, _ = data_utils.load_mnist_raw(train=(args.split == "train"))
+        report = fixed_point_exactness_report(images, args.method, fixed=fixed, params=params)
+        print(
+            f"Fixed-point vs float: byte-exact {report['byte_exact_fraction']:.4%} of "
+            f"{report['elements']} bytes, sample-exact {report['sample_exact_fraction']:.2%} of "
+            f"{report['samples']} samples, max |diff|={report['max_abs_diff']}, "
+            f"histogram={report['diff_histogram']}"
+        )
 
 
 if __name__ == "__main__":
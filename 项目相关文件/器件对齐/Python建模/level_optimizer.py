@@ -0,0 +1,307 @@
+"""
+==========================================================
+  SNN SoC Python 建模 - 电导电平集优化
+==========================================================
+用途:
+  器件插件默认在 [g_min, g_max] 之间取 2^bits 个 log 间隔电平，
+  与训练后权重 W 的分布无关。这里按权重分布和验证集 MAC 结果
+  重新挑选 2^bits 个可编程电平:
+    1) Lloyd-Max 初始化 (对 |W| 做一维 k-means, 最低电平固定)
+    2) 坐标搜索: 逐个电平在相邻电平之间试探候选值
+
+增量评估:
+  MAC 输出 y = X @ Wq^T 可按电平拆开:
+    y = sum_k level_k * C_k,   C_k = X @ (sign(W) * [cell 属于电平 k] * w_max)^T
+  每个电平的贡献 C_k 只算一次并缓存。移动电平 k 时，只有落在
+  (level_{k-1}, level_{k+1}) 之间的单元可能换电平，所以每个候选
+  只需重算 3 个电平的贡献，不需要跑完整的 snn_inference。
+
+输出:
+  .pt 文件 {levels_norm, weight_bits, ...}，可通过
+    - config.OPTIMIZED_LEVELS_PATH / 环境变量 SNN_OPTIMIZED_LEVELS_PATH
+    - export_weight_map.py --levels <path>
+  接入 snn_engine._load_plugin_levels 与写阵列表导出。
+
+用法:
+  python level_optimizer.py --method proj_sup_64 --objective acc
+"""
+
+import argparse
+import os
+
+import torch
+
+import config as cfg
+import snn_engine
+
+
+def _assign_levels(mag, levels):
+    """把归一化幅值映射到最近电平的索引（任意形状，与 argmin 最近邻一致）。"""
+    return snn_engine.nearest_level_index(mag, levels)
+
+
+def lloyd_max_levels(mag, num_levels, min_level=0.0, iters=30):
+    """
+    一维 Lloyd-Max 量化器 (k-means)，最低电平固定为 min_level。
+
+    参数:
+        mag:        Tensor, |W| / w_max，值域 [0,1]
+        num_levels: 电平总数 (含固定的最低电平)
+        min_level:  最低电平 (器件 g_min / g_max，理想情况为 0)
+    返回:
+        levels: Tensor [num_levels]，升序
+    """
+    values = mag.flatten().float()
+    free = num_levels - 1
+    nonzero = values[values > min_level]
+    if nonzero.numel() == 0:
+        return torch.linspace(min_level, 1.0, num_levels)
+
+    # 分位数初始化，保证每个自由电平初始时都有样本
+    q = torch.linspace(0.0, 1.0, free + 2)[1:-1]
+    init = torch.quantile(nonzero, q)
+    levels = torch.cat([torch.tensor([float(min_level)]), init])
+    levels = torch.sort(torch.clamp(levels, min_level, 1.0))[0]
+
+    for _ in range(max(1, int(iters))):
+        idx = _assign_levels(values, levels)
+        sums = torch.zeros(num_levels).index_add_(0, idx, values)
+        counts = torch.bincount(idx, minlength=num_levels).float()
+        new_levels = levels.clone()
+        has = counts > 0
+        new_levels[has] = sums[has] / counts[has]
+        new_levels[0] = float(min_level)
+        new_levels = torch.sort(torch.clamp(new_levels, min_level, 1.0))[0]
+        if torch.allclose(new_levels, levels, atol=1e-7):
+            levels = new_levels
+            break
+        levels = new_levels
+    return levels
+
+
+class _LevelContributionCache:
+    """
+    缓存每个电平对 MAC 输出的贡献 C_k = X @ (S * onehot_k)^T。
+    X 使用像素值 (0..255)，即 8 个 bit-plane 按 2^b 加权后的理想膜电位。
+    """
+
+    def __init__(self, X, W, levels):
+        self.X = X.float()                                  # [N, D]
+        self.w_max = float(W.abs().max())
+        self.sign = torch.sign(W).float()                   # [O, D]
+        self.mag = (W.abs() / max(self.w_max, 1e-12)).float()
+        self.levels = levels.clone()
+        self.assign = _assign_levels(self.mag, self.levels)  # [O, D]
+        num_levels = self.levels.numel()
+        self.contrib = torch.stack([
+            self._contribution(self.assign == k) for k in range(num_levels)
+        ])                                                  # [L, N, O]
+        self.output = torch.einsum("l,lno->no", self.levels, self.contrib)
+
+    def _contribution(self, mask):
+        return self.X @ (self.sign * mask.float() * self.w_max).t()
+
+    def propose(self, k, value):
+        """
+        试探把电平 k 移到 value，返回 (新输出, 受影响电平的 (索引, 新贡献), 新分配)。
+        只重算 k-1, k, k+1 三个电平。
+        """
+        levels = self.levels.clone()
+        levels[k] = value
+        lo = max(0, k - 1)
+        hi = min(levels.numel() - 1, k + 1)
+        window = (self.assign >= lo) & (self.assign <= hi)
+        local_levels = levels[lo:hi + 1]
+        local_idx = _assign_levels(self.mag[window], local_levels) + lo
+        assign = self.assign.clone()
+        assign[window] = local_idx
+
+        output = self.output.clone()
+        updates = []
+        for j in range(lo, hi + 1):
+            new_c = self._contribution(assign == j)
+            output += levels[j] * new_c - self.levels[j] * self.contrib[j]
+            updates.append((j, new_c))
+        return output, updates, assign
+
+    def accept(self, k, value, output, updates, assign):
+        self.levels[k] = value
+        self.assign = assign
+        for j, new_c in updates:
+            self.contrib[j] = new_c
+        self.output = output
+
+
+def _score(output, reference, labels, objective):
+    """
+    返回可比较的分数元组（越大越好）。
+    mac: 只看相对 MAC 误差; acc: 先比膜电位 argmax 准确率，再比 MAC 误差。
+    """
+    err = ((output - reference) ** 2).mean() / reference.pow(2).mean().clamp(min=1e-12)
+    err = float(err)
+    if objective == "acc":
+        acc = float((output.argmax(dim=1) == labels).float().mean())
+        return (acc, -err)
+    return (-err,)
+
+
+def optimize_level_set(W, images_uint8, labels, weight_bits=4, objective="acc",
+                       min_level=0.0, sweeps=4, candidates=16, lloyd_iters=30):
+    """
+    为权重矩阵 W 选择 2^weight_bits 个归一化电平（相对 w_max / g_max）。
+
+    参数:
+        W:            Tensor [O, D]，训练好的 ANN 权重
+        images_uint8: Tensor [N, D]，标定样本 (通常取验证集子集)
+        labels:       Tensor [N]
+        objective:    'acc' (argmax 准确率优先) | 'mac' (MAC 相对误差)
+        min_level:    最低电平，器件路径取 g_min/g_max
+        sweeps:       坐标搜索轮数
+        candidates:   每个电平每轮试探的候选数
+    返回:
+        dict: levels_norm / lloyd_levels / score_init / score_lloyd / score_final / history
+    """
+    objective = str(objective).lower()
+    if objective not in ("acc", "mac"):
+        raise ValueError(f"unknown objective: {objective}")
+    W = W.detach().float().cpu()
+    X = images_uint8.float().cpu()
+    labels = labels.cpu()
+    num_levels = 2 ** int(weight_bits)
+    reference = X @ W.t()
+
+    mag = W.abs() / W.abs().max().clamp(min=1e-12)
+    # 基线电平表与 snn_engine 的器件电平一致: min_level>0 时为 [min_level, 1] 上的 num_levels 个
+    # log 电平；理想器件 (min_level=0) 时与 set_level_set 相同，在 log 电平前补 0
+    if min_level > 0:
+        init_levels = torch.logspace(torch.log10(torch.tensor(float(min_level))), 0.0, num_levels)
+    else:
+        init_levels = torch.cat([torch.zeros(1), torch.logspace(-4.0, 0.0, num_levels - 1)])
+    init_cache = _LevelContributionCache(X, W, init_levels)
+    score_init = _score(init_cache.output, reference, labels, objective)
+
+    lloyd = lloyd_max_levels(mag, num_levels, min_level=min_level, iters=lloyd_iters)
+    cache = _LevelContributionCache(X, W, lloyd)
+    score_lloyd = _score(cache.output, reference, labels, objective)
+    best = score_lloyd
+    history = [{"stage": "lloyd", "score": best}]
+
+    for sweep in range(max(0, int(sweeps))):
+        improved = False
+        for k in range(1, num_levels):
+            left = float(cache.levels[k - 1])
+            right = float(cache.levels[k + 1]) if k + 1 < num_levels else 1.0
+            if right - left <= 1e-7:
+                continue
+            grid = torch.linspace(left, right, int(candidates) + 2)[1:]
+            if k + 1 < num_levels:
+                grid = grid[:-1]   # 保持严格升序，不与右邻电平重合
+            best_move = None
+            for value in grid.tolist():
+                output, updates, assign = cache.propose(k, value)
+                score = _score(output, reference, labels, objective)
+                if score > best:
+                    best = score
+                    best_move = (value, output, updates, assign)
+            if best_move is not None:
+                cache.accept(k, *best_move)
+                improved = True
+        history.append({"stage": f"sweep{sweep + 1}", "score": best})
+        if not improved:
+            break
+
+    return {
+        "levels_norm": cache.levels.clone(),
+        "lloyd_levels": lloyd,
+        "weight_bits": int(weight_bits),
+        "objective": objective,
+        "min_level": float(min_level),
+        "score_init": score_init,
+        "score_lloyd": score_lloyd,
+        "score_final": best,
+        "history": history,
+    }
+
+
+def save_level_set(result, path, method=None):
+    """保存优化结果，格式与 snn_engine.load_level_set 一致。"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    payload = dict(result)
+    payload["method"] = method
+    torch.save(payload, path)
+    return path
+
+
+def _device_min_level():
+    """器件 g_min/g_max；器件模型不可用时为 0。"""
+    device_sim = snn_engine._get_plugin_sim(cfg.NUM_OUTPUTS, 1)
+    if device_sim is None:
+        return 0.0
+    g_min = float(device_sim.conductance_model.g_min)
+    g_max = float(device_sim.conductance_model.g_max)
+    return g_min / g_max if g_max > 0 else 0.0
+
+
+def main():
+    import data_utils
+    import export_weight_map
+
+    parser = argparse.ArgumentParser(description="优化可编程电导电平集 (Lloyd-Max + 坐标搜索)")
+    parser.add_argument("--method", type=str, default="proj_sup_64", help="权重文件名(不含 .pt)")
+    parser.add_argument("--weight-bits", type=int, default=int(cfg.WEIGHT_BITS_DEVICE))
+    parser.add_argument("--objective", choices=["acc", "mac"], default="acc")
+    parser.add_argument("--weights-dir", type=str, default=cfg.WEIGHTS_DIR)
+    parser.add_argument("--samples", type=int, default=int(cfg.THRESHOLD_CALIBRATE_SAMPLES),
+                        help="用于优化的验证集样本数 (0=全部)")
+    parser.add_argument("--sweeps", type=int, default=4)
+    parser.add_argument("--candidates", type=int, default=16)
+    parser.add_argument("--out", type=str, default=None,
+                        help="输出路径，默认 results/levels_<method>_w<bits>.pt")
+    args = parser.parse_args()
+
+    W = export_weight_map._load_weight_tensor(args.method, args.weights_dir)
+    all_datasets = data_utils.prepare_all_datasets(quick_mode=False, methods=[args.method])
+    ds = all_datasets[args.method]
+    images, labels = ds["val_images_uint8"], ds["val_labels"]
+    if images is None:
+        raise RuntimeError("validation split unavailable (VAL_SAMPLES=0?)")
+    if args.samples > 0:
+        images, labels = images[:args.samples], labels[:args.samples]
+
+    result = optimize_level_set(
+        W, images, labels,
+        weight_bits=args.weight_bits,
+        objective=args.objective,
+        min_level=_device_min_level(),
+        sweeps=args.sweeps,
+        candidates=args.candidates,
+    )
+
+    # 用完整 bit-plane SNN 推理对比默认电平与优化电平
+    scheme = str(getattr(cfg, "PRIMARY_SCHEME", "B")).upper()
+    base_acc, _ = snn_engine.snn_inference(
+        images, labels, W, weight_bits=args.weight_bits, scheme=scheme, decision="membrane"
+    )
+    snn_engine.set_level_set(result["levels_norm"], weight_bits=args.weight_bits, source="optimized")
+    opt_acc, _ = snn_engine.snn_inference(
+        images, labels, W, weight_bits=args.weight_bits, scheme=scheme, decision="membrane"
+    )
+    result["snn_acc_default"] = float(base_acc)
+    result["snn_acc_optimized"] = float(opt_acc)
+
+    out = args.out or os.path.join(
+        cfg.RESULTS_DIR, f"levels_{args.method}_w{int(args.weight_bits)}.pt"
+    )
+    save_level_set(result, out, method=args.method)
+
+    print("电平优化完成:")
+    print(f"  method={args.method}, weight_bits={args.weight_bits}, objective={args.objective}")
+    print(f"  score: log-init={result['score_init']}, lloyd={result['score_lloyd']}, "
+          f"final={result['score_final']}")
+    print(f"  SNN(membrane, scheme={scheme}): default={base_acc:.2%}, optimized={opt_acc:.2%}")
+    print("  levels_norm=" + ", ".join(f"{v:.4f}" for v in result["levels_norm"].tolist()))
+    print(f"  输出文件={out}")
+
+
+if __name__ == "__main__":
+    main()
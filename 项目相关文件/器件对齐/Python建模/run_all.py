@@ -27,6 +27,7 @@
 import sys
 import os
 import argparse
+import csv
 import time
 import random
 import shutil
@@ -349,11 +350,8 @@ def calibrate_threshold_ratio(ds, W, adc_bits=8, weight_bits=4,
     if n <= 0:
         return None, None, []
 
-    # Use a deterministic random subset to avoid positional/class-order bias.
-    gen = torch.Generator().manual_seed(int(getattr(cfg, "RANDOM_SEED", 42)) + 20260207)
-    perm = torch.randperm(int(labels_src.shape[0]), generator=gen)[:n]
-    images = images_src[perm]
-    labels = labels_src[perm]
+    # Nested stratified subset from the persistent index store (same subset in every process).
+    images, labels = data_utils.take_eval_subset(images_src, labels_src, n, split="val")
 
     best_ratio = None
     best_acc = -1.0
@@ -378,6 +376,29 @@ def calibrate_threshold_ratio(ds, W, adc_bits=8, weight_bits=4,
     return best_ratio, best_acc, candidate_scores
 
 
+def _sweep_subset_ladder():
+    """SWEEP_SUBSET_LADDER -> increasing subset sizes, always ending with the full split (0)."""
+    sizes = {data_utils.resolve_subset_size(s) for s in getattr(cfg, "SWEEP_SUBSET_LADDER", [])}
+    return sorted(s for s in sizes if s > 0) + [0]
+
+
+def _escalate_combos(records):
+    """
+    Keep records whose subset accuracy (screen_acc) is within SWEEP_ESCALATE_MARGIN of the best
+    (at least SWEEP_ESCALATE_MIN_KEEP).
+    """
+    margin = float(getattr(cfg, "SWEEP_ESCALATE_MARGIN", 0.02))
+    min_keep = int(getattr(cfg, "SWEEP_ESCALATE_MIN_KEEP", 10))
+    ranked = sorted(records, key=lambda x: float(x["screen_acc"]), reverse=True)
+    best = float(ranked[0]["screen_acc"])
+    kept = [x for x in ranked if float(x["screen_acc"]) >= best - margin]
+    if len(kept) < min_keep:
+        kept = ranked[:min_keep]
+    # keep the original grid order for the next rung
+    kept_ids = {id(x) for x in kept}
+    return [x for x in records if id(x) in kept_ids]
+
+
 def _get_split_tensors(ds, split_name):
     """
     Return (images_uint8, labels) for the requested split.
@@ -445,6 +466,187 @@ def _combo_cost_key(item, primary_scheme):
 #  姝ラ 2: 璁粌 ANN
 # =====================================================
 
+def _use_batched_training(all_datasets):
+    """Batched training needs SGD mode and identical training labels across methods."""
+    if not bool(getattr(cfg, "ANN_TRAIN_BATCHED", False)):
+        return False
+    if str(getattr(cfg, "ANN_TRAIN_MODE", "sgd")).lower() != "sgd":
+        return False
+    labels = [ds["train_labels"] for ds in all_datasets.values()]
+    if len(labels) < 2 or any(l is None for l in labels):
+        return False
+    return all(torch.equal(labels[0], l) for l in labels[1:])
+
+
+def _training_phases():
+    """Checkpoint phases run_training trains before pruning / HIL."""
+    qat = getattr(cfg, 'QAT_ENABLE', False) and getattr(cfg, 'POST_QUANT_FINE_TUNE_EPOCHS', 0) > 0
+    return ("float", "qat") if qat else ("float",)
+
+
+def _pending_batched(to_train, fingerprints):
+    """
+    Methods still to batch-train: those whose per-method checkpoint already holds every training
+    phase (written by an interrupted earlier batched run) resume through train_model instead.
+    """
+    if fingerprints is None:
+        return to_train
+    phases = set(_training_phases())
+    return {name: ds for name, ds in to_train.items()
+            if not phases <= train_ann.TrainingCheckpoint(name, fingerprints[name]).completed_phases()}
+
+
+def _train_all_batched(all_datasets, epochs, quick=False, fingerprints=None):
+    """
+    Train every method at once (train_ann.train_models_batched): float phase,
+    then the optional QAT fine-tune, all as [M, 10, D] batched steps.
+    Early stopping runs per method when every method has the same validation split.
+    With `fingerprints` the stacked state is checkpointed per epoch (BatchedTrainingCheckpoint) and
+    the finished phases are handed to each method's TrainingCheckpoint.
+    Returns {name: (model, history, (float_info, qat_info))}.
+    """
+    names = list(all_datasets.keys())
+    ckpt = None
+    if fingerprints is not None:
+        batch_fp = hashlib.sha256(
+            "".join(f"{n}={fingerprints[n]}\n" for n in names).encode("utf-8")).hexdigest()
+        ckpt = train_ann.BatchedTrainingCheckpoint(batch_fp)
+    inputs = [train_ann.loader_tensors(all_datasets[n]["train_loader"])[0] for n in names]
+    dims = [int(all_datasets[n]["input_dim"]) for n in names]
+    labels = all_datasets[names[0]]["train_labels"]
+    stacked, _ = train_ann.stack_padded_inputs(inputs)
+    del inputs  # temporary float copies; only the stacked batch is kept
+    print(f"  batched training: {len(names)} methods stacked as {list(stacked.shape)}")
+
+    val = {}
+    val_loaders = [all_datasets[n].get("val_loader_float") for n in names]
+    if all(v is not None for v in val_loaders):
+        val_sets = [train_ann.loader_tensors(v) for v in val_loaders]
+        if all(torch.equal(val_sets[0][1], v[1]) for v in val_sets[1:]):
+            val["val_inputs"], _ = train_ann.stack_padded_inputs(
+                [v[0] for v in val_sets], pad_dim=stacked.shape[2])
+            val["val_labels"] = val_sets[0][1]
+
+    models, histories, infos = train_ann.train_models_batched(
+        stacked, labels, dims, epochs=epochs, return_info=True, checkpoint=ckpt, **val)
+    float_histories = [list(h) for h in histories]
+    qat_histories = [[] for _ in names]
+    qat_infos = [None] * len(names)
+
+    if getattr(cfg, 'QAT_ENABLE', False) and getattr(cfg, 'POST_QUANT_FINE_TUNE_EPOCHS', 0) > 0:
+        qat_epochs = cfg.POST_QUANT_FINE_TUNE_EPOCHS
+        if quick:
+            qat_epochs = min(1, qat_epochs)
+        models, qat_histories, qat_infos = train_ann.train_models_batched(
+            stacked, labels, dims,
+            epochs=qat_epochs, lr=getattr(cfg, 'QAT_LR', cfg.ANN_LR * 0.2), models=models,
+            qat=True, weight_bits=cfg.QAT_WEIGHT_BITS,
+            noise_std=cfg.QAT_NOISE_STD, ir_drop_coeff=cfg.QAT_IR_DROP_COEFF,
+            return_info=True, checkpoint=ckpt, **val,
+        )
+        for history, qat_history in zip(histories, qat_histories):
+            history.extend(qat_history)
+
+    if ckpt is not None:
+        # Per-method checkpoints take over, so a later restart with fewer pending methods
+        # (different batch fingerprint) still skips the finished training phases
+        for i, name in enumerate(names):
+            method_ckpt = train_ann.TrainingCheckpoint(name, fingerprints[name])
+            method_ckpt.complete("float", models[i], float_histories[i], infos[i])
+            if qat_infos[i] is not None:
+                method_ckpt.complete("qat", models[i], qat_histories[i], qat_infos[i])
+        ckpt.clear()
+
+    return {name: (models[i], histories[i], (infos[i], qat_infos[i]))
+            for i, name in enumerate(names)}
+
+
+def _train_in_process_pool(all_datasets, names, epochs, quick=False, fingerprints=None):
+    """
+    Train the given methods in a spawn process pool (train_ann.train_models_parallel).
+    Workers run float training + optional QAT and write weights via save_weights;
+    with `fingerprints` they also checkpoint / resume per method.
+    Returns {name: (model, history, (float_info, qat_info))}.
+    """
+    fingerprints = fingerprints or {}
+    qat_epochs = 0
+    if getattr(cfg, 'QAT_ENABLE', False) and getattr(cfg, 'POST_QUANT_FINE_TUNE_EPOCHS', 0) > 0:
+        qat_epochs = cfg.POST_QUANT_FINE_TUNE_EPOCHS
+        if quick:
+            qat_epochs = min(1, qat_epochs)
+    workers = train_ann.resolve_train_workers(len(names))
+    print(f"  process-pool training: {len(names)} methods on {workers} workers")
+    jobs = [(n, all_datasets[n]["train_loader"], all_datasets[n]["input_dim"], epochs,
+             all_datasets[n].get("val_loader_float"), fingerprints.get(n)) for n in names]
+    return train_ann.train_models_parallel(
+        jobs, workers=workers, qat_epochs=qat_epochs,
+        qat_lr=getattr(cfg, 'QAT_LR', cfg.ANN_LR * 0.2), return_info=True,
+    )
+
+
+def _hil_finetune(ds, model, epochs, mask=None):
+    """
+    Hardware-in-the-loop fine-tune (train_ann.hil_finetune) at the baseline ADC/W/T and the
+    primary scheme. The threshold ratio is calibrated on val for the current weights first.
+    A pruning mask keeps pruned weights at zero.
+    Returns (model, info) or (model, None) when the dataset has no uint8 split.
+    """
+    if ds.get("train_images_uint8") is None or ds.get("train_labels") is None:
+        return model, None
+    _, scheme = _resolve_eval_schemes()
+    adc_bits = int(getattr(cfg, "HIL_ADC_BITS", 8))
+    timesteps = int(getattr(cfg, "HIL_TIMESTEPS", 1))
+    ratio, _, _ = calibrate_threshold_ratio(
+        ds, train_ann.get_weights(model), adc_bits=adc_bits,
+        weight_bits=cfg.QAT_WEIGHT_BITS, timesteps=timesteps, scheme=scheme,
+    )
+    if ratio is None:
+        ratio = float(getattr(cfg, "SPIKE_THRESHOLD_RATIO", 0.6))
+    model, _, info = train_ann.hil_finetune(
+        model, ds["train_images_uint8"], ds["train_labels"], epochs=epochs,
+        adc_bits=adc_bits, timesteps=timesteps, scheme=scheme, threshold_ratio=ratio,
+        val_images_uint8=ds.get("val_images_uint8"), val_labels=ds.get("val_labels"),
+        return_info=True, mask=mask,
+    )
+    return model, info
+
+
+def _training_fingerprint(name, ds, epochs, quick=False):
+    """Config + data fingerprint of one method's training run (see train_ann.training_fingerprint)."""
+    tensors = list(ds["train_loader"].dataset.tensors)
+    val_loader = ds.get("val_loader_float")
+    if val_loader is not None:
+        tensors += list(val_loader.dataset.tensors)
+    if int(getattr(cfg, "HIL_FINETUNE_EPOCHS", 0)) > 0:
+        tensors += [ds.get("train_images_uint8"), ds.get("val_images_uint8")]
+    return train_ann.training_fingerprint(
+        name, ds["input_dim"], epochs,
+        data_digest=train_ann.tensor_digest(*tensors), extra={"quick": bool(quick)},
+    )
+
+
+def _load_trained(name, ds, note):
+    """Load saved weights for `name` and evaluate them (raises FileNotFoundError)."""
+    model = train_ann.load_weights(name, ds["input_dim"])
+    W = train_ann.get_weights(model)
+    acc = train_ann.evaluate_model(model, ds["test_loader_float"])
+    quant_acc = None
+    if getattr(cfg, 'QAT_ENABLE', False):
+        quant_acc = train_ann.evaluate_model(
+            model, ds["test_loader_float"],
+            quantized=True,
+            weight_bits=cfg.QAT_WEIGHT_BITS,
+            noise_std=cfg.QAT_NOISE_STD if cfg.QAT_NOISE_ENABLE else 0.0,
+            ir_drop_coeff=cfg.QAT_IR_DROP_COEFF
+        )
+    if quant_acc is not None:
+        print(f"  {name:20s}: {note}, acc={acc:.2%}, QAT={quant_acc:.2%}")
+    else:
+        print(f"  {name:20s}: {note}, acc={acc:.2%}")
+    return {"float_acc": acc, "weights": W, "quant_acc": quant_acc,
+            "converged_epoch": None, "qat_converged_epoch": None}
+
+
 def run_training(all_datasets, skip_train=False, quick=False):
     """
     瀵规瘡绉嶉檷閲囨牱鏂规硶璁粌涓€涓?ANN锛岃褰?float 鍩虹嚎鍑嗙‘鐜囥€?
@@ -457,53 +659,95 @@ def run_training(all_datasets, skip_train=False, quick=False):
     epochs = cfg.QUICK_EPOCHS if quick else cfg.ANN_EPOCHS
     results = {}
 
+    # Config fingerprints: stale weights are retrained, matching ones are reused (TRAIN_RESUME)
+    resume = bool(getattr(cfg, "TRAIN_RESUME", True))
+    fingerprints = {name: _training_fingerprint(name, ds, epochs, quick=quick)
+                    for name, ds in all_datasets.items()}
+    up_to_date = set()
+    if not skip_train and resume:
+        up_to_date = {name for name in all_datasets
+                      if train_ann.read_weights_fingerprint(name) == fingerprints[name]}
+    to_train = {name: ds for name, ds in all_datasets.items() if name not in up_to_date}
+
+    batched = {}
+    if not skip_train:
+        batchable = _pending_batched(to_train, fingerprints if resume else None)
+        if _use_batched_training(batchable):
+            batched = _train_all_batched(batchable, epochs, quick=quick,
+                                         fingerprints=fingerprints if resume else None)
+
+    pooled = {}
+    if not skip_train:
+        pending = [name for name in to_train if name not in batched]
+        if train_ann.resolve_train_workers(len(pending)) > 1:
+            pooled = _train_in_process_pool(all_datasets, pending, epochs, quick=quick,
+                                            fingerprints=fingerprints if resume else None)
+
     for name, ds in all_datasets.items():
-        if skip_train:
-            # 鍔犺浇宸蹭繚瀛樼殑鏉冮噸
-            try:
-                model = train_ann.load_weights(name, ds["input_dim"])
-                W = train_ann.get_weights(model)
-                acc = train_ann.evaluate_model(model, ds["test_loader_float"])
-                quant_acc = None
-                if getattr(cfg, 'QAT_ENABLE', False):
-                    quant_acc = train_ann.evaluate_model(
-                        model, ds["test_loader_float"],
-                        quantized=True,
-                        weight_bits=cfg.QAT_WEIGHT_BITS,
-                        noise_std=cfg.QAT_NOISE_STD if cfg.QAT_NOISE_ENABLE else 0.0,
-                        ir_drop_coeff=cfg.QAT_IR_DROP_COEFF
-                    )
-                if quant_acc is not None:
-                    print(f"  {name:20s}: loaded weights, acc={acc:.2%}, QAT={quant_acc:.2%}")
-                else:
-                    print(f"  {name:20s}: loaded weights, acc={acc:.2%}")
-                results[name] = {"float_acc": acc, "weights": W, "quant_acc": quant_acc}
-                continue
-            except FileNotFoundError:
-                print(f"  {name}: 鏈壘鍒板凡淇濆瓨鏉冮噸锛岄噸鏂拌缁?.")
-
-        # +/-+/-
-        model, history = train_ann.train_model(
-            ds["train_loader"], ds["input_dim"], epochs=epochs
-        )
+        if skip_train or name in up_to_date:
+            stored = train_ann.read_weights_fingerprint(name)
+            if stored is not None and stored != fingerprints[name]:
+                print(f"  {name:20s}: saved weights are stale (training config changed), retraining...")
+            else:
+                # 鍔犺浇宸蹭繚瀛樼殑鏉冮噸
+                try:
+                    note = "loaded weights" if skip_train else "weights up to date, training skipped"
+                    results[name] = _load_trained(name, ds, note)
+                    continue
+                except FileNotFoundError:
+                    print(f"  {name}: 鏈壘鍒板凡淇濆瓨鏉冮噸锛岄噸鏂拌缁?.")
 
-        # QAT fine-tune (optional)
         quant_acc = None
-        if getattr(cfg, 'QAT_ENABLE', False) and getattr(cfg, 'POST_QUANT_FINE_TUNE_EPOCHS', 0) > 0:
+        qat_info = None
+        ckpt = train_ann.TrainingCheckpoint(name, fingerprints[name]) if resume else None
+        if name in pooled:
+            model, history, (info, qat_info) = pooled[name]
+        elif name in batched:
+            model, history, (info, qat_info) = batched[name]
+        else:
+            # +/-+/-
+            model, history, info = train_ann.train_model(
+                ds["train_loader"], ds["input_dim"], epochs=epochs,
+                val_loader=ds.get("val_loader_float"), return_info=True, checkpoint=ckpt
+            )
+
+        # QAT fine-tune (optional)
+        if name not in batched and name not in pooled and getattr(cfg, 'QAT_ENABLE', False) and getattr(cfg, 'POST_QUANT_FINE_TUNE_EPOCHS', 0) > 0:
             qat_epochs = cfg.POST_QUANT_FINE_TUNE_EPOCHS
             if quick:
                 qat_epochs = min(1, qat_epochs)
             qat_lr = getattr(cfg, 'QAT_LR', cfg.ANN_LR * 0.2)
-            model, qat_history = train_ann.train_model(
+            model, qat_history, qat_info = train_ann.train_model(
                 ds["train_loader"], ds["input_dim"],
                 epochs=qat_epochs, lr=qat_lr, model=model,
                 qat=True, weight_bits=cfg.QAT_WEIGHT_BITS,
                 noise_std=cfg.QAT_NOISE_STD,
-                ir_drop_coeff=cfg.QAT_IR_DROP_COEFF
+                ir_drop_coeff=cfg.QAT_IR_DROP_COEFF,
+                val_loader=ds.get("val_loader_float"), return_info=True, checkpoint=ckpt
             )
             if qat_history:
                 history.extend(qat_history)
 
+        # Magnitude pruning + masked fine-tune (optional)
+        prune_mask = None
+        if float(getattr(cfg, 'PRUNE_SPARSITY', 0.0)) > 0:
+            prune_epochs = int(getattr(cfg, 'PRUNE_FINETUNE_EPOCHS', 3))
+            if quick:
+                prune_epochs = min(1, prune_epochs)
+            model, prune_history, prune_mask = train_ann.prune_and_finetune(
+                model, ds["train_loader"], ds["input_dim"], epochs=prune_epochs,
+                val_loader=ds.get("val_loader_float"), checkpoint=ckpt,
+            )
+            history.extend(prune_history)
+
+        # Hardware-in-the-loop fine-tune (optional)
+        hil_info = None
+        hil_epochs = int(getattr(cfg, 'HIL_FINETUNE_EPOCHS', 0))
+        if hil_epochs > 0:
+            if quick:
+                hil_epochs = min(1, hil_epochs)
+            model, hil_info = _hil_finetune(ds, model, hil_epochs, mask=prune_mask)
+
         acc = train_ann.evaluate_model(model, ds["test_loader_float"])
         if getattr(cfg, 'QAT_ENABLE', False):
             quant_acc = train_ann.evaluate_model(
@@ -514,16 +758,89 @@ def run_training(all_datasets, skip_train=False, quick=False):
                 ir_drop_coeff=cfg.QAT_IR_DROP_COEFF
             )
         W = train_ann.get_weights(model)
-        train_ann.save_weights(model, name)
-
+        if name not in pooled or hil_info is not None or prune_mask is not None:
+            train_ann.save_weights(model, name, fingerprint=fingerprints[name])
+        else:
+            train_ann.write_weights_fingerprint(name, fingerprints[name])
+        if ckpt is not None:
+            ckpt.clear()
+
+        stop_note = ""
+        if info["early_stopped"] or (qat_info is not None and qat_info["early_stopped"]):
+            stop_note = f", best@{info['converged_epoch']}/{info['epochs_run']}"
+            if qat_info is not None:
+                stop_note += f"+{qat_info['converged_epoch']}/{qat_info['epochs_run']}"
         if quant_acc is not None:
-            print(f"  {name:20s}: loss={history[-1]:.4f}, acc={acc:.2%}, QAT={quant_acc:.2%}")
+            print(f"  {name:20s}: loss={history[-1]:.4f}, acc={acc:.2%}, QAT={quant_acc:.2%}{stop_note}")
         else:
-            print(f"  {name:20s}: loss={history[-1]:.4f}, acc={acc:.2%}")
-        results[name] = {"float_acc": acc, "weights": W, "quant_acc": quant_acc}
+            print(f"  {name:20s}: loss={history[-1]:.4f}, acc={acc:.2%}{stop_note}")
+        programming = None
+        if prune_mask is not None:
+            programming = snn_engine.conductance_programming_stats(W, weight_bits=cfg.QAT_WEIGHT_BITS)
+            print(f"  {'':20s}  pruned: {programming['weight_sparsity']:.1%} zero weights, "
+                  f"{programming['driven_inputs']}/{programming['input_dim']} inputs driven, "
+                  f"{programming['unprogrammed_fraction']:.1%} cells need no programming")
+        if hil_info is not None and hil_info["best_val_acc"] is not None:
+            print(f"  {'':20s}  HIL: val spike acc={hil_info['best_val_acc']:.2%} "
+                  f"(epoch {hil_info['converged_epoch']}/{hil_info['epochs_run']})")
+        results[name] = {
+            "float_acc": acc, "weights": W, "quant_acc": quant_acc,
+            "converged_epoch": info["converged_epoch"],
+            "qat_converged_epoch": qat_info["converged_epoch"] if qat_info is not None else None,
+            "hil_converged_epoch": hil_info["converged_epoch"] if hil_info is not None else None,
+            "unprogrammed_fraction": programming["unprogrammed_fraction"] if programming else None,
+        }
 
     return results
 
+def run_hparam_scan(all_datasets, quick=False):
+    """
+    Hyperparameter scan: train every HPARAM_SCAN_GRID combination as one ensemble per method
+    (train_ann.train_hparam_ensemble), rank on val, write RESULTS_DIR/hparam_scan_<method>.csv.
+    Returns {method: rows sorted best-first}.
+    """
+    settings = train_ann.hparam_grid(**getattr(cfg, "HPARAM_SCAN_GRID", {}))
+    methods = list(getattr(cfg, "HPARAM_SCAN_METHODS", []) or all_datasets.keys())
+    epochs = cfg.QUICK_EPOCHS if quick else cfg.ANN_EPOCHS
+    qat_epochs = 0
+    if getattr(cfg, 'QAT_ENABLE', False):
+        qat_epochs = cfg.POST_QUANT_FINE_TUNE_EPOCHS
+        if quick:
+            qat_epochs = min(1, qat_epochs)
+    print(f"\n[hparam scan] {len(settings)} settings x {len(methods)} methods")
+
+    os.makedirs(cfg.RESULTS_DIR, exist_ok=True)
+    scan = {}
+    for name in methods:
+        ds = all_datasets[name]
+        x_train, y_train = train_ann.loader_tensors(ds["train_loader"])
+        val_inputs = val_labels = None
+        if ds.get("val_loader_float") is not None:
+            val_inputs, val_labels = train_ann.loader_tensors(ds["val_loader_float"])
+        t0 = time.time()
+        _, rows = train_ann.train_hparam_ensemble(
+            x_train, y_train, settings, epochs=epochs, qat_epochs=qat_epochs,
+            val_inputs=val_inputs, val_labels=val_labels,
+        )
+        rows.sort(key=lambda r: (-r.get("val_noisy_acc", 0.0), -r.get("val_quant_acc", 0.0)))
+        scan[name] = rows
+
+        path = os.path.join(cfg.RESULTS_DIR, f"hparam_scan_{name}.csv")
+        fields = list(rows[0].keys()) if rows else []
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"  {name:20s}: {time.time() - t0:.1f}s -> {path}")
+        for row in rows[:3]:
+            knobs = ", ".join(f"{k}={row[k]}" for k in settings[0].keys())
+            if "val_noisy_acc" in row:
+                print(f"    {knobs}: val={row['val_acc']:.2%}, quant={row['val_quant_acc']:.2%}, "
+                      f"noisy={row['val_noisy_acc']:.2%}")
+            else:
+                print(f"    {knobs}: loss={row['loss']:.4f}")
+    return scan
+
 
 # =====================================================
 #  姝ラ 3: 鍙傛暟鎵弿
@@ -555,7 +872,8 @@ def run_parameter_sweep(all_datasets, training_results, quick=False):
         "adc_sweep": {},        # tuning split
         "weight_sweep": {},     # tuning split
         "timestep_sweep": {},   # tuning split
-        "full_grid": [],        # exhaustive tuning split combinations
+        "full_grid": [],        # exhaustive tuning split combinations (snn_acc only on finalists,
+                                # screen_acc = last subset-rung accuracy)
         "full_grid_top": [],    # top-K by tuning accuracy
         "best_case": {},        # best tuning configuration (max acc)
         "noise_impact": {},     # tuning split
@@ -580,12 +898,12 @@ def run_parameter_sweep(all_datasets, training_results, quick=False):
     }
 
     eligible_methods = []
-    for name, ds in all_datasets.items():
-        input_dim = int(ds["input_dim"])
+    for name in all_datasets:
+        input_dim = all_datasets.input_dim(name)
         if target_input_dim > 0 and input_dim != target_input_dim:
             continue
         try:
-            _get_split_tensors(ds, tune_split)
+            _get_split_tensors(all_datasets[name], tune_split)
         except ValueError:
             continue
         eligible_methods.append(name)
@@ -681,62 +999,77 @@ def run_parameter_sweep(all_datasets, training_results, quick=False):
 
     # ---- 3b-1. 鍏ㄩ噺缁勫悎鎵弿 (method/scheme/ADC/W/T) ----
     print(f"\n  [3b-1] 鍏ㄩ噺缁勫悎鎵弿 (split={tune_split})...")
-    grid_total = (
-        len(eligible_methods)
-        * len(schemes)
-        * len(cfg.ADC_BITS_SWEEP)
-        * len(cfg.WEIGHT_BITS_SWEEP)
-        * len(cfg.TIMESTEPS_SWEEP)
-    )
-    grid_idx = 0
-    for method_name in eligible_methods:
-        ds = all_datasets[method_name]
-        W = training_results[method_name]["weights"]
-        images_eval, labels_eval = _get_split_tensors(ds, tune_split)
-        for scheme in schemes:
-            ratio = method_ratio[method_name].get(scheme, default_ratio)
-            for adc_bits in cfg.ADC_BITS_SWEEP:
-                for weight_bits in cfg.WEIGHT_BITS_SWEEP:
-                    for timesteps in cfg.TIMESTEPS_SWEEP:
-                        acc, _ = snn_engine.snn_inference(
-                            images_eval, labels_eval, W,
-                            adc_bits=adc_bits,
-                            weight_bits=weight_bits,
-                            timesteps=timesteps,
-                            scheme=scheme,
-                            threshold_ratio=ratio
-                        )
-                        results["full_grid"].append({
-                            "method": method_name,
-                            "scheme": scheme,
-                            "threshold_ratio": float(ratio),
-                            "adc_bits": int(adc_bits),
-                            "weight_bits": int(weight_bits),
-                            "timesteps": int(timesteps),
-                            "snn_acc": float(acc),
-                        })
-                        grid_idx += 1
-                        progress_bar(grid_idx, grid_total, prefix="鍏ㄩ噺缁勫悎")
+    combos = [
+        {
+            "method": method_name,
+            "scheme": scheme,
+            "threshold_ratio": float(method_ratio[method_name].get(scheme, default_ratio)),
+            "adc_bits": int(adc_bits),
+            "weight_bits": int(weight_bits),
+            "timesteps": int(timesteps),
+        }
+        for method_name in eligible_methods
+        for scheme in schemes
+        for adc_bits in cfg.ADC_BITS_SWEEP
+        for weight_bits in cfg.WEIGHT_BITS_SWEEP
+        for timesteps in cfg.TIMESTEPS_SWEEP
+    ]
+    ladder = _sweep_subset_ladder()
+    survivors = combos
+    for level, size in enumerate(ladder):
+        final_rung = level == len(ladder) - 1
+        eval_sets = {}
+        for grid_idx, record in enumerate(survivors, start=1):
+            name = record["method"]
+            if name not in eval_sets:
+                eval_sets[name] = data_utils.take_eval_subset(
+                    *_get_split_tensors(all_datasets[name], tune_split), size, split=tune_split)
+            images_eval, labels_eval = eval_sets[name]
+            acc, _ = snn_engine.snn_inference(
+                images_eval, labels_eval, training_results[name]["weights"],
+                adc_bits=record["adc_bits"],
+                weight_bits=record["weight_bits"],
+                timesteps=record["timesteps"],
+                scheme=record["scheme"],
+                threshold_ratio=record["threshold_ratio"]
+            )
+            if final_rung:
+                record["snn_acc"] = float(acc)
+                record["eval_samples"] = int(labels_eval.shape[0])
+            else:
+                # subset screening accuracy; snn_acc is reserved for full-split results
+                record["screen_acc"] = float(acc)
+                record["screen_samples"] = int(labels_eval.shape[0])
+            progress_bar(grid_idx, len(survivors),
+                         prefix="鍏ㄩ噺缁勫悎" if final_rung else f"subset {size}")
+        if not final_rung:
+            kept = _escalate_combos(survivors)
+            print(f"    subset {size}: {len(kept)}/{len(survivors)} combinations escalated")
+            survivors = kept
+    results["full_grid"] = combos
+    finalists = survivors
 
     if not results["full_grid"]:
         raise RuntimeError("full-grid sweep produced no records")
 
-    best_case = max(results["full_grid"], key=lambda x: x["snn_acc"])
+    best_case = max(finalists, key=lambda x: x["snn_acc"])
     margin = float(getattr(cfg, "RECOMMEND_ACC_MARGIN", 0.005))
     acc_floor = float(best_case["snn_acc"]) - margin
-    near_best = [x for x in results["full_grid"] if float(x["snn_acc"]) >= acc_floor]
+    near_best = [x for x in finalists if float(x["snn_acc"]) >= acc_floor]
     if not near_best:
         near_best = [best_case]
     recommendation = min(near_best, key=lambda x: _combo_cost_key(x, primary_scheme))
 
     topk_n = int(getattr(cfg, "SUMMARY_TOPK_COMBOS", 10))
     results["full_grid_top"] = sorted(
-        results["full_grid"], key=lambda x: float(x["snn_acc"]), reverse=True
+        finalists, key=lambda x: float(x["snn_acc"]), reverse=True
     )[:max(1, topk_n)]
     results["best_case"] = dict(best_case)
     results["recommendation"] = dict(recommendation)
     results["meta"]["recommend_margin"] = margin
     results["meta"]["full_grid_total"] = len(results["full_grid"])
+    results["meta"]["full_grid_finalists"] = len(finalists)
+    results["meta"]["sweep_subset_ladder"] = list(ladder)
     results["meta"]["downsample_best_method"] = downsample_best_method
 
     print(
@@ -1241,6 +1574,16 @@ def generate_summary(results, training_results, best_method, all_datasets):
             f"count={int(final_best_hw.get('zero_spike_count', 0))})"
         )
 
+    converged = {name: item for name, item in training_results.items()
+                 if item.get("converged_epoch") is not None}
+    if converged:
+        lines.append("\nANN converged epoch (best val checkpoint, float + QAT):")
+        for name in sorted(converged.keys()):
+            item = converged[name]
+            qat_epoch = item.get("qat_converged_epoch")
+            qat_text = f" + {qat_epoch}" if qat_epoch is not None else ""
+            lines.append(f"  {name:20s}: {item['converged_epoch']}{qat_text}")
+
     if top_grid:
         lines.append("\nTop full-grid combinations:")
         for i, item in enumerate(top_grid, start=1):
@@ -1373,6 +1716,8 @@ def main():
                         help='蹇€熸ā寮?(灏戦噺鏍锋湰锛岄€傚悎璋冭瘯)')
     parser.add_argument('--skip-train', action='store_true',
                         help='璺宠繃璁粌锛屽姞杞藉凡淇濆瓨鏉冮噸')
+    parser.add_argument('--hparam-scan', action='store_true',
+                        help='train the HPARAM_SCAN_GRID ensemble per method, write CSVs and exit')
     args = parser.parse_args()
 
     print("=" * 60)
@@ -1401,10 +1746,21 @@ def main():
     # 姝ラ 1: 鍑嗗鏁版嵁
     all_datasets = data_utils.prepare_all_datasets(quick_mode=args.quick)
 
+    if args.hparam_scan:
+        # Only HPARAM_SCAN_METHODS are built (lazily)
+        run_hparam_scan(all_datasets, quick=args.quick)
+        elapsed = time.time() - start_time
+        print(f"\nhparam scan finished in {elapsed:.1f}s")
+        return
+
+    all_datasets.materialize()
+
     # 姝ラ 2: 璁粌 ANN
     training_results = run_training(
         all_datasets, skip_train=args.skip_train, quick=args.quick
     )
+    # The sweep only needs uint8 splits: drop the float training copies
+    all_datasets.release_float()
 
     # 姝ラ 3: SNN 鎺ㄧ悊 + 鍙傛暟鎵弿
     sweep_results, best_method = run_parameter_sweep(
@@ -50,6 +50,11 @@ _PLUGIN_MODULE_CACHE = None
 _PLUGIN_MODULE_LOAD_TRIED = False
 _BACKEND_NOTES = []
 _BACKEND_NOTES_SEEN = set()
+_LEVEL_SET_OVERRIDE = None
+_LEVEL_SET_LOAD_TRIED = False
+_IV_BATCH_VARIATION_CACHE = None
+_IV_BATCH_VARIATION_TRIED = False
+_LEVEL_TABLE_CACHE = {}
 
 
 def _note_backend(message):
@@ -100,6 +105,10 @@ def _load_plugin_levels():
     """
     global _PLUGIN_LEVELS_CACHE, _PLUGIN_LEVELS_LOAD_TRIED
 
+    override = _get_level_set_override()
+    if override is not None:
+        return override["levels"]
+
     if _PLUGIN_LEVELS_LOAD_TRIED:
         return _PLUGIN_LEVELS_CACHE
     _PLUGIN_LEVELS_LOAD_TRIED = True
@@ -127,6 +136,122 @@ def _load_plugin_levels():
         return None
 
 
+def set_level_set(levels_norm, weight_bits=4, source=None):
+    """
+    用优化后的电平表覆盖器件默认的 log 间隔电平（见 level_optimizer.py）。
+
+    参数:
+        levels_norm: 归一化电平 [L]，值域 [0,1]（相对 g_max）
+        weight_bits: 该电平表对应的量化位宽
+        source:      来源说明（文件路径等），仅用于 backend 状态显示
+    传入 None 取消覆盖。
+    """
+    global _LEVEL_SET_OVERRIDE
+    if levels_norm is None:
+        _LEVEL_SET_OVERRIDE = None
+        return None
+    levels = torch.as_tensor(levels_norm, dtype=torch.float32).flatten()
+    levels = torch.sort(torch.unique(torch.clamp(levels, 0.0, 1.0)))[0]
+    if levels.numel() < 2:
+        raise ValueError("level set needs at least 2 distinct levels")
+    # 与插件电平加载保持同一约定：首元素为 0（差分对中"不导通"的一侧）
+    if levels[0] > 0:
+        levels = torch.cat([torch.zeros(1), levels])
+    _LEVEL_SET_OVERRIDE = {
+        "levels": levels,
+        "device_levels": levels[levels > 0] if levels[0] == 0 else levels,
+        "weight_bits": int(weight_bits),
+        "source": source,
+    }
+    _note_backend(
+        f"Using optimized level set ({int(levels.numel())} levels, {int(weight_bits)}-bit)"
+        + (f" from {source}" if source else "")
+    )
+    return levels
+
+
+def load_level_set(path):
+    """加载 level_optimizer 保存的电平文件并设为当前电平表。"""
+    try:
+        payload = torch.load(path, map_location="cpu", weights_only=False)
+    except TypeError:
+        payload = torch.load(path, map_location="cpu")
+    if isinstance(payload, dict):
+        levels = payload["levels_norm"]
+        weight_bits = int(payload.get("weight_bits", 4))
+    else:
+        levels = payload
+        weight_bits = 4
+    return set_level_set(levels, weight_bits=weight_bits, source=path)
+
+
+def _get_level_set_override():
+    """返回当前电平覆盖（首次调用时按 cfg.OPTIMIZED_LEVELS_PATH 自动加载）。"""
+    global _LEVEL_SET_LOAD_TRIED
+    if _LEVEL_SET_OVERRIDE is None and not _LEVEL_SET_LOAD_TRIED:
+        _LEVEL_SET_LOAD_TRIED = True
+        path = str(getattr(cfg, "OPTIMIZED_LEVELS_PATH", "") or "")
+        if path:
+            if os.path.exists(path):
+                try:
+                    load_level_set(path)
+                except Exception as exc:
+                    _note_backend(f"Failed to load optimized level set: {exc}")
+            else:
+                _note_backend(f"Optimized level set not found: {path}")
+    return _LEVEL_SET_OVERRIDE
+
+
+def _level_set_bits():
+    """电平表对应的位宽：有覆盖时取覆盖位宽，否则为器件原生 4-bit。"""
+    override = _get_level_set_override()
+    if override is not None:
+        return override["weight_bits"]
+    return 4
+
+
+def get_device_level_table(device_sim, weight_bits):
+    """
+    返回器件路径使用的真实电导电平表 [L]（单位与器件模型一致）。
+    位宽与电平表匹配时使用离散电平，否则返回 None（走线性量化）。
+    """
+    if weight_bits != _level_set_bits():
+        return None
+    g_min = float(device_sim.conductance_model.g_min)
+    g_max = float(device_sim.conductance_model.g_max)
+    override = _get_level_set_override()
+    if override is not None:
+        g_levels = torch.clamp(override["device_levels"] * g_max, min=g_min, max=g_max)
+        return torch.sort(torch.unique(g_levels))[0]
+    return torch.tensor(device_sim.conductance_levels, dtype=torch.float32)
+
+
+def _get_iv_batch_variation(module):
+    """按 cfg.IV_BATCH_PATH 拟合器件变化性（只拟合一次，失败返回 None）。"""
+    global _IV_BATCH_VARIATION_CACHE, _IV_BATCH_VARIATION_TRIED
+    if _IV_BATCH_VARIATION_TRIED:
+        return _IV_BATCH_VARIATION_CACHE
+    _IV_BATCH_VARIATION_TRIED = True
+    path = str(getattr(cfg, "IV_BATCH_PATH", "") or "")
+    if not path:
+        return None
+    fit = getattr(module, "variation_from_iv_batch", None)
+    if fit is None:
+        _note_backend("IV_BATCH_PATH set but plugin has no variation_from_iv_batch; using default variation.")
+        return None
+    try:
+        _IV_BATCH_VARIATION_CACHE = fit(path)
+        _note_backend(
+            f"Fitted device variation from {path}: "
+            f"D2D={_IV_BATCH_VARIATION_CACHE.die_to_die:.2%}, "
+            f"C2C={_IV_BATCH_VARIATION_CACHE.cell_to_cell:.2%}"
+        )
+    except Exception as exc:
+        _note_backend(f"Failed to fit variation from IV_BATCH_PATH: {exc}")
+        _IV_BATCH_VARIATION_CACHE = None
+    return _IV_BATCH_VARIATION_CACHE
+
+
 def _get_plugin_sim(rows, cols):
     """
     获取器件仿真器实例（按阵列尺寸缓存）。
@@ -147,7 +272,15 @@ def _get_plugin_sim(rows, cols):
             kwargs["rows"] = int(rows)
         if "cols" in ctor_sig.parameters:
             kwargs["cols"] = int(cols)
+        if "variation" in ctor_sig.parameters:
+            variation = _get_iv_batch_variation(module)
+            if variation is not None:
+                kwargs["variation"] = variation
         sim = module.MemristorArraySimulator(**kwargs)
+        if str(getattr(cfg, "READ_NOISE_MODEL", "signal")).lower() == "state" and hasattr(
+            sim, "read_noise_state_coeff"
+        ):
+            sim.read_noise_state_coeff = float(getattr(cfg, "READ_NOISE_STATE_COEFF", 0.0))
         _PLUGIN_SIM_CACHE[key] = sim
         if "rows" not in kwargs or "cols" not in kwargs:
             _note_backend(
@@ -181,6 +314,9 @@ def get_device_backend_status():
         "plugin_path_exists": os.path.exists(cfg.MEMRISTOR_PLUGIN_PATH),
         "plugin_levels_loaded": levels is not None,
         "plugin_levels_count": int(levels.numel()) if levels is not None else 0,
+        "level_set_source": (
+            _LEVEL_SET_OVERRIDE.get("source") or "runtime"
+        ) if _LEVEL_SET_OVERRIDE is not None else "device_default",
         "plugin_sim_available": sim_available,
         "plugin_sim_instances": len(sim_entries),
         "backend_mode": backend_mode,
@@ -210,13 +346,57 @@ def split_differential(W):
     return W_pos, W_neg
 
 
+def _level_table(levels):
+    """
+    电平表预处理（每张表只做一次）: 排序去重后的电平值，以及每个值在原表中第一次出现的索引。
+    以张量对象 + 版本号为键缓存，原地修改过的表会重新处理。
+    """
+    key = id(levels)
+    hit = _LEVEL_TABLE_CACHE.get(key)
+    if hit is not None and hit[0] is levels and hit[1] == levels._version:
+        return hit[2]
+    flat = levels.detach().reshape(-1)
+    uniq, inverse = torch.unique(flat, sorted=True, return_inverse=True)
+    first = torch.full((uniq.numel(),), flat.numel(), dtype=torch.long, device=flat.device)
+    first.scatter_reduce_(0, inverse, torch.arange(flat.numel(), device=flat.device), reduce="amin")
+    if len(_LEVEL_TABLE_CACHE) >= 64:
+        _LEVEL_TABLE_CACHE.clear()
+    _LEVEL_TABLE_CACHE[key] = (levels, levels._version, (uniq, first))
+    return uniq, first
+
+
+def nearest_level_index(values, levels):
+    """
+    最近电平索引，结果与 (values[..., None] - levels).abs().argmin(-1) 逐元素一致
+    （包括平局取表中靠前的电平），但不构造 [..., L] 的差值张量。
+
+    做法: 在排序后的电平表上 searchsorted 找到插入位置，只比较左右两个相邻电平的距离，
+    内存 O(N)、时间 O(N log L)。values 任意形状，levels 为一维电平表（可无序、可重复）。
+    """
+    uniq, first = _level_table(levels)
+    v = values.detach()
+    common = torch.promote_types(v.dtype, uniq.dtype)
+    hi = torch.searchsorted(uniq.to(common), v.to(common).contiguous())
+    hi = hi.clamp_(max=uniq.numel() - 1)
+    lo = (hi - 1).clamp_(min=0)
+    d_lo = (v - uniq[lo]).abs()
+    d_hi = (v - uniq[hi]).abs()
+    idx_lo = first[lo]
+    idx_hi = first[hi]
+    take_hi = (d_hi < d_lo) | ((d_hi == d_lo) & (idx_hi < idx_lo))
+    return torch.where(take_hi, idx_hi, idx_lo)
+
+
+def snap_to_levels(values, levels):
+    """把 values 吸附到最近的离散电平（nearest_level_index 的取值版本，不带梯度）。"""
+    return levels.reshape(-1)[nearest_level_index(values, levels)]
+
+
 def _nearest_level_quantize(normalized_values, normalized_levels):
     """
     将 [0,1] 的值量化到给定离散电平（最近邻）。
     """
-    diff = (normalized_values.unsqueeze(-1) - normalized_levels.view(1, 1, -1)).abs()
-    idx = diff.argmin(dim=-1)
-    return normalized_levels[idx]
+    return snap_to_levels(normalized_values, normalized_levels)
 
 
 def quantize_weights(W_half, weight_bits, mode='linear', ref_max=None, plugin_levels=None):
@@ -246,8 +426,8 @@ def quantize_weights(W_half, weight_bits, mode='linear', ref_max=None, plugin_le
 
     num_levels = 2 ** weight_bits
 
-    # 4-bit 时优先用器件电平（如果可用），并且与正/负支路共享同一个 ref_max。
-    if plugin_levels is not None and weight_bits == 4:
+    # 4-bit（或优化电平表对应位宽）时优先用离散电平，并且与正/负支路共享同一个 ref_max。
+    if plugin_levels is not None and weight_bits == _level_set_bits():
         levels = plugin_levels.to(device=W_half.device, dtype=W_half.dtype)
         normalized = torch.clamp(W_half / w_max, 0.0, 1.0)
         q_norm = _nearest_level_quantize(normalized, levels)
@@ -297,19 +477,26 @@ def _quantize_weights_device(W_half, weight_bits, device_sim, ref_max):
     """使用器件电导电平进行量化，返回真实电导值。"""
     if ref_max < 1e-10:
         return W_half.clone()
-    g_levels = torch.tensor(
-        device_sim.conductance_levels, device=W_half.device, dtype=W_half.dtype
-    )
-    g_max = g_levels.max()
+    g_levels = get_device_level_table(device_sim, weight_bits)
     normalized = torch.clamp(W_half / ref_max, 0.0, 1.0)
 
-    if weight_bits == 4:
+    if g_levels is not None:
         # 使用器件真实电平（不强行补零，体现漏电）
+        g_levels = g_levels.to(device=W_half.device, dtype=W_half.dtype)
+        g_max = g_levels.max()
+        if _get_level_set_override() is not None:
+            # 优化电平是相对器件 g_max 归一化的，最高电平不一定顶到 g_max
+            g_max = torch.tensor(
+                float(device_sim.conductance_model.g_max), device=W_half.device, dtype=W_half.dtype
+            )
         levels_norm = g_levels / g_max
         q_norm = _nearest_level_quantize(normalized, levels_norm)
         G = q_norm * g_max
     else:
         # 其它位宽：线性量化到 [0, g_max]
+        g_max = torch.tensor(
+            device_sim.conductance_levels, device=W_half.device, dtype=W_half.dtype
+        ).max()
         num_levels = 2 ** weight_bits
         step = 1.0 / (num_levels - 1)
         q_norm = torch.round(normalized / step) * step
@@ -331,6 +518,70 @@ def prepare_conductance_pair_device(W, weight_bits, device_sim):
     return G_pos, G_neg
 
 
+def active_input_columns(W):
+    """至少有一个非零权重的输入列索引；整列为零的输入 (剪掉的字线) 不需要驱动。"""
+    return torch.nonzero(W.detach().ne(0).any(dim=0), as_tuple=False).flatten()
+
+
+def count_unprogrammed_cells(G_pos, G_neg, erased_level=0.0):
+    """
+    差分对中停在擦除态的单元数，这些单元写阵列时可以跳过。
+    erased_level: 理想阵列为 0，器件模型为 g_min (HRS)。
+    """
+    limit = float(erased_level) * (1.0 + 1e-6)
+    return int((G_pos <= limit).sum().item()) + int((G_neg <= limit).sum().item())
+
+
+def _programming_stats(G_pos, G_neg, erased_level, input_dim, num_zero_weights=None):
+    """稀疏统计: G_* 只含被驱动的输入列，其余 (input_dim - driven) 列整列算作无需编程。"""
+    num_outputs, driven = int(G_pos.shape[0]), int(G_pos.shape[1])
+    total = 2 * num_outputs * int(input_dim)
+    skipped = count_unprogrammed_cells(G_pos, G_neg, erased_level) + 2 * num_outputs * (int(input_dim) - driven)
+    stats = {
+        "input_dim": int(input_dim),
+        "driven_inputs": driven,
+        "total_cells": total,
+        "programmed_cells": total - skipped,
+        "unprogrammed_fraction": skipped / float(max(1, total)),
+    }
+    if num_zero_weights is not None:
+        stats["weight_sparsity"] = num_zero_weights / float(max(1, num_outputs * int(input_dim)))
+    return stats
+
+
+def _drop_zero_inputs(W, images_uint8):
+    """稀疏 MAC: 去掉整列为零的输入列；全部为零或没有零列时原样返回。"""
+    if not bool(getattr(cfg, 'SPARSE_SKIP_ZERO_INPUTS', True)):
+        return W, images_uint8
+    cols = active_input_columns(W)
+    if cols.numel() == 0 or cols.numel() == W.shape[1]:
+        return W, images_uint8
+    return W[:, cols], images_uint8[:, cols]
+
+
+def conductance_programming_stats(W, weight_bits=4, quant_mode='linear', use_device_model=None):
+    """
+    稀疏电导表示的编程统计（与 snn_inference 相同的量化链路，不含噪声）:
+        input_dim / driven_inputs:   输入总数 / 需要驱动的输入数
+        total_cells / programmed_cells: 差分阵列单元总数 / 需要编程的单元数
+        unprogrammed_fraction:       停在擦除态、写阵列时可跳过的单元比例
+        weight_sparsity:             W 中零权重比例
+    """
+    if use_device_model is None:
+        use_device_model = getattr(cfg, 'USE_DEVICE_MODEL', False)
+    input_dim = int(W.shape[1])
+    num_zero = int(W.detach().eq(0).sum().item())
+    W_active, _ = _drop_zero_inputs(W, W[:1])
+    device_sim = _get_plugin_sim(W_active.shape[0], W_active.shape[1]) if use_device_model else None
+    if device_sim is not None:
+        G_pos, G_neg = prepare_conductance_pair_device(W_active, weight_bits, device_sim)
+        erased = float(device_sim.conductance_model.g_min)
+    else:
+        G_pos, G_neg = prepare_conductance_pair(W_active, weight_bits, quant_mode)
+        erased = 0.0
+    return _programming_stats(G_pos, G_neg, erased, input_dim, num_zero)
+
+
 def _cim_mac(spike_input, G, device_sim=None):
     """CIM 矩阵乘法：可选 IR drop 仿真。"""
     if device_sim is not None and device_sim.interconnect.ir_drop_active:
@@ -340,6 +591,43 @@ def _cim_mac(spike_input, G, device_sim=None):
     return spike_input @ G.T
 
 
+def _sim_supports_program_read(device_sim):
+    """插件是否提供 program/read 接口（旧版插件只有 matrix_vector_multiply）。"""
+    return (
+        device_sim is not None
+        and callable(getattr(device_sim, "program_conductance", None))
+        and callable(getattr(device_sim, "read", None))
+    )
+
+
+def _bitplane_macs(pixels, G_pos, G_neg, device_sim=None):
+    """
+    一次性计算所有 bit-plane 的 CIM 输出。
+
+    参数:
+        pixels: LongTensor [N, input_dim]
+    返回:
+        mac_pos, mac_neg: Tensor [PIXEL_BITS, N, num_outputs]，第 0 维按 bit 索引
+
+    同一张图在每一帧的 bit-plane 完全相同，所以 MAC（含 IR drop）只需算一次，
+    帧循环里只剩读噪声 / ADC / LIF。器件插件支持 program/read 时，
+    差分对作为两个 bank 写入后批量读取；读噪声仍由调用方注入，保持 RNG 顺序不变。
+    """
+    bits = torch.arange(cfg.PIXEL_BITS, device=pixels.device).view(-1, 1, 1)
+    planes = ((pixels.unsqueeze(0) >> bits) & 1).float()  # [B, N, input_dim]
+
+    if _sim_supports_program_read(device_sim):
+        device_sim.program_conductance(
+            torch.stack([G_pos, G_neg]), apply_variation=False, add_drift=False
+        )
+        out = device_sim.read(planes, add_noise=False)  # [2, B, N, num_outputs]
+        return out[0].to(G_pos.dtype), out[1].to(G_neg.dtype)
+
+    mac_pos = torch.stack([_cim_mac(p, G_pos, device_sim) for p in planes])
+    mac_neg = torch.stack([_cim_mac(p, G_neg, device_sim) for p in planes])
+    return mac_pos, mac_neg
+
+
 def _estimate_spike_threshold(fs_cfg, timesteps, ratio):
     """估算固定阈值（与 RTL 的 ~60% 经验一致）。"""
     if "signed" in fs_cfg:
@@ -435,6 +723,53 @@ def add_read_noise_to_signal(signal, full_scale, noise_sigma=None):
     return signal + torch.randn_like(signal) * sigma
 
 
+def _state_noise_std_planes(pixels, G_pos, G_neg, g_ref, scheme):
+    """
+    电导态相关读噪声：σ_j = READ_NOISE_SIGMA·g_ref + READ_NOISE_STATE_COEFF·G_j。
+    二值 bit-plane 输入下输出噪声方差 = Σ_j v_j·σ_j²，按 bit-plane 预先算好标准差。
+
+    返回 dict（键与 fs_cfg 一致），值为 [PIXEL_BITS, N, num_outputs]
+    """
+    k = float(getattr(cfg, "READ_NOISE_STATE_COEFF", 0.0))
+    base = float(cfg.READ_NOISE_SIGMA) * float(g_ref)
+    bits = torch.arange(cfg.PIXEL_BITS, device=pixels.device).view(-1, 1, 1)
+    planes = ((pixels.unsqueeze(0) >> bits) & 1).float()
+    var_pos = planes @ (base + k * G_pos.abs()).pow(2).T
+    var_neg = planes @ (base + k * G_neg.abs()).pow(2).T
+    if scheme == 'A':
+        return {"signed": (var_pos + var_neg).sqrt()}
+    return {"pos": var_pos.sqrt(), "neg": var_neg.sqrt()}
+
+
+def _add_read_noise(signal, full_scale, state_std, key, bit):
+    """按 READ_NOISE_MODEL 给一次 bit-plane 读出加噪声。"""
+    if state_std is None:
+        return add_read_noise_to_signal(signal, full_scale)
+    return signal + torch.randn_like(signal) * state_std[key][bit]
+
+
+def _make_telegraph_stream(shape):
+    """创建 RTN 流（使用插件中的 TelegraphNoiseStream），不可用时返回 None。"""
+    module = _load_plugin_module()
+    stream_cls = getattr(module, "TelegraphNoiseStream", None) if module is not None else None
+    if stream_cls is None:
+        _note_backend("RTN_ENABLE=True but plugin TelegraphNoiseStream is unavailable; RTN skipped.")
+        return None
+    return stream_cls(
+        shape,
+        p_capture=float(getattr(cfg, "RTN_P_CAPTURE", 0.05)),
+        p_emit=float(getattr(cfg, "RTN_P_EMIT", 0.05)),
+        amplitude=float(getattr(cfg, "RTN_AMPLITUDE", 0.02)),
+        active_fraction=float(getattr(cfg, "RTN_ACTIVE_FRACTION", 0.1)),
+    )
+
+
+def _rtn_mac(spike_input, G, stream):
+    """推进 RTN 一步，返回它对本次 MAC 的增量 Σ_j v_j·G_j·δ_j。"""
+    delta = stream.step()                                   # [N, num_outputs, input_dim]
+    return torch.einsum("nd,nod->no", spike_input, G.unsqueeze(0) * delta)
+
+
 # ==========================================================
 #  第3部分: ADC 量化
 # ==========================================================
@@ -515,6 +850,216 @@ def _normalize_scheme(scheme):
     return s
 
 
+# ---- 多 macro 分块映射 ----
+# 一个 macro = ARRAY_ROWS 条字线(输入) × ARRAY_COLS 条位线。
+# Scheme B 每个输出占一对差分列，所以一个 macro 放 ARRAY_COLS/2 个输出。
+# 超过一个 macro 的权重矩阵按 [row_tiles, col_tiles] 切块：
+#   - 列方向（输出）切块：各 tile 输出直接拼接
+#   - 行方向（输入）切块：各 tile 单独 ADC 后在数字域求和
+
+def plan_weight_tiles(num_outputs, input_dim, rows=None, cols=None):
+    """
+    计算 [num_outputs, input_dim] 权重在 macro 上的分块方案。
+
+    返回 dict:
+        macro_inputs / macro_outputs: 单个 macro 的物理容量
+        tile_inputs / tile_outputs:   实际计算用的 tile 尺寸（只有一块时不补零到物理尺寸）
+        row_tiles / col_tiles / num_tiles
+        utilization: 权重单元数 / 占用 macro 的物理单元数
+    """
+    rows = int(rows if rows is not None else getattr(cfg, "ARRAY_ROWS", 128))
+    cols = int(cols if cols is not None else getattr(cfg, "ARRAY_COLS", 256))
+    macro_outputs = max(1, cols // 2)
+    row_tiles = max(1, math.ceil(input_dim / rows))
+    col_tiles = max(1, math.ceil(num_outputs / macro_outputs))
+    num_tiles = row_tiles * col_tiles
+    return {
+        "num_outputs": int(num_outputs),
+        "input_dim": int(input_dim),
+        "macro_inputs": rows,
+        "macro_outputs": macro_outputs,
+        "tile_inputs": rows if row_tiles > 1 else int(input_dim),
+        "tile_outputs": macro_outputs if col_tiles > 1 else int(num_outputs),
+        "row_tiles": row_tiles,
+        "col_tiles": col_tiles,
+        "num_tiles": num_tiles,
+        "utilization": float(num_outputs * input_dim) / float(num_tiles * rows * macro_outputs),
+    }
+
+
+def _use_tiling(plan):
+    mode = str(getattr(cfg, "TILE_MAPPING", "auto")).lower()
+    if mode == "off":
+        return False
+    if mode == "on":
+        return True
+    return plan["num_tiles"] > 1
+
+
+def _tile_conductance(G, plan):
+    """G [O, D] → 补零后切成 [row_tiles, col_tiles, tile_outputs, tile_inputs]。"""
+    r, c = plan["row_tiles"], plan["col_tiles"]
+    ti, to = plan["tile_inputs"], plan["tile_outputs"]
+    G_pad = G.new_zeros(c * to, r * ti)
+    G_pad[:G.shape[0], :G.shape[1]] = G
+    return G_pad.view(c, to, r, ti).permute(2, 0, 1, 3).contiguous()
+
+
+def _tile_full_scale(G_pos, G_neg, plan, scheme):
+    """
+    每个 tile 的固定 ADC 满量程（该 tile 输入全为 1 时的最大列电流）。
+    返回 dict，值为 [row_tiles, col_tiles * tile_outputs]，可直接与 tile 输出广播。
+    """
+    to = plan["tile_outputs"]
+    fs_pos = _tile_conductance(G_pos, plan).sum(dim=-1).amax(dim=-1)  # [Tr, Tc]
+    fs_neg = _tile_conductance(G_neg, plan).sum(dim=-1).amax(dim=-1)
+    fs_pos = fs_pos.repeat_interleave(to, dim=1)
+    fs_neg = fs_neg.repeat_interleave(to, dim=1)
+    if scheme == 'A':
+        return {"signed": torch.maximum(fs_pos, fs_neg)}
+    return {"pos": fs_pos, "neg": fs_neg}
+
+
+def _tiled_bitplane_macs(pixels, G_pos, G_neg, plan, device_sim=None):
+    """
+    分块版 _bitplane_macs：所有 bit-plane × 所有 tile 一次批量计算。
+
+    返回:
+        mac_pos, mac_neg: [PIXEL_BITS, row_tiles, N, col_tiles * tile_outputs]
+                          行 tile 尚未求和（要先逐 tile 过 ADC）
+    """
+    r, c = plan["row_tiles"], plan["col_tiles"]
+    ti, to = plan["tile_inputs"], plan["tile_outputs"]
+    N = pixels.shape[0]
+
+    bits = torch.arange(cfg.PIXEL_BITS, device=pixels.device).view(-1, 1, 1)
+    planes = ((pixels.unsqueeze(0) >> bits) & 1).float()           # [B, N, D]
+    planes_pad = planes.new_zeros(planes.shape[0], N, r * ti)
+    planes_pad[:, :, :planes.shape[2]] = planes
+    planes_pad = planes_pad.view(planes.shape[0], N, r, ti)         # [B, N, Tr, Ti]
+
+    Gt_pos = _tile_conductance(G_pos, plan)                         # [Tr, Tc, To, Ti]
+    Gt_neg = _tile_conductance(G_neg, plan)
+
+    if device_sim is not None and device_sim.interconnect.ir_drop_active:
+        # IR drop 与 tile 几何相关：用 tile 尺寸的仿真器逐行 tile 计算
+        tile_sim = _get_plugin_sim(to, ti) or device_sim
+        outs_pos, outs_neg = [], []
+        for tr in range(r):
+            x = planes_pad[:, :, tr]                                  # [B, N, Ti]
+            if _sim_supports_program_read(tile_sim):
+                tile_sim.program_conductance(
+                    torch.cat([Gt_pos[tr], Gt_neg[tr]]), apply_variation=False, add_drift=False
+                )
+                out = tile_sim.read(x, add_noise=False).to(G_pos.dtype)  # [2Tc, B, N, To]
+                out_pos, out_neg = out[:c], out[c:]
+            else:
+                out_pos = torch.stack([
+                    torch.stack([_cim_mac(p, Gt_pos[tr, tc], tile_sim) for p in x]) for tc in range(c)
+                ])
+                out_neg = torch.stack([
+                    torch.stack([_cim_mac(p, Gt_neg[tr, tc], tile_sim) for p in x]) for tc in range(c)
+                ])
+            # [Tc, B, N, To] → [B, N, Tc*To]
+            outs_pos.append(out_pos.permute(1, 2, 0, 3).reshape(planes.shape[0], N, c * to))
+            outs_neg.append(out_neg.permute(1, 2, 0, 3).reshape(planes.shape[0], N, c * to))
+        return torch.stack(outs_pos, dim=1), torch.stack(outs_neg, dim=1)
+
+    shape = (planes.shape[0], r, N, c * to)
+    active = Gt_pos.ne(0).any(dim=3).any(dim=2) | Gt_neg.ne(0).any(dim=3).any(dim=2)  # [Tr, Tc]
+    if not bool(active.all()):
+        # 稀疏：全零 tile（剪枝后整块无需编程）不读，输出保持 0
+        mac_pos = planes_pad.new_zeros(planes.shape[0], r, N, c, to)
+        mac_neg = planes_pad.new_zeros(planes.shape[0], r, N, c, to)
+        for tr, tc in active.nonzero().tolist():
+            x = planes_pad[:, :, tr]                                  # [B, N, Ti]
+            mac_pos[:, tr, :, tc] = x @ Gt_pos[tr, tc].T
+            mac_neg[:, tr, :, tc] = x @ Gt_neg[tr, tc].T
+        return mac_pos.reshape(shape), mac_neg.reshape(shape)
+
+    # 理想阵列：一次 einsum 覆盖所有 bit-plane 与所有 tile
+    mac_pos = torch.einsum("bnri,rcoi->brnco", planes_pad, Gt_pos)
+    mac_neg = torch.einsum("bnri,rcoi->brnco", planes_pad, Gt_neg)
+    return mac_pos.reshape(shape), mac_neg.reshape(shape)
+
+
+def _quantize_adc_tiles(values, adc_bits, full_scale, signed):
+    """quantize_adc 的逐 tile 版本：full_scale 为可广播张量。"""
+    num_levels = 2 ** adc_bits
+    fs = full_scale.clamp(min=1e-30)
+    if signed:
+        step = (2 * fs) / (num_levels - 1)
+        quantized = torch.round(values / step) * step
+        return torch.maximum(torch.minimum(quantized, fs), -fs)
+    step = fs / (num_levels - 1)
+    quantized = torch.round(values / step) * step
+    return torch.minimum(torch.clamp(quantized, min=0.0), fs)
+
+
+def _dynamic_tile_full_scale(values, plan, signed):
+    """dynamic 量程模式下，按 tile 取当前读出的最大值。"""
+    r, c, to = values.shape[0], plan["col_tiles"], plan["tile_outputs"]
+    v = values.abs() if signed else values
+    fs = v.reshape(r, -1, c, to).amax(dim=(1, 3))
+    return fs.repeat_interleave(to, dim=1).unsqueeze(1)
+
+
+def _tiled_adc_read(mac_pos, mac_neg, tile_fs, plan, scheme, adc_bits, add_noise):
+    """
+    单个 bit-plane 的分块读出：逐 tile 注入读噪声 + ADC，再把行 tile 数字求和。
+    mac_pos/mac_neg: [row_tiles, N, col_tiles*tile_outputs]
+    返回: [N, num_outputs]
+    """
+    dynamic = str(cfg.ADC_FULL_SCALE_MODE) == "dynamic"
+    if scheme == 'A':
+        fs = tile_fs["signed"].unsqueeze(1)
+        mac_diff = mac_pos - mac_neg
+        if add_noise:
+            mac_diff = mac_diff + torch.randn_like(mac_diff) * cfg.READ_NOISE_SIGMA * fs.clamp(min=1e-12)
+        if dynamic:
+            fs = _dynamic_tile_full_scale(mac_diff, plan, signed=True)
+        adc = _quantize_adc_tiles(mac_diff, adc_bits, fs, signed=True)
+    else:
+        fs_pos = tile_fs["pos"].unsqueeze(1)
+        fs_neg = tile_fs["neg"].unsqueeze(1)
+        if add_noise:
+            mac_pos = mac_pos + torch.randn_like(mac_pos) * cfg.READ_NOISE_SIGMA * fs_pos.clamp(min=1e-12)
+            mac_neg = mac_neg + torch.randn_like(mac_neg) * cfg.READ_NOISE_SIGMA * fs_neg.clamp(min=1e-12)
+        if dynamic:
+            fs_pos = _dynamic_tile_full_scale(mac_pos, plan, signed=False)
+            fs_neg = _dynamic_tile_full_scale(mac_neg, plan, signed=False)
+        adc = (
+            _quantize_adc_tiles(mac_pos, adc_bits, fs_pos, signed=False)
+            - _quantize_adc_tiles(mac_neg, adc_bits, fs_neg, signed=False)
+        )
+    return adc.sum(dim=0)[:, :plan["num_outputs"]]
+
+
+def estimate_tile_throughput(plan, macro_counts=(1, 2, 4, 8, 16), timesteps=1):
+    """
+    估算吞吐量随 macro 数量的变化（理想流水，忽略数字累加开销）。
+
+    每个 bit-plane 需要把所有 tile 各读一次；M 个 macro 并行时
+    一个 bit-plane 需 ceil(num_tiles / M) 轮读出。
+    返回 list[dict]: macros / reads_per_sample / speedup / macro_utilization
+    """
+    steps = cfg.PIXEL_BITS * max(1, int(timesteps))
+    num_tiles = plan["num_tiles"]
+    base = steps * num_tiles
+    rows = []
+    for m in macro_counts:
+        m = max(1, int(m))
+        rounds = math.ceil(num_tiles / m)
+        reads = steps * rounds
+        rows.append({
+            "macros": m,
+            "reads_per_sample": reads,
+            "speedup": base / reads,
+            "macro_utilization": num_tiles / float(rounds * m),
+        })
+    return rows
+
+
 def snn_inference(test_images_uint8, test_labels, W, adc_bits=8,
                   weight_bits=4, timesteps=1, scheme='A',
                   add_noise=False, quant_mode='linear',
@@ -528,8 +1073,23 @@ def snn_inference(test_images_uint8, test_labels, W, adc_bits=8,
     decision:
         - 'spike' / 'count' : 使用每个输出神经元的发放次数做分类
         - 'membrane'        : 直接对最终膜电位做 argmax 分类
+
+    稀疏权重: 整列为零的输入 (剪掉的字线) 不驱动，直接从 MAC 和 tile 规划中去掉
+    (SPARSE_SKIP_ZERO_INPUTS)；全零 tile 不读。return_stats 时附带编程统计 (见
+    conductance_programming_stats)。
+
+    事件流输入: test_images_uint8 为 [N, T, D] 时每个时间步使用各自的一帧 (event_stream.py)，
+    timesteps 取 T；bit-plane MAC 对全部 N×T 帧一次算完。
     """
     N = test_images_uint8.shape[0]
+    num_frames = None
+    if test_images_uint8.dim() == 3:
+        num_frames = int(test_images_uint8.shape[1])
+        timesteps = num_frames
+        test_images_uint8 = test_images_uint8.reshape(N * num_frames, -1)
+    full_input_dim = W.shape[1]
+    num_zero_weights = int(W.detach().eq(0).sum().item()) if return_stats else None
+    W, test_images_uint8 = _drop_zero_inputs(W, test_images_uint8)
     input_dim = W.shape[1]
     num_outputs = W.shape[0]
 
@@ -552,6 +1112,18 @@ def snn_inference(test_images_uint8, test_labels, W, adc_bits=8,
     # Keep ADC full-scale tied to nominal conductance map (hardware-fixed reference).
     fs_cfg = estimate_adc_full_scale(G_pos, G_neg, scheme)
 
+    programming = None
+    if return_stats:
+        erased = float(device_sim.conductance_model.g_min) if device_sim is not None else 0.0
+        programming = _programming_stats(G_pos, G_neg, erased, full_input_dim, num_zero_weights)
+
+    # 超过一个 macro 时按 tile 映射（每个 tile 独立的固定 ADC 量程）
+    tile_plan = plan_weight_tiles(num_outputs, input_dim)
+    tiled = _use_tiling(tile_plan)
+    tile_fs = _tile_full_scale(G_pos, G_neg, tile_plan, scheme) if tiled else None
+
+    g_ref = max(float(G_pos.max()), float(G_neg.max()))
+
     # ---- Step 3: 注入器件非理想 ----
     if add_noise:
         if device_sim is not None:
@@ -579,19 +1151,55 @@ def snn_inference(test_images_uint8, test_labels, W, adc_bits=8,
 
     pixels = test_images_uint8.long()  # [N, input_dim]
 
+    # CIM MAC（可选 IR drop 建模）：各 bit-plane 只算一次，帧间复用
+    if tiled:
+        mac_planes_pos, mac_planes_neg = _tiled_bitplane_macs(
+            pixels, G_pos, G_neg, tile_plan, device_sim
+        )
+    else:
+        mac_planes_pos, mac_planes_neg = _bitplane_macs(pixels, G_pos, G_neg, device_sim)
+    if num_frames is not None:
+        # [..., N*T, out] → [..., N, T, out]，帧循环里按时间步取
+        mac_planes_pos = mac_planes_pos.unflatten(-2, (N, num_frames))
+        mac_planes_neg = mac_planes_neg.unflatten(-2, (N, num_frames))
+
+    # 读噪声模型 / RTN（带时间相关性，每个 bit-plane 子时间步推进一次）
+    state_std = None
+    rtn_pos = rtn_neg = None
+    if add_noise:
+        use_state = str(getattr(cfg, "READ_NOISE_MODEL", "signal")).lower() == "state"
+        use_rtn = bool(getattr(cfg, "RTN_ENABLE", False))
+        if tiled and (use_state or use_rtn):
+            _note_backend("READ_NOISE_MODEL=state / RTN are not modeled on the tiled path; using signal noise.")
+        elif num_frames is not None and (use_state or use_rtn):
+            _note_backend("READ_NOISE_MODEL=state / RTN are not modeled for [N, T, D] inputs; using signal noise.")
+        elif use_state:
+            state_std = _state_noise_std_planes(pixels, G_pos, G_neg, g_ref, scheme)
+        if use_rtn and not tiled and num_frames is None:
+            rtn_pos = _make_telegraph_stream((N, num_outputs, input_dim))
+            rtn_neg = _make_telegraph_stream((N, num_outputs, input_dim)) if rtn_pos is not None else None
+
     for frame in range(timesteps):
         for bit in range(cfg.PIXEL_BITS - 1, -1, -1):
-            spike_input = ((pixels >> bit) & 1).float()  # [N, input_dim]
-
-            # CIM MAC（可选 IR drop 建模）
-            mac_pos = _cim_mac(spike_input, G_pos, device_sim)
-            mac_neg = _cim_mac(spike_input, G_neg, device_sim)
+            mac_pos = mac_planes_pos[bit]
+            mac_neg = mac_planes_neg[bit]
+            if num_frames is not None:
+                mac_pos = mac_pos.select(-2, frame)
+                mac_neg = mac_neg.select(-2, frame)
+            if rtn_pos is not None:
+                spike_input = ((pixels >> bit) & 1).float()
+                mac_pos = mac_pos + _rtn_mac(spike_input, G_pos, rtn_pos)
+                mac_neg = mac_neg + _rtn_mac(spike_input, G_neg, rtn_neg)
 
             # 差分方案 + ADC 量化
-            if scheme == 'A':
+            if tiled:
+                adc_out = _tiled_adc_read(
+                    mac_pos, mac_neg, tile_fs, tile_plan, scheme, adc_bits, add_noise
+                )
+            elif scheme == 'A':
                 mac_diff = mac_pos - mac_neg
                 if add_noise:
-                    mac_diff = add_read_noise_to_signal(mac_diff, fs_cfg['signed'])
+                    mac_diff = _add_read_noise(mac_diff, fs_cfg['signed'], state_std, 'signed', bit)
                 adc_out = quantize_adc(
                     mac_diff,
                     adc_bits,
@@ -601,8 +1209,8 @@ def snn_inference(test_images_uint8, test_labels, W, adc_bits=8,
                 )
             elif scheme == 'B':
                 if add_noise:
-                    mac_pos = add_read_noise_to_signal(mac_pos, fs_cfg['pos'])
-                    mac_neg = add_read_noise_to_signal(mac_neg, fs_cfg['neg'])
+                    mac_pos = _add_read_noise(mac_pos, fs_cfg['pos'], state_std, 'pos', bit)
+                    mac_neg = _add_read_noise(mac_neg, fs_cfg['neg'], state_std, 'neg', bit)
                 adc_pos = quantize_adc(
                     mac_pos,
                     adc_bits,
@@ -658,6 +1266,8 @@ def snn_inference(test_images_uint8, test_labels, W, adc_bits=8,
 
     accuracy = (predictions == test_labels).sum().item() / N
     if return_stats:
+        stats["num_tiles"] = int(tile_plan["num_tiles"]) if tiled else 1
+        stats.update(programming)
         stats["acc"] = float(accuracy)
         return accuracy, membranes, stats
     return accuracy, membranes
@@ -676,10 +1286,14 @@ def snn_inference_ideal(test_images_uint8, test_labels, W, timesteps=1):
     N = test_images_uint8.shape[0]
     membranes = torch.zeros(N, W.shape[0])
     pixels = test_images_uint8.long()
+    if pixels.dim() == 3:
+        # 事件流输入 [N, T, D]
+        timesteps = pixels.shape[1]
 
     for frame in range(timesteps):
+        frame_pixels = pixels[:, frame] if pixels.dim() == 3 else pixels
         for bit in range(cfg.PIXEL_BITS - 1, -1, -1):
-            spike_input = ((pixels >> bit) & 1).float()
+            spike_input = ((frame_pixels >> bit) & 1).float()
             mac = spike_input @ W.T  # 直接用原始权重，无差分拆分
             membranes += mac * (2 ** bit)
 
@@ -737,15 +1351,15 @@ def snn_inference_adaptive_threshold(test_images_uint8, test_labels, W,
             G_neg = add_device_variation(G_neg, d2d_factor=shared_d2d)
 
     pixels = test_images_uint8.long()
+    mac_planes_pos, mac_planes_neg = _bitplane_macs(pixels, G_pos, G_neg, device_sim)
 
     # 估计初始阈值
     init_samples = max(1, int(getattr(cfg, 'ADAPTIVE_INIT_SAMPLES', 512)))
     sample_n = min(init_samples, N)
     sample_membrane = torch.zeros(sample_n, num_outputs)
     for bit in range(cfg.PIXEL_BITS - 1, -1, -1):
-        spike = ((pixels[:sample_n] >> bit) & 1).float()
-        mac_pos = _cim_mac(spike, G_pos, device_sim)
-        mac_neg = _cim_mac(spike, G_neg, device_sim)
+        mac_pos = mac_planes_pos[bit, :sample_n]
+        mac_neg = mac_planes_neg[bit, :sample_n]
         if scheme == 'A':
             sample_signal = mac_pos - mac_neg
             if add_noise:
@@ -791,9 +1405,8 @@ def snn_inference_adaptive_threshold(test_images_uint8, test_labels, W,
 
     for frame in range(timesteps):
         for bit in range(cfg.PIXEL_BITS - 1, -1, -1):
-            spike_input = ((pixels >> bit) & 1).float()
-            mac_pos = _cim_mac(spike_input, G_pos, device_sim)
-            mac_neg = _cim_mac(spike_input, G_neg, device_sim)
+            mac_pos = mac_planes_pos[bit]
+            mac_neg = mac_planes_neg[bit]
 
             if scheme == 'A':
                 mac_diff = mac_pos - mac_neg
@@ -845,3 +1458,134 @@ def snn_inference_adaptive_threshold(test_images_uint8, test_labels, W,
 
     accuracy = (predictions == test_labels).sum().item() / N
     return accuracy, spike_counts
+
+
+# ==========================================================
+#  第5部分: 可微 SNN 前向 (硬件在环微调用)
+# ==========================================================
+
+class _SurrogateSpike(torch.autograd.Function):
+    """
+    发放函数: 前向是阶跃 (x >= 0)，反向用 fast-sigmoid 导数 1 / (slope*|x| + 1)^2。
+    x 是按阈值归一化后的膜电位 (V - Vth) / Vth。
+    """
+    @staticmethod
+    def forward(ctx, x, slope):
+        ctx.save_for_backward(x)
+        ctx.slope = slope
+        return (x >= 0).to(x.dtype)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        (x,) = ctx.saved_tensors
+        return grad_output / (ctx.slope * x.abs() + 1.0) ** 2, None
+
+
+def _quantize_adc_ste(values, adc_bits, signed, full_scale):
+    """
+    ADC 量化的直通版本: 前向与 quantize_adc 完全一致，
+    反向在量程内梯度为 1，被截断 (饱和) 的位置梯度为 0。
+    """
+    q = quantize_adc(values.detach(), adc_bits, signed=signed, full_scale=full_scale,
+                     full_scale_mode=cfg.ADC_FULL_SCALE_MODE)
+    if cfg.ADC_FULL_SCALE_MODE != "dynamic" and full_scale is not None and full_scale >= 1e-30:
+        lo = -full_scale if signed else 0.0
+        inside = ((values >= lo) & (values <= full_scale)).to(values.dtype)
+        values = values * inside + (values * (1.0 - inside)).detach()
+    return values + (q - values).detach()
+
+
+def snn_forward_surrogate(images_uint8, W, adc_bits=8, weight_bits=4, timesteps=1,
+                          scheme='B', threshold_ratio=None, reset_mode=None,
+                          quant_mode='linear', use_device_model=None, add_noise=False,
+                          slope=None):
+    """
+    可微的 bit-plane SNN 前向，供硬件在环 (HIL) 微调使用。
+
+    前向与 snn_inference(add_noise=False) 的理想 MAC 路径逐值一致:
+      差分量化 (prepare_conductance_pair[_device]) → bit-plane MAC → 固定量程 ADC → LIF 累加/发放。
+    反向:
+      - 电导量化: STE，梯度按 G ≈ W±·g_scale 直通回 W
+      - ADC 取整: STE (饱和区梯度为 0)
+      - 发放: fast-sigmoid 代理梯度 (slope 默认 cfg.HIL_SURROGATE_SLOPE)
+    所有 bit-plane 一次 GEMM: [PIXEL_BITS·N, D] @ [D, 2·O]，ADC 也对整块做一次；
+    只有 LIF 的 T × PIXEL_BITS 步是逐步的逐元素运算。
+
+    不建模: IR drop（插件 read 不可微）、多 tile 映射、RTN / 状态相关读噪声；
+    add_noise=True 时每帧注入 signal 读噪声 (add_read_noise_to_signal)。
+
+    返回:
+        spike_counts: [N, num_outputs]（可微，经代理梯度）
+        membranes:    [N, num_outputs] 最终膜电位
+        threshold:    float，使用的固定阈值
+    """
+    num_outputs, input_dim = int(W.shape[0]), int(W.shape[1])
+    if use_device_model is None:
+        use_device_model = getattr(cfg, 'USE_DEVICE_MODEL', False)
+    if reset_mode is None:
+        reset_mode = getattr(cfg, 'SPIKE_RESET_MODE', 'soft')
+    if threshold_ratio is None:
+        threshold_ratio = float(getattr(cfg, 'SPIKE_THRESHOLD_RATIO', 0.6))
+    if slope is None:
+        slope = float(getattr(cfg, 'HIL_SURROGATE_SLOPE', 5.0))
+    scheme = _normalize_scheme(scheme)
+
+    device_sim = _get_plugin_sim(num_outputs, input_dim) if use_device_model else None
+    with torch.no_grad():
+        W_det = W.detach()
+        if device_sim is not None:
+            Gq_pos, Gq_neg = prepare_conductance_pair_device(W_det, weight_bits, device_sim)
+        else:
+            Gq_pos, Gq_neg = prepare_conductance_pair(W_det, weight_bits, quant_mode)
+    fs_cfg = estimate_adc_full_scale(Gq_pos, Gq_neg, scheme)
+    threshold = _estimate_spike_threshold(fs_cfg, timesteps, threshold_ratio)
+
+    # 电导 STE: 前向取量化电导，反向按线性映射 W± → G 直通
+    w_max = float(W_det.abs().max())
+    g_scale = max(float(Gq_pos.max()), float(Gq_neg.max())) / w_max if w_max > 1e-10 else 1.0
+    lin_pos = torch.clamp(W, min=0) * g_scale
+    lin_neg = torch.clamp(-W, min=0) * g_scale
+    G_pos = lin_pos + (Gq_pos.to(W.dtype) - lin_pos).detach()
+    G_neg = lin_neg + (Gq_neg.to(W.dtype) - lin_neg).detach()
+
+    pixels = images_uint8.long()
+    n = int(pixels.shape[0])
+    bits = torch.arange(cfg.PIXEL_BITS, device=pixels.device).view(-1, 1, 1)
+    planes = ((pixels.unsqueeze(0) >> bits) & 1).to(W.dtype)  # [B, N, D]
+    macs = (planes.reshape(-1, input_dim) @ torch.cat([G_pos, G_neg]).t()).view(
+        cfg.PIXEL_BITS, n, 2 * num_outputs
+    )
+    mac_pos, mac_neg = macs[..., :num_outputs], macs[..., num_outputs:]
+
+    frames = max(1, int(timesteps))
+    if add_noise:
+        # 每帧独立噪声 → [T, B, N, O]
+        mac_pos = mac_pos.unsqueeze(0).expand(frames, -1, -1, -1)
+        mac_neg = mac_neg.unsqueeze(0).expand(frames, -1, -1, -1)
+    if scheme == 'A':
+        diff = mac_pos - mac_neg
+        if add_noise:
+            diff = add_read_noise_to_signal(diff, fs_cfg['signed'])
+        adc = _quantize_adc_ste(diff, adc_bits, True, fs_cfg['signed'])
+    else:
+        if add_noise:
+            mac_pos = add_read_noise_to_signal(mac_pos, fs_cfg['pos'])
+            mac_neg = add_read_noise_to_signal(mac_neg, fs_cfg['neg'])
+        adc = (_quantize_adc_ste(mac_pos, adc_bits, False, fs_cfg['pos'])
+               - _quantize_adc_ste(mac_neg, adc_bits, False, fs_cfg['neg']))
+    weights = (2 ** bits).to(adc.dtype)
+    adc = adc * weights  # 逐 bit 权重 2^bit（2 的幂，乘法无舍入）
+
+    membranes = torch.zeros(n, num_outputs, dtype=adc.dtype, device=adc.device)
+    spike_counts = torch.zeros_like(membranes)
+    for frame in range(frames):
+        frame_adc = adc[frame] if add_noise else adc
+        for bit in range(cfg.PIXEL_BITS - 1, -1, -1):
+            membranes = membranes + frame_adc[bit]
+            spikes = _SurrogateSpike.apply((membranes - threshold) / threshold, slope)
+            spike_counts = spike_counts + spikes
+            if reset_mode == 'hard':
+                membranes = membranes * (1.0 - spikes)
+            else:
+                membranes = membranes - spikes * threshold
+    return spike_counts, membranes, threshold
@@ -25,9 +25,18 @@ ANN-to-SNN 转换说明：
 """
 
 import os
+import json
+import random
+import hashlib
+import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
+from torch.utils.data import (DataLoader, TensorDataset, RandomSampler, SequentialSampler,
+                              BatchSampler, default_collate)
 import config as cfg
 
 
@@ -71,10 +80,16 @@ def _get_qat_levels():
 
 
 def _fake_quantize_signed(weights, weight_bits, levels=None):
-    """Signed fake quantization with STE. If levels provided, use device levels for magnitude."""
-    max_abs = weights.abs().max()
-    if max_abs < 1e-12:
-        return weights
+    """
+    Signed fake quantization with STE. If levels provided, use device levels for magnitude.
+    weights may be [O, D] or a stack [M, O, D] (independent max_abs per matrix).
+    """
+    if weights.dim() == 3:
+        max_abs = weights.detach().abs().amax(dim=(1, 2), keepdim=True).clamp(min=1e-12)
+    else:
+        max_abs = weights.abs().max()
+        if max_abs < 1e-12:
+            return weights
     if levels is None:
         qmax = (2 ** (weight_bits - 1)) - 1
         if qmax <= 0:
@@ -82,16 +97,19 @@ def _fake_quantize_signed(weights, weight_bits, levels=None):
         step = max_abs / qmax
         w_q = torch.round(weights / step) * step
     else:
+        import snn_engine
         sign = torch.sign(weights)
         mag = weights.abs() / max_abs
-        diff = (mag.unsqueeze(-1) - levels.view(1, 1, -1)).abs()
-        idx = diff.argmin(dim=-1)
-        q_mag = levels[idx]
+        q_mag = snn_engine.snap_to_levels(mag, levels)
         w_q = sign * q_mag * max_abs
     return weights + (w_q - weights).detach()
 
 
 def _apply_qat_noise(w_q, noise_std):
+    if w_q.dim() == 3:
+        # 批量 [M, O, D]：每个矩阵按自己的 max_abs 缩放
+        max_abs = w_q.detach().abs().amax(dim=(1, 2), keepdim=True)
+        return w_q + torch.randn_like(w_q) * noise_std * max_abs
     if noise_std is None or noise_std <= 0:
         return w_q
     max_abs = w_q.abs().max()
@@ -101,7 +119,14 @@ def _apply_qat_noise(w_q, noise_std):
     return w_q + noise
 
 
-def _ir_drop_scale(inputs, coeff):
+def _ir_drop_scale(inputs, coeff, input_dims=None):
+    """
+    input_dims: 批量输入 [M, B, D_pad] 时各方法的真实维度 [M,1,1]，
+                均值按 sum / 真实维度计算，补零的列不稀释 IR drop。
+    """
+    if input_dims is not None:
+        scale = 1.0 - coeff * (inputs.sum(dim=-1, keepdim=True) / input_dims)
+        return torch.clamp(scale, 0.8, 1.0)
     if coeff is None or coeff <= 0:
         return None
     # simple proxy: larger input -> larger attenuation
@@ -109,10 +134,546 @@ def _ir_drop_scale(inputs, coeff):
     return torch.clamp(scale, 0.8, 1.0)
 
 
+def _tensor_loader_plan(loader):
+    """
+    判断 loader 是否是"常驻内存的 TensorDataset + 默认采样/拼接"，
+    是则返回 (tensors, batch_size, drop_last, sampler)，否则返回 None。
+    """
+    if not isinstance(getattr(loader, "dataset", None), TensorDataset):
+        return None
+    if getattr(loader, "num_workers", 0) != 0 or loader.collate_fn is not default_collate:
+        return None
+    batch_sampler = getattr(loader, "batch_sampler", None)
+    if type(batch_sampler) is not BatchSampler:
+        return None
+    sampler = batch_sampler.sampler
+    n = len(loader.dataset)
+    if type(sampler) is RandomSampler:
+        if sampler.replacement or sampler.num_samples != n:
+            return None
+    elif type(sampler) is not SequentialSampler:
+        return None
+    return loader.dataset.tensors, batch_sampler.batch_size, batch_sampler.drop_last, sampler
+
+
+def iterate_batches(loader):
+    """
+    不经过 DataLoader 的 minibatch 迭代（TensorDataset 专用，其他 loader 原样迭代）。
+
+    每个 epoch 只做一次索引置换：整份数据按 perm 重排一次，之后按连续切片取 batch，
+    batch 是视图，没有逐样本 collate 开销。uint8 数据集 (data_utils.Uint8TensorDataset)
+    按 uint8 重排，每个 batch 再即时转成 float。
+    随机数消耗与 DataLoader 完全一致（每 epoch 先取 base seed，RandomSampler 再取
+    采样种子 + randperm），所以 batch 顺序和后续 QAT 噪声都与原实现逐位相同。
+    """
+    plan = _tensor_loader_plan(loader)
+    if plan is None:
+        yield from loader
+        return
+    tensors, batch_size, drop_last, sampler = plan
+    n = len(tensors[0])
+    to_float = getattr(loader.dataset, "batch_to_float", None)
+
+    # _BaseDataLoaderIter.__init__ 每个 epoch 都会取一次 base seed
+    torch.empty((), dtype=torch.int64).random_(generator=loader.generator)
+
+    if isinstance(sampler, RandomSampler):
+        generator = sampler.generator
+        if generator is None:
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+            generator = torch.Generator()
+            generator.manual_seed(seed)
+        perm = torch.randperm(n, generator=generator)
+        if sampler.generator is not None:
+            # RandomSampler 迭代结束时还会调用一次 randperm(n)[:0]，共享生成器要同步推进
+            torch.randperm(n, generator=generator)
+        tensors = [t[perm] for t in tensors]
+
+    stop = (n // batch_size) * batch_size if drop_last else n
+    for start in range(0, stop, batch_size):
+        batch = tuple(t[start:start + batch_size] for t in tensors)
+        if to_float is not None:
+            batch = (to_float(batch[0]),) + batch[1:]
+        yield batch
+
+
+def loader_tensors(loader):
+    """
+    TensorDataset loader 的整份 (float inputs, labels)。uint8 数据集返回一次性的 float 副本，
+    调用方用完即释放，不常驻内存。
+    """
+    float_tensors = getattr(loader.dataset, "float_tensors", None)
+    if float_tensors is not None:
+        return float_tensors()
+    return tuple(loader.dataset.tensors[:2])
+
+
+def _full_batch_tensors(loader):
+    """取出 loader 的全部 (inputs, labels)；TensorDataset 直接取底层张量。"""
+    if _tensor_loader_plan(loader) is not None:
+        return loader_tensors(loader)
+    inputs, labels = zip(*[(x, y) for x, y in loader])
+    return torch.cat(inputs), torch.cat(labels)
+
+
+def _train_model_lbfgs(model, train_loader, epochs, qat, weight_bits, levels,
+                       noise_std, ir_drop_coeff, mask=None):
+    """
+    全 batch L-BFGS 训练（ANN_TRAIN_MODE="lbfgs"）。
+
+    单层无 bias 的 softmax 分类是凸问题，全 batch 拟二阶法几十次迭代即可收敛。
+    加一个很小的 L2（LBFGS_L2），避免线性可分时权重无界增长。
+    - float: L-BFGS（strong Wolfe 线搜索），最多 LBFGS_MAX_ITER 次迭代，梯度 / 目标变化
+             低于容差时提前结束；每次 step 只走一次迭代以便逐次记录 loss，线搜索的函数评估
+             预算与终止条件沿用单次 step(max_iter=LBFGS_MAX_ITER) 的规则，迭代轨迹与之相同
+    - QAT:   epochs 个外层步，每步只抽一次噪声（固定噪声下目标是确定的，
+             线搜索才有意义），内层 LBFGS_QAT_ITERS 次 L-BFGS；量化梯度用 STE
+    mask: 0/1 掩码，前向用 weight * mask，被剪掉的权重梯度为 0、始终保持为 0。
+    始终从传入 model 的当前权重热启动。
+    返回 (history, steps): history 为每次迭代 (float) / 每个外层步 (QAT) 结束时的交叉熵
+    （不含 L2 项，与 SGD 的逐 epoch loss 同口径）；steps 为实际完成的迭代 / 外层步数。
+    """
+    inputs, labels = _full_batch_tensors(train_loader)
+    criterion = nn.CrossEntropyLoss()
+    l2 = float(getattr(cfg, 'LBFGS_L2', 1e-4))
+    weight = model.fc.weight
+    history = []
+    if mask is not None:
+        with torch.no_grad():
+            weight.mul_(mask)
+
+    def _effective_weight():
+        return weight * mask if mask is not None else weight
+
+    if not qat:
+        max_iter = int(getattr(cfg, 'LBFGS_MAX_ITER', 100))
+        tolerance_change = 1e-10
+        optimizer = optim.LBFGS(
+            [weight], lr=1.0, max_iter=1, history_size=20, line_search_fn='strong_wolfe',
+            tolerance_grad=1e-7, tolerance_change=tolerance_change,
+        )
+        # 单次 step 的评估预算为 max_iter * 5 // 4（含开头的 1 次），其余全部留给线搜索
+        ls_budget = max_iter * 5 // 4 - 1
+
+        def closure():
+            optimizer.zero_grad()
+            w = _effective_weight()
+            loss = criterion(inputs @ w.t(), labels) + 0.5 * l2 * w.pow(2).sum()
+            loss.backward()
+            return loss
+
+        state = optimizer.state[weight]
+        for _ in range(max_iter):
+            n_iter = state.get('n_iter', 0)
+            func_evals = state.get('func_evals', 0)
+            optimizer.param_groups[0]['max_eval'] = 1 + ls_budget
+            optimizer.step(closure)
+            if state['n_iter'] == n_iter:
+                break  # 梯度已低于 tolerance_grad，本次 step 没有迭代
+            ls_budget -= state['func_evals'] - func_evals - 1
+            with torch.no_grad():
+                w = _effective_weight()
+                ce = criterion(inputs @ w.t(), labels)
+                objective = (ce + 0.5 * l2 * w.pow(2).sum()).item()
+            history.append(ce.item())
+            # 与 LBFGS 内部 (max_iter > 1 时) 的提前结束条件一致；prev_loss 为本次迭代起点的目标值
+            if ls_budget <= 0 or state['d'].mul(state['t']).abs().max() <= tolerance_change:
+                break
+            if abs(objective - state['prev_loss']) < tolerance_change:
+                break
+        return history, len(history)
+
+    # IR drop 代理只与输入有关，全 batch 下算一次
+    scale = _ir_drop_scale(inputs, ir_drop_coeff)
+    use_noise = getattr(cfg, 'QAT_NOISE_ENABLE', False) and noise_std is not None and noise_std > 0
+    inner_iters = int(getattr(cfg, 'LBFGS_QAT_ITERS', 5))
+
+    def _qat_cross_entropy(noise_unit):
+        w_q = _fake_quantize_signed(_effective_weight(), weight_bits, levels)
+        if noise_unit is not None:
+            w_q = w_q + noise_unit * noise_std * w_q.abs().max()
+        outputs = inputs @ w_q.t()
+        if scale is not None:
+            outputs = outputs * scale
+        return criterion(outputs, labels)
+
+    for _ in range(max(1, int(epochs))):
+        noise_unit = torch.randn_like(weight) if use_noise else None
+        optimizer = optim.LBFGS(
+            [weight], lr=1.0, max_iter=inner_iters, history_size=10,
+            line_search_fn='strong_wolfe',
+        )
+
+        def closure():
+            optimizer.zero_grad()
+            loss = _qat_cross_entropy(noise_unit) + 0.5 * l2 * _effective_weight().pow(2).sum()
+            loss.backward()
+            return loss
+
+        optimizer.step(closure)
+        with torch.no_grad():
+            history.append(_qat_cross_entropy(noise_unit).item())
+    return history, len(history)
+
+
+# ---- 训练断点 / 配置指纹 ----
+
+# 影响训练结果的配置项；任何一项变化都会让已有断点和权重指纹失效
+_FINGERPRINT_KEYS = (
+    "RANDOM_SEED", "ANN_LR", "ANN_MOMENTUM", "ANN_BATCH_SIZE", "ANN_TRAIN_MODE",
+    "ANN_TRAIN_BATCHED", "ANN_TRAIN_WORKERS",
+    "LBFGS_MAX_ITER", "LBFGS_QAT_ITERS", "LBFGS_L2",
+    "QAT_ENABLE", "QAT_WEIGHT_BITS", "QAT_USE_DEVICE_LEVELS", "QAT_NOISE_ENABLE",
+    "QAT_NOISE_STD", "QAT_IR_DROP_COEFF", "QAT_LR", "POST_QUANT_FINE_TUNE_EPOCHS",
+    "EARLY_STOP_ENABLE", "EARLY_STOP_EVAL_EVERY", "EARLY_STOP_PATIENCE", "EARLY_STOP_MIN_DELTA",
+    "HIL_FINETUNE_EPOCHS", "HIL_LR", "HIL_ADC_BITS", "HIL_TIMESTEPS", "HIL_SURROGATE_SLOPE",
+    "HIL_VAL_SAMPLES", "PRUNE_SPARSITY", "PRUNE_STRUCTURE", "PRUNE_FINETUNE_EPOCHS", "PRUNE_LR",
+    "THRESHOLD_RATIO_CANDIDATES", "THRESHOLD_CALIBRATE_SAMPLES",
+    "PRIMARY_SCHEME", "USE_DEVICE_MODEL", "IV_DATA_PATH", "IV_BATCH_PATH",
+    "MEMRISTOR_PLUGIN_PATH", "OPTIMIZED_LEVELS_PATH",
+)
+
+# 这些路径指向的文件可能被原地重写（如 level_optimizer 的默认输出路径），指纹按文件内容计算
+_FINGERPRINT_FILE_KEYS = ("IV_DATA_PATH", "IV_BATCH_PATH", "OPTIMIZED_LEVELS_PATH")
+
+
+def tensor_digest(*tensors):
+    """若干张量内容的 sha256（用于把训练数据纳入指纹）。"""
+    h = hashlib.sha256()
+    for t in tensors:
+        if t is None:
+            h.update(b"none")
+            continue
+        t = t.detach().contiguous().cpu()
+        h.update(f"{t.dtype}{tuple(t.shape)}".encode())
+        h.update(t.numpy().tobytes())
+    return h.hexdigest()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    文件内容的 sha256；目录按相对路径顺序逐个文件计入。
+    路径为空返回 None，不存在返回 "missing"。
+    """
+    path = str(path or "")
+    if not path:
+        return None
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+        )
+    elif os.path.isfile(path):
+        files = [path]
+    else:
+        return "missing"
+    h = hashlib.sha256()
+    for file_path in files:
+        h.update(os.path.relpath(file_path, path).encode("utf-8"))
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def training_fingerprint(method_name, input_dim, epochs, data_digest=None, extra=None):
+    """
+    方法名 + 输入维度 + epoch 数 + 训练相关配置 + 数据摘要 (+ extra) 的 sha256。
+    _FINGERPRINT_FILE_KEYS 中的路径同时计入文件内容摘要。
+    """
+    payload = {
+        "method": method_name,
+        "input_dim": int(input_dim),
+        "epochs": int(epochs),
+        "data": data_digest,
+        "extra": extra,
+        "config": {k: getattr(cfg, k, None) for k in _FINGERPRINT_KEYS},
+        "files": {k: file_digest(getattr(cfg, k, None)) for k in _FINGERPRINT_FILE_KEYS},
+    }
+    text = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _rng_state():
+    return {
+        "torch": torch.get_rng_state(),
+        "numpy": np.random.get_state(),
+        "python": random.getstate(),
+    }
+
+
+def _set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    np.random.set_state(state["numpy"])
+    random.setstate(state["python"])
+
+
+_STOPPER_FIELDS = ("best_acc", "best_epoch", "best_state", "bad_evals", "stopped")
+
+
+def _stopper_state(stopper):
+    if stopper is None:
+        return None
+    return {k: getattr(stopper, k) for k in _STOPPER_FIELDS}
+
+
+def _load_stopper_state(stopper, state):
+    if stopper is not None and state is not None:
+        for key, value in state.items():
+            setattr(stopper, key, value)
+
+
+class TrainingCheckpoint:
+    """
+    单个方法的训练断点: WEIGHTS_DIR/checkpoints/<method>.pt。
+
+    内容: 配置指纹、当前阶段 ('float' / 'qat') 与已完成 epoch、模型和优化器 (动量) 状态、
+    本阶段 loss 历史、早停状态、已完成阶段的 {history, info}、torch/numpy/python RNG 状态。
+    指纹与当前配置不一致的断点视为不存在；写入先写临时文件再 os.replace，中断不会留下半个文件。
+    """
+    def __init__(self, method_name, fingerprint, every=None, directory=None):
+        if directory is None:
+            directory = os.path.join(cfg.WEIGHTS_DIR, "checkpoints")
+        self.path = os.path.join(directory, f"{method_name}.pt")
+        self.fingerprint = fingerprint
+        if every is None:
+            every = getattr(cfg, 'CHECKPOINT_EVERY', 1)
+        self.every = max(1, int(every))
+        self._state = None
+        self._loaded = False
+
+    def load(self):
+        """读取断点（只读一次磁盘）；不存在或指纹不匹配时返回 None。"""
+        if not self._loaded:
+            self._loaded = True
+            if os.path.exists(self.path):
+                try:
+                    state = torch.load(self.path, map_location="cpu", weights_only=False)
+                except TypeError:
+                    state = torch.load(self.path, map_location="cpu")
+                except Exception:
+                    state = None
+                if isinstance(state, dict) and state.get("fingerprint") == self.fingerprint:
+                    self._state = state
+        return self._state
+
+    def due(self, epoch):
+        return epoch % self.every == 0
+
+    def restore(self, phase, model, optimizer=None, stopper=None):
+        """
+        把断点恢复到 phase 的起点:
+          - phase 已完成: 恢复模型与 RNG，返回 {"completed": True, "history", "info"}
+          - phase 进行中: 恢复模型/优化器/早停/RNG，返回 {"epoch", "history"}
+          - 本阶段未开始 / 无可用断点: 返回 None (RNG 已在上一阶段返回时恢复)
+        """
+        state = self.load()
+        if state is None:
+            return None
+        done = state.get("completed", {})
+        if phase in done:
+            model.load_state_dict(state["model"])
+            _set_rng_state(state["rng"])
+            return {"completed": True, **done[phase]}
+        if state.get("phase") != phase:
+            return None
+        model.load_state_dict(state["model"])
+        if optimizer is not None and state.get("optimizer") is not None:
+            optimizer.load_state_dict(state["optimizer"])
+        _load_stopper_state(stopper, state.get("stopper"))
+        _set_rng_state(state["rng"])
+        return {"epoch": int(state["epoch"]), "history": list(state["history"])}
+
+    def _write(self, state):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, self.path)
+        self._state = state
+        self._loaded = True
+
+    def save(self, phase, epoch, model, optimizer, history, stopper=None):
+        """阶段进行中的周期性断点。"""
+        prev = self.load() or {}
+        self._write({
+            "fingerprint": self.fingerprint,
+            "phase": phase,
+            "epoch": int(epoch),
+            "model": {k: v.detach().clone() for k, v in model.state_dict().items()},
+            "optimizer": optimizer.state_dict() if optimizer is not None else None,
+            "history": list(history),
+            "stopper": _stopper_state(stopper),
+            "completed": dict(prev.get("completed", {})),
+            "rng": _rng_state(),
+        })
+
+    def complete(self, phase, model, history, info):
+        """记录 phase 已完成（含最终模型与 RNG），下一阶段从这里开始。"""
+        prev = self.load() or {}
+        completed = dict(prev.get("completed", {}))
+        completed[phase] = {"history": list(history), "info": dict(info)}
+        self._write({
+            "fingerprint": self.fingerprint,
+            "phase": phase,
+            "epoch": -1,
+            "model": {k: v.detach().clone() for k, v in model.state_dict().items()},
+            "optimizer": None,
+            "history": list(history),
+            "stopper": None,
+            "completed": completed,
+            "rng": _rng_state(),
+        })
+
+    def completed_phases(self):
+        """断点中已完成的阶段名集合（无可用断点时为空）。"""
+        return set((self.load() or {}).get("completed", {}))
+
+    def clear(self):
+        """最终权重落盘后删除断点。"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._state = None
+        self._loaded = True
+
+
+class BatchedTrainingCheckpoint(TrainingCheckpoint):
+    """
+    train_models_batched 的断点: WEIGHTS_DIR/checkpoints/<name>.pt（默认 name='batched'）。
+
+    与 TrainingCheckpoint 相同的阶段 / 指纹 / RNG 语义，模型状态换成堆叠的 [M, 10, D] 权重和动量、
+    逐模型是否仍在训练 (active)、已训练 epoch 数、loss 历史和早停状态。
+    fingerprint 应覆盖参与批量训练的全部方法（及其顺序）。
+    """
+    def __init__(self, fingerprint, name="batched", every=None, directory=None):
+        super().__init__(name, fingerprint, every=every, directory=directory)
+
+    def restore(self, phase):
+        """
+        返回 None (无可用断点)，或 {"state", "histories", "infos", "completed": True}（phase 已完成），
+        或 {"state", "histories", "stoppers", "epoch"}（phase 进行中）；有断点时同时恢复 RNG。
+        state = {"weight", "momentum", "active", "epochs_run"}。
+        """
+        state = self.load()
+        if state is None:
+            return None
+        done = state.get("completed", {})
+        if phase in done:
+            _set_rng_state(state["rng"])
+            return {"completed": True, "state": state["model"], **done[phase]}
+        if state.get("phase") != phase:
+            return None
+        _set_rng_state(state["rng"])
+        return {"epoch": int(state["epoch"]), "state": state["model"],
+                "histories": [list(h) for h in state["history"]], "stoppers": state["stopper"]}
+
+    def save(self, phase, epoch, state, histories, stoppers):
+        """阶段进行中的周期性断点。"""
+        prev = self.load() or {}
+        self._write({
+            "fingerprint": self.fingerprint,
+            "phase": phase,
+            "epoch": int(epoch),
+            "model": state,
+            "optimizer": None,
+            "history": [list(h) for h in histories],
+            "stopper": [_stopper_state(s) for s in stoppers],
+            "completed": dict(prev.get("completed", {})),
+            "rng": _rng_state(),
+        })
+
+    def complete(self, phase, state, histories, infos):
+        """记录 phase 已完成（含最终权重与 RNG）。"""
+        prev = self.load() or {}
+        completed = dict(prev.get("completed", {}))
+        completed[phase] = {"histories": [list(h) for h in histories],
+                            "infos": [dict(i) for i in infos]}
+        self._write({
+            "fingerprint": self.fingerprint,
+            "phase": phase,
+            "epoch": -1,
+            "model": state,
+            "optimizer": None,
+            "history": [list(h) for h in histories],
+            "stopper": None,
+            "completed": completed,
+            "rng": _rng_state(),
+        })
+
+
+class EarlyStopping:
+    """
+    验证集早停控制器。
+
+    每 eval_every 个 epoch 评估一次验证准确率；比历史最好高出 min_delta 才算提升，
+    此时保存一份权重快照 (snapshot() 的返回值)。连续 patience 次评估没有提升就停止。
+    best_epoch 从 1 开始计数，即该方法"收敛"的 epoch。
+    """
+    def __init__(self, patience, eval_every=1, min_delta=0.0):
+        self.patience = max(1, int(patience))
+        self.eval_every = max(1, int(eval_every))
+        self.min_delta = float(min_delta)
+        self.best_acc = None
+        self.best_epoch = 0
+        self.best_state = None
+        self.bad_evals = 0
+        self.stopped = False
+
+    def due(self, epoch, last_epoch):
+        """第 epoch 个 epoch (1-based) 结束后是否需要评估；最后一个 epoch 总是评估。"""
+        return epoch % self.eval_every == 0 or epoch == last_epoch
+
+    def update(self, epoch, acc, snapshot):
+        """记录一次评估结果，返回是否应停止训练。"""
+        if self.best_acc is None or acc > self.best_acc + self.min_delta:
+            self.best_acc = float(acc)
+            self.best_epoch = int(epoch)
+            self.best_state = snapshot()
+            self.bad_evals = 0
+        else:
+            self.bad_evals += 1
+            if self.bad_evals >= self.patience:
+                self.stopped = True
+        return self.stopped
+
+
+def _make_early_stopper(has_val, patience=None, eval_every=None):
+    """按 cfg.EARLY_STOP_* 构造 EarlyStopping；没有验证集或未启用时返回 None。"""
+    if not has_val or not bool(getattr(cfg, 'EARLY_STOP_ENABLE', False)):
+        return None
+    if patience is None:
+        patience = int(getattr(cfg, 'EARLY_STOP_PATIENCE', 5))
+    if eval_every is None:
+        eval_every = int(getattr(cfg, 'EARLY_STOP_EVAL_EVERY', 1))
+    if patience <= 0:
+        return None
+    return EarlyStopping(patience, eval_every=eval_every,
+                         min_delta=float(getattr(cfg, 'EARLY_STOP_MIN_DELTA', 0.0)))
+
+
+def _training_info(stopper, epochs_run):
+    """train_model(return_info=True) 的附加信息。"""
+    if stopper is None:
+        return {"converged_epoch": int(epochs_run), "epochs_run": int(epochs_run),
+                "best_val_acc": None, "early_stopped": False}
+    return {"converged_epoch": int(stopper.best_epoch), "epochs_run": int(epochs_run),
+            "best_val_acc": stopper.best_acc, "early_stopped": bool(stopper.stopped)}
+
+
 def train_model(train_loader, input_dim, epochs=None, lr=None, model=None,
-                qat=False, weight_bits=None, noise_std=None, ir_drop_coeff=None):
+                qat=False, weight_bits=None, noise_std=None, ir_drop_coeff=None,
+                mode=None, val_loader=None, patience=None, eval_every=None,
+                return_info=False, checkpoint=None, phase=None, mask=None):
     """
     Train ANN model. Supports QAT (fake quant + noise + IR drop proxy).
+    mode: 'sgd' (minibatch SGD, default) | 'lbfgs' (full-batch L-BFGS); None = cfg.ANN_TRAIN_MODE
+    val_loader: enables early stopping (cfg.EARLY_STOP_*, SGD mode only; L-BFGS warns and ignores it).
+        Validation accuracy is checked every eval_every epochs (quantized, noise-free in QAT); training
+        stops after `patience` checks without improvement and the best weights are restored.
+    return_info: also return {"converged_epoch", "epochs_run", "best_val_acc", "early_stopped"}.
+        For L-BFGS, epochs_run counts iterations (float) / outer steps (QAT).
+    checkpoint: TrainingCheckpoint; saves every CHECKPOINT_EVERY epochs and resumes this `phase`
+        ('float' / 'qat', default by qat) bit-exactly, or returns it directly if already completed.
+        L-BFGS only records / reuses completed phases.
+    mask: 0/1 tensor shaped like fc.weight; masked weights are zeroed and kept at 0.
     """
     if epochs is None:
         epochs = cfg.ANN_EPOCHS
@@ -131,15 +692,66 @@ def train_model(train_loader, input_dim, epochs=None, lr=None, model=None,
 
     levels = _get_qat_levels() if qat else None
 
+    if mode is None:
+        mode = getattr(cfg, 'ANN_TRAIN_MODE', 'sgd')
+    mode = str(mode).lower()
+    if mode not in ('sgd', 'lbfgs'):
+        raise ValueError(f"unknown training mode: {mode!r} (expected 'sgd' or 'lbfgs')")
+    if phase is None:
+        phase = 'qat' if qat else 'float'
+
+    if mode == 'lbfgs':
+        if _make_early_stopper(val_loader is not None, patience, eval_every) is not None:
+            warnings.warn("early stopping is not supported in lbfgs mode; val_loader is ignored",
+                          stacklevel=2)
+        if checkpoint is not None:
+            resumed = checkpoint.restore(phase, model)
+            if resumed is not None and resumed.get("completed"):
+                if return_info:
+                    return model, list(resumed["history"]), dict(resumed["info"])
+                return model, list(resumed["history"])
+        model.train()
+        history, steps = _train_model_lbfgs(
+            model, train_loader, epochs, qat, weight_bits, levels, noise_std, ir_drop_coeff,
+            mask=mask,
+        )
+        info = _training_info(None, steps)
+        if checkpoint is not None:
+            checkpoint.complete(phase, model, history, info)
+        if return_info:
+            return model, history, info
+        return model, history
+
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.SGD(model.parameters(), lr=lr, momentum=cfg.ANN_MOMENTUM)
+    if mask is not None:
+        with torch.no_grad():
+            model.fc.weight.mul_(mask)
+
+    stopper = _make_early_stopper(val_loader is not None, patience, eval_every)
 
     history = []
+    epochs_run = 0
+    start_epoch = 1
+    if checkpoint is not None:
+        # 放在 _get_qat_levels 之后: 建表消耗的 RNG 由断点里的 RNG 状态覆盖
+        resumed = checkpoint.restore(phase, model, optimizer, stopper)
+        if resumed is not None and resumed.get("completed"):
+            if return_info:
+                return model, list(resumed["history"]), dict(resumed["info"])
+            return model, list(resumed["history"])
+        if resumed is not None:
+            history = list(resumed["history"])
+            epochs_run = start_epoch = int(resumed["epoch"])
+            start_epoch += 1
+            if stopper is not None and stopper.stopped:
+                start_epoch = epochs + 1
+
     model.train()
-    for _ in range(epochs):
+    for epoch in range(start_epoch, epochs + 1):
         total_loss = 0.0
         num_batches = 0
-        for inputs, labels in train_loader:
+        for inputs, labels in iterate_batches(train_loader):
             if qat:
                 w_q = _fake_quantize_signed(model.fc.weight, weight_bits, levels)
                 if getattr(cfg, 'QAT_NOISE_ENABLE', False):
@@ -155,16 +767,666 @@ def train_model(train_loader, input_dim, epochs=None, lr=None, model=None,
             optimizer.zero_grad()
             loss.backward()
             optimizer.step()
+            if mask is not None:
+                with torch.no_grad():
+                    model.fc.weight.mul_(mask)
 
             total_loss += loss.item()
             num_batches += 1
 
         avg_loss = total_loss / max(1, num_batches)
         history.append(avg_loss)
+        epochs_run = epoch
+
+        if stopper is not None and stopper.due(epoch, epochs):
+            # 验证不加噪声，避免消耗 RNG 并让早停判据稳定
+            val_acc = evaluate_model(
+                model, val_loader, quantized=qat, weight_bits=weight_bits,
+                noise_std=0.0, ir_drop_coeff=ir_drop_coeff if qat else 0.0,
+            )
+            model.train()
+            stop = stopper.update(epoch, val_acc,
+                                  lambda: {k: v.detach().clone() for k, v in model.state_dict().items()})
+            if stop:
+                break
+
+        if checkpoint is not None and checkpoint.due(epoch) and epoch < epochs:
+            checkpoint.save(phase, epoch, model, optimizer, history, stopper)
 
+    if stopper is not None and stopper.best_state is not None:
+        model.load_state_dict(stopper.best_state)
+    info = _training_info(stopper, epochs_run)
+    if checkpoint is not None:
+        checkpoint.complete(phase, model, history, info)
+    if return_info:
+        return model, history, info
     return model, history
 
 
+# ---- 权重稀疏化 (幅值剪枝 + 掩码微调) ----
+
+def magnitude_prune_mask(weight, sparsity, structure=None):
+    """
+    按幅值生成剪枝掩码 (1 = 保留, 0 = 剪掉)，形状与 weight [O, D] 相同。
+
+    structure:
+        'unstructured': 剪掉 |w| 最小的 sparsity 比例的单元
+        'input':        按输入列 (阵列字线) 的 L2 范数整列剪掉 sparsity 比例的输入；
+                        剪掉的字线既不用编程也不用驱动，snn_engine 会把它们从 MAC 中去掉
+    """
+    if structure is None:
+        structure = getattr(cfg, 'PRUNE_STRUCTURE', 'unstructured')
+    structure = str(structure).lower()
+    w = weight.detach()
+    sparsity = min(max(float(sparsity), 0.0), 1.0)
+    mask = torch.ones_like(w)
+    if structure == 'input':
+        scores = w.norm(dim=0)
+        k = int(round(sparsity * scores.numel()))
+        if k > 0:
+            mask[:, torch.argsort(scores, stable=True)[:k]] = 0.0
+    elif structure == 'unstructured':
+        k = int(round(sparsity * w.numel()))
+        if k > 0:
+            mask.view(-1)[torch.argsort(w.abs().reshape(-1), stable=True)[:k]] = 0.0
+    else:
+        raise ValueError(f"未知剪枝方式: {structure}")
+    return mask
+
+
+def prune_and_finetune(model, train_loader, input_dim, sparsity=None, structure=None,
+                       epochs=None, lr=None, qat=None, val_loader=None,
+                       checkpoint=None, return_info=False):
+    """
+    幅值剪枝 + 掩码微调: 按 magnitude_prune_mask 剪掉 sparsity 比例的权重，再带掩码训练
+    epochs 轮 (QAT_ENABLE 时在量化前向上微调)，剪掉的单元始终为 0。
+    断点阶段名为 'prune'；掩码由当前权重重新计算，已剪掉的单元幅值为 0，续跑时掩码不变。
+
+    返回 (model, history, mask)，return_info=True 时再加一个 train_model 同格式的 info。
+    """
+    if sparsity is None:
+        sparsity = float(getattr(cfg, 'PRUNE_SPARSITY', 0.0))
+    if epochs is None:
+        epochs = int(getattr(cfg, 'PRUNE_FINETUNE_EPOCHS', 3))
+    if lr is None:
+        lr = float(getattr(cfg, 'PRUNE_LR', getattr(cfg, 'QAT_LR', cfg.ANN_LR * 0.2)))
+    if qat is None:
+        qat = bool(getattr(cfg, 'QAT_ENABLE', False))
+
+    mask = magnitude_prune_mask(model.fc.weight, sparsity, structure)
+    with torch.no_grad():
+        model.fc.weight.mul_(mask)
+    history = []
+    info = _training_info(None, 0)
+    if epochs > 0:
+        model, history, info = train_model(
+            train_loader, input_dim, epochs=epochs, lr=lr, model=model,
+            qat=qat, weight_bits=cfg.QAT_WEIGHT_BITS,
+            noise_std=cfg.QAT_NOISE_STD, ir_drop_coeff=cfg.QAT_IR_DROP_COEFF,
+            mode='sgd', val_loader=val_loader, return_info=True,
+            checkpoint=checkpoint, phase='prune', mask=mask,
+        )
+    if return_info:
+        return model, history, mask, info
+    return model, history, mask
+
+
+def _per_model(value, num_models, default):
+    """标量或长度为 M 的序列 → [M, 1, 1] 张量（批量训练的逐模型超参）。"""
+    if value is None:
+        value = default
+    t = torch.as_tensor(value, dtype=torch.float32).flatten()
+    if t.numel() == 1:
+        t = t.expand(num_models)
+    if t.numel() != num_models:
+        raise ValueError(f"expected 1 or {num_models} values, got {t.numel()}")
+    return t.reshape(num_models, 1, 1).clone()
+
+
+def stack_padded_inputs(inputs_list, pad_dim=None):
+    """[N, d_m] 列表 → 补零后的 [M, N, pad_dim]，以及真实维度列表。"""
+    dims = [int(x.shape[1]) for x in inputs_list]
+    pad_dim = max(dims) if pad_dim is None else int(pad_dim)
+    n = int(inputs_list[0].shape[0])
+    stacked = torch.zeros(len(inputs_list), n, pad_dim, dtype=torch.float32)
+    for m, x in enumerate(inputs_list):
+        if int(x.shape[0]) != n:
+            raise ValueError("all methods must share the same training samples")
+        stacked[m, :, :dims[m]] = x.float()
+    return stacked, dims
+
+
+def train_models_batched(train_inputs, train_labels, input_dims, epochs=None, lr=None,
+                         momentum=None, models=None, qat=False, weight_bits=None,
+                         noise_std=None, ir_drop_coeff=None, batch_size=None,
+                         val_inputs=None, val_labels=None, patience=None, eval_every=None,
+                         return_info=False, checkpoint=None, phase=None):
+    """
+    同时训练 M 个单层 ANN（共享标签与 batch 顺序，输入维度可以不同）。
+
+    所有方法的输入补零到同一维度后堆叠成 [M, N, D]，权重堆叠成 [M, 10, D]，
+    每步一次 bmm + 一次交叉熵。每个模型的 loss 是自己 batch 的平均值，
+    总 loss 为各模型 loss 之和，所以梯度与单独训练完全一致；
+    补零列的输入恒为 0，权重和梯度再乘 mask，保证不会泄漏到 7×7 模型。
+    QAT 的 max_abs / 噪声幅度 / IR drop 代理都按模型各自计算。
+
+    参数:
+        train_inputs: [M, N, D] 补零张量，或 [N, d_m] 张量列表；
+                      也可以是所有模型共用的 [N, D]（超参集成: 同一数据、不同超参），不做 M 份拷贝
+        input_dims:   各模型真实输入维度
+        lr / momentum / noise_std / ir_drop_coeff: 标量或长度 M 的序列（逐模型超参）
+        models:       可选的 SingleLayerANN 列表（热启动），默认按顺序新建
+        val_inputs / val_labels: [M, Nv, D]（或列表）+ [Nv]，启用逐模型早停 (cfg.EARLY_STOP_*)；
+                      已停止的模型权重冻结，全部停止后提前结束，最后各自恢复最好的权重
+        return_info:  额外返回每个模型的 train_model 同格式信息 (converged_epoch 等)
+        checkpoint:   BatchedTrainingCheckpoint；每 CHECKPOINT_EVERY 个 epoch 保存堆叠权重 / 动量 /
+                      逐模型早停状态 / RNG，续跑本 phase ('float' / 'qat'，默认按 qat)，已完成则直接返回
+    返回:
+        models:    list[SingleLayerANN]
+        histories: list[list[float]]，每个模型实际训练的每个 epoch 的平均 loss
+    """
+    if isinstance(train_inputs, (list, tuple)):
+        train_inputs, _ = stack_padded_inputs(train_inputs)
+    input_dims = [int(d) for d in input_dims]
+    shared_inputs = train_inputs.dim() == 2
+    if shared_inputs:
+        num_models = len(input_dims)
+        n, pad_dim = (int(v) for v in train_inputs.shape)
+    else:
+        num_models, n, pad_dim = (int(v) for v in train_inputs.shape)
+
+    if epochs is None:
+        epochs = cfg.ANN_EPOCHS
+    if batch_size is None:
+        batch_size = cfg.ANN_BATCH_SIZE
+    if weight_bits is None:
+        weight_bits = getattr(cfg, 'QAT_WEIGHT_BITS', 4)
+    lr_t = _per_model(lr, num_models, cfg.ANN_LR)
+    momentum_t = _per_model(momentum, num_models, cfg.ANN_MOMENTUM)
+    noise_t = _per_model(noise_std, num_models, getattr(cfg, 'QAT_NOISE_STD', 0.0))
+    ir_t = _per_model(ir_drop_coeff, num_models, getattr(cfg, 'QAT_IR_DROP_COEFF', 0.0))
+    dims_t = torch.tensor(input_dims, dtype=torch.float32).reshape(num_models, 1, 1)
+
+    if models is None:
+        models = [SingleLayerANN(d) for d in input_dims]
+    num_classes = int(models[0].fc.weight.shape[0])
+
+    mask = torch.zeros(num_models, 1, pad_dim)
+    weight = torch.zeros(num_models, num_classes, pad_dim)
+    for m, model in enumerate(models):
+        mask[m, :, :input_dims[m]] = 1.0
+        weight[m, :, :input_dims[m]] = model.fc.weight.detach()
+    weight.requires_grad_(True)
+    momentum_buf = None
+
+    levels = _get_qat_levels() if qat else None
+    use_noise = qat and getattr(cfg, 'QAT_NOISE_ENABLE', False) and bool((noise_t > 0).any())
+    use_ir = qat and bool((ir_t > 0).any())
+    labels = train_labels
+
+    if isinstance(val_inputs, (list, tuple)):
+        val_inputs, _ = stack_padded_inputs(val_inputs, pad_dim=pad_dim)
+    stoppers = [None] * num_models
+    if val_inputs is not None and val_labels is not None:
+        stoppers = [_make_early_stopper(True, patience, eval_every) for _ in range(num_models)]
+    active = torch.ones(num_models, 1, 1)
+    epochs_run = [0] * num_models
+
+    histories = [[] for _ in range(num_models)]
+    start_epoch = 1
+    if phase is None:
+        phase = 'qat' if qat else 'float'
+    resumed = checkpoint.restore(phase) if checkpoint is not None else None
+    if resumed is not None:
+        # 放在 _get_qat_levels 之后: 建表消耗的 RNG 由断点里的 RNG 状态覆盖
+        state = resumed["state"]
+        with torch.no_grad():
+            weight.copy_(state["weight"])
+        if resumed.get("completed"):
+            with torch.no_grad():
+                for m, model in enumerate(models):
+                    model.fc.weight.copy_(weight[m, :, :input_dims[m]])
+            histories = [list(h) for h in resumed["histories"]]
+            if return_info:
+                return models, histories, [dict(i) for i in resumed["infos"]]
+            return models, histories
+        if state["momentum"] is not None:
+            momentum_buf = state["momentum"].clone()
+        active = state["active"].clone()
+        epochs_run = list(state["epochs_run"])
+        histories = resumed["histories"]
+        for stopper, stopper_state in zip(stoppers, resumed["stoppers"]):
+            _load_stopper_state(stopper, stopper_state)
+        start_epoch = int(resumed["epoch"]) + 1
+        if not bool((active > 0).any()):
+            start_epoch = epochs + 1
+
+    def _state():
+        return {"weight": weight.detach().clone(),
+                "momentum": momentum_buf.clone() if momentum_buf is not None else None,
+                "active": active.clone(), "epochs_run": list(epochs_run)}
+
+    for epoch in range(start_epoch, epochs + 1):
+        perm = torch.randperm(n)
+        x_epoch = train_inputs[perm] if shared_inputs else train_inputs[:, perm]
+        y_epoch = labels[perm]
+        loss_sum = torch.zeros(num_models)
+        num_batches = 0
+        for start in range(0, n, batch_size):
+            inputs = x_epoch[..., start:start + batch_size, :]
+            targets = y_epoch[start:start + batch_size]
+            if qat:
+                w_q = _fake_quantize_signed(weight, weight_bits, levels)
+                if use_noise:
+                    w_q = _apply_qat_noise(w_q, noise_t)
+                outputs = torch.matmul(inputs, w_q.transpose(1, 2))
+                if use_ir:
+                    outputs = outputs * _ir_drop_scale(inputs, ir_t, input_dims=dims_t)
+            else:
+                outputs = torch.matmul(inputs, weight.transpose(1, 2))
+
+            per_model = nn.functional.cross_entropy(
+                outputs.reshape(-1, num_classes), targets.repeat(num_models), reduction='none'
+            ).view(num_models, -1).mean(dim=1)
+            weight.grad = None
+            per_model.sum().backward()
+
+            with torch.no_grad():
+                grad = weight.grad * mask
+                if momentum_buf is None:
+                    momentum_buf = grad.clone()
+                else:
+                    momentum_buf.mul_(momentum_t).add_(grad)
+                weight.sub_(lr_t * active * momentum_buf)
+
+            loss_sum += per_model.detach()
+            num_batches += 1
+
+        for m in range(num_models):
+            if active[m] > 0:
+                histories[m].append(float(loss_sum[m]) / max(1, num_batches))
+                epochs_run[m] = epoch
+
+        due = [m for m in range(num_models)
+               if stoppers[m] is not None and active[m] > 0 and stoppers[m].due(epoch, epochs)]
+        if due:
+            val_acc = _batched_val_accuracy(weight.detach(), val_inputs, val_labels, qat,
+                                            weight_bits, levels, ir_t if use_ir else None, dims_t)
+            for m in due:
+                if stoppers[m].update(epoch, float(val_acc[m]), lambda: weight[m].detach().clone()):
+                    active[m] = 0.0
+            if not bool((active > 0).any()):
+                break
+
+        if checkpoint is not None and checkpoint.due(epoch) and epoch < epochs:
+            checkpoint.save(phase, epoch, _state(), histories, stoppers)
+
+    with torch.no_grad():
+        for m, model in enumerate(models):
+            if stoppers[m] is not None and stoppers[m].best_state is not None:
+                weight[m].copy_(stoppers[m].best_state)
+            model.fc.weight.copy_(weight[m, :, :input_dims[m]])
+    infos = [_training_info(stoppers[m], epochs_run[m]) for m in range(num_models)]
+    if checkpoint is not None:
+        checkpoint.complete(phase, _state(), histories, infos)
+    if return_info:
+        return models, histories, infos
+    return models, histories
+
+
+def _batched_val_accuracy(weight, val_inputs, val_labels, qat, weight_bits, levels, ir_t, dims_t,
+                          noise_std=None):
+    """
+    [M, 10, D] 权重在 [M, Nv, D]（或共用的 [Nv, D]）验证集上的逐模型准确率。
+    QAT 时量化；noise_std 给出时再叠加一次权重噪声（默认不加噪声）。
+    """
+    with torch.no_grad():
+        w_eval = _fake_quantize_signed(weight, weight_bits, levels) if qat else weight
+        if noise_std is not None:
+            w_eval = _apply_qat_noise(w_eval, noise_std)
+        outputs = torch.matmul(val_inputs, w_eval.transpose(1, 2))
+        if ir_t is not None:
+            outputs = outputs * _ir_drop_scale(val_inputs, ir_t, input_dims=dims_t)
+        correct = (outputs.argmax(dim=2) == val_labels.view(1, -1)).float()
+    return correct.mean(dim=1)
+
+
+def hparam_grid(**axes):
+    """
+    超参网格的笛卡尔积，例如 hparam_grid(lr=[0.005, 0.01], noise_std=[0.0, 0.02])
+    → [{"lr": 0.005, "noise_std": 0.0}, ...]（按参数顺序、最后一个参数变化最快）。
+    """
+    settings = [{}]
+    for key, values in axes.items():
+        settings = [dict(s, **{key: v}) for s in settings for v in values]
+    return settings
+
+
+def train_hparam_ensemble(train_inputs, train_labels, settings, epochs=None, qat_epochs=None,
+                          val_inputs=None, val_labels=None, noise_trials=None):
+    """
+    超参集成: K 组超参的 SingleLayerANN 副本在同一数据上同步训练（[K, 10, D] 一次 matmul）。
+
+    settings: 长度 K 的 dict 列表，可用的键（缺省取 cfg 对应值）:
+        lr, momentum          — float 阶段 (ANN_LR / ANN_MOMENTUM)
+        qat_lr                — QAT 阶段学习率 (QAT_LR)，动量沿用 momentum
+        noise_std, ir_drop_coeff — QAT 噪声 / IR drop 代理 (QAT_NOISE_STD / QAT_IR_DROP_COEFF)
+    train_inputs 为共用的 [N, D]，不复制 K 份；batch 顺序所有副本相同，差异只来自超参。
+    qat_epochs 默认 POST_QUANT_FINE_TUNE_EPOCHS（QAT_ENABLE 关闭时为 0）。
+
+    给出验证集时（同时启用逐副本早停）所有副本一次评估，每个副本返回:
+        val_acc            float 权重
+        val_quant_acc      量化权重 + 部署用 IR 代理 (cfg.QAT_IR_DROP_COEFF)，无噪声
+        val_noisy_acc      同上再加 cfg.QAT_NOISE_STD 权重噪声，noise_trials 次平均
+    返回 (models, rows)，rows[k] = settings[k] + 上述指标 + loss / converged_epoch。
+    """
+    num_models = len(settings)
+    dims = [int(train_inputs.shape[1])] * num_models
+    if qat_epochs is None:
+        qat_epochs = cfg.POST_QUANT_FINE_TUNE_EPOCHS if getattr(cfg, 'QAT_ENABLE', False) else 0
+    if noise_trials is None:
+        noise_trials = int(getattr(cfg, 'HPARAM_SCAN_NOISE_TRIALS', 5))
+
+    def _column(key, default):
+        return [float(s.get(key, default)) for s in settings]
+
+    momentum = _column('momentum', cfg.ANN_MOMENTUM)
+    val = {}
+    if val_inputs is not None and val_labels is not None:
+        val = {"val_inputs": val_inputs, "val_labels": val_labels}
+
+    models, histories, infos = train_models_batched(
+        train_inputs, train_labels, dims, epochs=epochs,
+        lr=_column('lr', cfg.ANN_LR), momentum=momentum, return_info=True, **val
+    )
+    qat_infos = [None] * num_models
+    if qat_epochs > 0:
+        models, qat_histories, qat_infos = train_models_batched(
+            train_inputs, train_labels, dims, epochs=qat_epochs, models=models,
+            lr=_column('qat_lr', getattr(cfg, 'QAT_LR', cfg.ANN_LR * 0.2)), momentum=momentum,
+            qat=True, weight_bits=cfg.QAT_WEIGHT_BITS,
+            noise_std=_column('noise_std', cfg.QAT_NOISE_STD),
+            ir_drop_coeff=_column('ir_drop_coeff', cfg.QAT_IR_DROP_COEFF),
+            return_info=True, **val
+        )
+        for history, qat_history in zip(histories, qat_histories):
+            history.extend(qat_history)
+
+    rows = []
+    for k, setting in enumerate(settings):
+        row = dict(setting)
+        row["loss"] = histories[k][-1] if histories[k] else None
+        row["converged_epoch"] = infos[k]["converged_epoch"]
+        row["qat_converged_epoch"] = qat_infos[k]["converged_epoch"] if qat_infos[k] else None
+        rows.append(row)
+
+    if val:
+        weight = torch.stack([m.fc.weight.detach() for m in models])
+        levels = _get_qat_levels()
+        weight_bits = cfg.QAT_WEIGHT_BITS
+        dims_t = torch.tensor(dims, dtype=torch.float32).reshape(num_models, 1, 1)
+        ir = float(getattr(cfg, 'QAT_IR_DROP_COEFF', 0.0))
+        ir_t = _per_model(ir, num_models, 0.0) if ir > 0 else None
+        float_acc = _batched_val_accuracy(weight, val_inputs, val_labels, False,
+                                          weight_bits, None, None, dims_t)
+        quant_acc = _batched_val_accuracy(weight, val_inputs, val_labels, True,
+                                          weight_bits, levels, ir_t, dims_t)
+        noisy_acc = quant_acc
+        noise_std = float(getattr(cfg, 'QAT_NOISE_STD', 0.0))
+        if getattr(cfg, 'QAT_NOISE_ENABLE', False) and noise_std > 0 and noise_trials > 0:
+            noisy_acc = torch.stack([
+                _batched_val_accuracy(weight, val_inputs, val_labels, True, weight_bits,
+                                      levels, ir_t, dims_t, noise_std=noise_std)
+                for _ in range(noise_trials)
+            ]).mean(dim=0)
+        for k, row in enumerate(rows):
+            row["val_acc"] = float(float_acc[k])
+            row["val_quant_acc"] = float(quant_acc[k])
+            row["val_noisy_acc"] = float(noisy_acc[k])
+    return models, rows
+
+
+def _hil_val_subset(images_uint8, labels, max_samples):
+    """固定随机子集（不消耗全局 RNG），与 run_all 的阈值标定取样方式一致。"""
+    n = int(labels.shape[0])
+    if max_samples <= 0 or max_samples >= n:
+        return images_uint8, labels
+    gen = torch.Generator().manual_seed(int(getattr(cfg, "RANDOM_SEED", 42)) + 20260207)
+    idx = torch.randperm(n, generator=gen)[:max_samples]
+    return images_uint8[idx], labels[idx]
+
+
+def hil_finetune(model, train_images_uint8, train_labels, epochs=None, lr=None,
+                 adc_bits=None, weight_bits=None, timesteps=None, scheme=None,
+                 threshold_ratio=None, batch_size=None, val_images_uint8=None,
+                 val_labels=None, return_info=False, mask=None):
+    """
+    硬件在环 (HIL) 微调: 直接在 snn_engine 的 bit-plane MAC → ADC → LIF 前向上训练。
+
+    前向用 snn_engine.snn_forward_surrogate（量化电导 / ADC 取整走 STE，发放走代理梯度），
+    logits = spike_count + 残余膜电位 / 阈值，与 "spike 计数 + 膜电位兜底" 的决策一致。
+    给出验证集时每个 epoch 用真实 snn_inference（含器件模型）评估纯 spike 准确率，
+    按 EarlyStopping 保留最好的权重（不受 EARLY_STOP_ENABLE / PATIENCE 影响，它们只决定是否提前停止）；微调前的权重作为第 0 个 epoch 参与比较，
+    所以微调不会让验证精度变差。给出剪枝掩码 mask 时被剪掉的权重始终保持为 0。
+
+    返回 (model, history)，return_info=True 时再加一个 train_model 同格式的 info。
+    """
+    import snn_engine
+
+    if epochs is None:
+        epochs = int(getattr(cfg, 'HIL_FINETUNE_EPOCHS', 0))
+    if lr is None:
+        lr = float(getattr(cfg, 'HIL_LR', 0.003))
+    if adc_bits is None:
+        adc_bits = int(getattr(cfg, 'HIL_ADC_BITS', 8))
+    if weight_bits is None:
+        weight_bits = getattr(cfg, 'QAT_WEIGHT_BITS', 4)
+    if timesteps is None:
+        timesteps = int(getattr(cfg, 'HIL_TIMESTEPS', 1))
+    if scheme is None:
+        scheme = getattr(cfg, 'PRIMARY_SCHEME', 'B')
+    if threshold_ratio is None:
+        threshold_ratio = float(getattr(cfg, 'SPIKE_THRESHOLD_RATIO', 0.6))
+    if batch_size is None:
+        batch_size = cfg.ANN_BATCH_SIZE
+
+    snn_kwargs = dict(adc_bits=adc_bits, weight_bits=weight_bits, timesteps=timesteps,
+                      scheme=scheme, threshold_ratio=threshold_ratio)
+
+    stopper = None
+    if val_images_uint8 is not None and val_labels is not None:
+        # 保留最好权重不受 EARLY_STOP_ENABLE 控制；早停关闭或 patience<=0 时只是不提前停止
+        patience = int(getattr(cfg, 'EARLY_STOP_PATIENCE', 5))
+        if not bool(getattr(cfg, 'EARLY_STOP_ENABLE', False)) or patience <= 0:
+            patience = int(epochs) + 1
+        stopper = EarlyStopping(patience, eval_every=int(getattr(cfg, 'EARLY_STOP_EVAL_EVERY', 1)),
+                                min_delta=float(getattr(cfg, 'EARLY_STOP_MIN_DELTA', 0.0)))
+        val_images_uint8, val_labels = _hil_val_subset(
+            val_images_uint8, val_labels, int(getattr(cfg, 'HIL_VAL_SAMPLES', 2000))
+        )
+
+    def _val_acc():
+        _, _, stats = snn_engine.snn_inference(
+            val_images_uint8, val_labels, model.fc.weight.detach(), decision='spike',
+            spike_fallback_to_membrane=False, return_stats=True, **snn_kwargs
+        )
+        return stats["spike_only_acc"]
+
+    def _snapshot():
+        return {k: v.detach().clone() for k, v in model.state_dict().items()}
+
+    if stopper is not None:
+        stopper.update(0, _val_acc(), _snapshot)
+
+    weight = model.fc.weight
+    optimizer = optim.SGD([weight], lr=lr, momentum=cfg.ANN_MOMENTUM)
+    n = int(train_labels.shape[0])
+    history = []
+    epochs_run = 0
+    model.train()
+    for epoch in range(1, int(epochs) + 1):
+        perm = torch.randperm(n)
+        total_loss = 0.0
+        num_batches = 0
+        for start in range(0, n, batch_size):
+            idx = perm[start:start + batch_size]
+            counts, membranes, threshold = snn_engine.snn_forward_surrogate(
+                train_images_uint8[idx], weight, **snn_kwargs
+            )
+            loss = nn.functional.cross_entropy(counts + membranes / threshold, train_labels[idx])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            if mask is not None:
+                with torch.no_grad():
+                    weight.mul_(mask)
+            total_loss += loss.item()
+            num_batches += 1
+        history.append(total_loss / max(1, num_batches))
+        epochs_run = epoch
+
+        if stopper is not None and stopper.due(epoch, epochs):
+            if stopper.update(epoch, _val_acc(), _snapshot):
+                break
+
+    if stopper is not None and stopper.best_state is not None:
+        model.load_state_dict(stopper.best_state)
+    if return_info:
+        return model, history, _training_info(stopper, epochs_run)
+    return model, history
+
+
+def resolve_train_workers(num_jobs, workers=None):
+    """
+    训练进程数: workers (默认 cfg.ANN_TRAIN_WORKERS)；0 = 不开进程池，负数 = 全部核。
+    不会超过任务数，也不会超过 CPU 核数。
+    """
+    if workers is None:
+        workers = int(getattr(cfg, 'ANN_TRAIN_WORKERS', 0))
+    cores = os.cpu_count() or 1
+    if workers < 0:
+        workers = cores
+    return max(0, min(int(workers), int(num_jobs), cores))
+
+
+def _config_snapshot():
+    """主进程的 cfg 标量/容器设置（含运行时改过的 WEIGHTS_DIR 等），传给 spawn 出来的子进程。"""
+    plain = (bool, int, float, str, type(None), tuple, list, dict)
+    return {k: v for k, v in vars(cfg).items() if k.isupper() and isinstance(v, plain)}
+
+
+def _parallel_worker_init(cfg_values, num_threads):
+    """子进程初始化: 同步 cfg，并限制 torch 线程数避免 workers × 线程数 超订 CPU。"""
+    for key, value in cfg_values.items():
+        setattr(cfg, key, value)
+    torch.set_num_threads(max(1, int(num_threads)))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    if bool(getattr(cfg, 'QAT_ENABLE', False)):
+        # 器件电平表在这里建好：建表会消耗 torch RNG，放在任务播种之前才能与调度顺序无关
+        _get_qat_levels()
+
+
+def _parallel_train_job(name, inputs, labels, input_dim, batch_size, epochs,
+                        qat_epochs, qat_lr, seed, val_inputs=None, val_labels=None,
+                        fingerprint=None):
+    """
+    子进程里的单个方法训练: float 训练 + 可选 QAT 微调，权重经 save_weights 写回。
+    inputs/labels (及可选的验证集) 是共享内存张量，子进程直接映射，不做拷贝；
+    uint8 输入在子进程里转成 float（与主进程的 Uint8TensorDataset 逐位相同）。
+    """
+    torch.manual_seed(seed)
+    if inputs.dtype == torch.uint8:
+        inputs = inputs.float() / 255.0
+    loader = DataLoader(TensorDataset(inputs, labels), batch_size=batch_size, shuffle=True)
+    val_loader = None
+    if val_inputs is not None:
+        if val_inputs.dtype == torch.uint8:
+            val_inputs = val_inputs.float() / 255.0
+        val_loader = DataLoader(TensorDataset(val_inputs, val_labels), batch_size=batch_size)
+    ckpt = TrainingCheckpoint(name, fingerprint) if fingerprint is not None else None
+    model, history, info = train_model(loader, input_dim, epochs=epochs,
+                                       val_loader=val_loader, return_info=True, checkpoint=ckpt)
+    qat_info = None
+    if qat_epochs > 0:
+        model, qat_history, qat_info = train_model(
+            loader, input_dim, epochs=qat_epochs, lr=qat_lr, model=model,
+            qat=True, weight_bits=cfg.QAT_WEIGHT_BITS,
+            noise_std=cfg.QAT_NOISE_STD, ir_drop_coeff=cfg.QAT_IR_DROP_COEFF,
+            val_loader=val_loader, return_info=True, checkpoint=ckpt
+        )
+        history.extend(qat_history)
+    save_weights(model, name)
+    return name, model.state_dict(), history, (info, qat_info)
+
+
+def train_models_parallel(jobs, workers=None, qat_epochs=0, qat_lr=None, seed=None,
+                          return_info=False):
+    """
+    用进程池并行训练多个方法（不能走 train_models_batched 的情况，例如训练 epoch 数不同）。
+
+    参数:
+        jobs:       [(name, train_loader, input_dim, epochs[, val_loader[, fingerprint]]), ...]，
+                    loader 需是 TensorDataset（uint8 数据集按 uint8 共享）；给出 val_loader 时两个阶段都按验证集早停；
+                    给出 fingerprint 时子进程按 TrainingCheckpoint 存断点 / 续跑
+        workers:    进程数，见 resolve_train_workers
+        qat_epochs: >0 时每个方法训练后做 QAT 微调 (lr=qat_lr)
+        seed:       第 i 个任务的随机种子为 seed + i（默认 cfg.RANDOM_SEED），与调度顺序无关
+        return_info: 为 True 时返回 {name: (model, history, (float_info, qat_info))}
+    返回:
+        {name: (model, history)}，权重已由子进程写入 cfg.WEIGHTS_DIR
+
+    训练张量只调用一次 share_memory_() 放进共享内存，子进程按句柄映射而不是逐个 pickle 拷贝；
+    每个子进程 torch 线程数 = CPU 核数 // workers。使用 spawn 启动，避免 fork 后 OpenMP 线程池状态异常。
+    """
+    workers = resolve_train_workers(len(jobs), workers)
+    if workers < 1:
+        raise ValueError("train_models_parallel 需要至少 1 个 worker")
+    if qat_lr is None:
+        qat_lr = getattr(cfg, 'QAT_LR', cfg.ANN_LR * 0.2)
+    if seed is None:
+        seed = int(getattr(cfg, 'RANDOM_SEED', 0))
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    shared = {}
+
+    def _shared(t):
+        # 多个方法共用的张量（如标签）只放一次
+        if id(t) not in shared:
+            shared[id(t)] = t.contiguous().share_memory_()
+        return shared[id(t)]
+
+    submissions = []
+    for i, job in enumerate(jobs):
+        name, loader, input_dim, epochs = job[:4]
+        val_loader = job[4] if len(job) > 4 else None
+        fingerprint = job[5] if len(job) > 5 else None
+        inputs, labels = loader.dataset.tensors[:2]
+        val_inputs = val_labels = None
+        if val_loader is not None:
+            val_inputs, val_labels = (_shared(t) for t in val_loader.dataset.tensors[:2])
+        submissions.append((
+            name, _shared(inputs), _shared(labels),
+            int(input_dim), int(loader.batch_size), int(epochs),
+            int(qat_epochs), float(qat_lr), seed + i, val_inputs, val_labels, fingerprint,
+        ))
+
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_parallel_worker_init,
+                             initargs=(_config_snapshot(), num_threads)) as pool:
+        futures = [pool.submit(_parallel_train_job, *args) for args in submissions]
+        for (name, _, _, input_dim, *_), future in zip(submissions, futures):
+            _, state, history, infos = future.result()
+            model = SingleLayerANN(input_dim)
+            model.load_state_dict(state)
+            results[name] = (model, history, infos) if return_info else (model, history)
+    return results
+
+
 def evaluate_model(model, test_loader, quantized=False, weight_bits=None,
                    noise_std=0.0, ir_drop_coeff=0.0):
     """Evaluate model accuracy. Optionally use quantized weights for inference."""
@@ -178,7 +1440,7 @@ def evaluate_model(model, test_loader, quantized=False, weight_bits=None,
     levels = _get_qat_levels() if quantized else None
 
     with torch.no_grad():
-        for inputs, labels in test_loader:
+        for inputs, labels in iterate_batches(test_loader):
             if quantized:
                 w_q = _fake_quantize_signed(model.fc.weight, weight_bits, levels)
                 if getattr(cfg, 'QAT_NOISE_ENABLE', False) and noise_std > 0:
@@ -211,11 +1473,43 @@ def get_weights(model):
     return model.fc.weight.data.clone()
 
 
-def save_weights(model, method_name):
-    """保存权重到文件"""
+def save_weights(model, method_name, fingerprint=None):
+    """
+    保存权重到文件。
+    fingerprint 给出时同时写 <method>.meta.json（训练配置指纹），供 --skip-train / 续跑判断权重是否过期；
+    不给时删除旧的 meta，避免新权重沿用旧指纹。
+    """
     os.makedirs(cfg.WEIGHTS_DIR, exist_ok=True)
     path = os.path.join(cfg.WEIGHTS_DIR, f"{method_name}.pt")
     torch.save(model.state_dict(), path)
+    write_weights_fingerprint(method_name, fingerprint)
+
+
+def _fingerprint_path(method_name):
+    return os.path.join(cfg.WEIGHTS_DIR, f"{method_name}.meta.json")
+
+
+def write_weights_fingerprint(method_name, fingerprint):
+    """写入 (或在 fingerprint=None 时删除) 权重文件旁的配置指纹。"""
+    path = _fingerprint_path(method_name)
+    if fingerprint is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"method": method_name, "fingerprint": fingerprint}, f)
+
+
+def read_weights_fingerprint(method_name):
+    """读取权重指纹；没有 meta（旧权重）时返回 None。"""
+    path = _fingerprint_path(method_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("fingerprint")
+    except (OSError, ValueError):
+        return None
 
 
 def load_weights(method_name, input_dim):
@@ -559,6 +559,247 @@ class ConductanceExtractor:
         return self.r_off / self.r_on
 
 
+# ==========================================================
+# 批量 I-V 曲线：器件参数提取与变化性拟合
+# ==========================================================
+# IVCharacteristicLoader / ConductanceExtractor 一次只处理一条曲线。
+# 器件组现在测几百个单元，下面把所有曲线装进一个 NaN 补齐的二维数组，
+# 用向量化 NumPy 一次提取全部单元的 g_min/g_max/开关比/电平，
+# 再从总体统计直接拟合 D2D / C2C，替代 VariationProfile 的 5%/3% 默认值。
+
+
+def _clean_iv_frame(dataframe) -> Tuple[np.ndarray, np.ndarray]:
+    """与 IVCharacteristicLoader._load_from_excel 相同的清洗：取绝对电流、合并重复电压点、排序。"""
+    dataframe = dataframe[['Voltage', 'Current']].dropna().copy()
+    dataframe['Voltage'] = dataframe['Voltage'].astype(np.float64)
+    dataframe['Current'] = dataframe['Current'].astype(np.float64).abs()
+    dataframe = (
+        dataframe.groupby('Voltage', as_index=False)['Current']
+        .mean()
+        .sort_values('Voltage')
+        .reset_index(drop=True)
+    )
+    return (
+        dataframe['Voltage'].to_numpy(dtype=np.float64),
+        dataframe['Current'].to_numpy(dtype=np.float64),
+    )
+
+
+@dataclass
+class IVPopulation:
+    # 教学注释：
+    # 多条曲线按行堆叠，长度不同的曲线用 NaN 补齐。
+    """批量 I-V 数据（NaN 补齐）"""
+    voltages: np.ndarray            # [C, L]
+    currents: np.ndarray            # [C, L]
+    names: list                     # 每条曲线的来源 "文件:工作表"
+    groups: np.ndarray              # [C] 分组编号（同一 die / 同一文件）
+    group_names: list
+
+    @property
+    def num_curves(self) -> int:
+        return int(self.voltages.shape[0])
+
+
+class BatchIVLoader:
+    # 教学注释：
+    # 输入可以是目录（多个 .xlsx/.xls/.csv）或一个多工作表的工作簿。
+    """批量 I-V 数据加载器"""
+
+    SUPPORTED_SUFFIXES = ('.xlsx', '.xls', '.csv')
+
+    def __init__(self, path: str, group_separator: str = '_'):
+        """
+        输入：
+        - `path`：目录或工作簿路径。每个工作表（或每个 csv 文件）是一条单元曲线，
+          必须包含 `Voltage` / `Current` 两列，缺列的工作表会被跳过。
+        - `group_separator`：分组规则。目录输入时每个文件是一组（一个 die）；
+          单个工作簿输入时，工作表名在第一个分隔符之前的前缀作为组名
+          （例如 "D1_C03" → 组 "D1"），没有分隔符则全部归为一组。
+
+        处理：
+        - 逐表读取并清洗，然后堆叠为 [C, L] 的 NaN 补齐数组。
+
+        输出：
+        - 无返回值；结果保存在 self.population。
+
+        为什么：
+        - D2D 需要"组间"差异、C2C 需要"组内"差异，所以加载时就要记录分组。
+        """
+        self.path = path
+        self.group_separator = group_separator
+        self.population = self._load()
+
+    def _iter_tables(self):
+        import pandas as pd
+        if os.path.isdir(self.path):
+            files = sorted(
+                f for f in os.listdir(self.path)
+                if f.lower().endswith(self.SUPPORTED_SUFFIXES) and not f.startswith('~$')
+            )
+            for fname in files:
+                fpath = os.path.join(self.path, fname)
+                stem = os.path.splitext(fname)[0]
+                if fname.lower().endswith('.csv'):
+                    yield f"{fname}", stem, pd.read_csv(fpath)
+                else:
+                    for sheet, frame in pd.read_excel(fpath, sheet_name=None).items():
+                        yield f"{fname}:{sheet}", stem, frame
+        elif os.path.exists(self.path):
+            fname = os.path.basename(self.path)
+            if fname.lower().endswith('.csv'):
+                yield fname, "all", pd.read_csv(self.path)
+                return
+            for sheet, frame in pd.read_excel(self.path, sheet_name=None).items():
+                sheet = str(sheet)
+                if self.group_separator and self.group_separator in sheet:
+                    group = sheet.split(self.group_separator, 1)[0]
+                else:
+                    group = "all"
+                yield f"{fname}:{sheet}", group, frame
+        else:
+            raise FileNotFoundError(f"I-V batch path not found: {self.path}")
+
+    def _load(self) -> IVPopulation:
+        curves, names, group_keys = [], [], []
+        for name, group, frame in self._iter_tables():
+            if not {'Voltage', 'Current'}.issubset(frame.columns):
+                continue
+            v, i = _clean_iv_frame(frame)
+            if v.size == 0:
+                continue
+            curves.append((v, i))
+            names.append(name)
+            group_keys.append(group)
+        if not curves:
+            raise RuntimeError(f"no Voltage/Current curves found in: {self.path}")
+
+        length = max(v.size for v, _ in curves)
+        voltages = np.full((len(curves), length), np.nan)
+        currents = np.full((len(curves), length), np.nan)
+        for row, (v, i) in enumerate(curves):
+            voltages[row, :v.size] = v
+            currents[row, :i.size] = i
+
+        group_names = list(dict.fromkeys(group_keys))
+        group_index = {g: k for k, g in enumerate(group_names)}
+        groups = np.array([group_index[g] for g in group_keys], dtype=np.int64)
+        return IVPopulation(voltages, currents, names, groups, group_names)
+
+
+def extract_population_parameters(population: IVPopulation, n_levels: int = 16) -> Dict[str, np.ndarray]:
+    """
+    输入：
+    - `population`：BatchIVLoader 输出的 NaN 补齐曲线。
+    - `n_levels`：每个单元生成的对数间隔电平数。
+
+    处理：
+    - 与 ConductanceExtractor 完全相同的规则，但对所有曲线一次向量化计算：
+      G = I/|V|（|V|≤0.01 的点取该曲线最小有效电导），
+      g_min = 低压段 (|V|<0.5) 25 分位，g_max = 高压段 (|V|>1.5) 75 分位。
+
+    输出：
+    - dict：g_min/g_max/on_off_ratio [C]，levels [C, n_levels]。
+
+    为什么：
+    - 几百条曲线逐条构造 ConductanceExtractor 会重复建插值器；这里只需要边界参数。
+    """
+    v = population.voltages
+    i = population.currents
+    valid = ~np.isnan(v)
+    abs_v = np.abs(v)
+    nonzero = valid & (abs_v > 0.01)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g = np.where(nonzero, i / abs_v, np.nan)
+    has_nonzero = nonzero.any(axis=1)
+    row_min = np.full(v.shape[0], 1e-12)
+    row_min[has_nonzero] = np.nanmin(g[has_nonzero], axis=1)
+    g = np.where(valid & ~nonzero, row_min[:, None], g)
+
+    def _masked_percentile(mask, q, default):
+        out = np.full(v.shape[0], default, dtype=np.float64)
+        rows = mask.any(axis=1)
+        if np.any(rows):
+            out[rows] = np.nanpercentile(np.where(mask[rows], g[rows], np.nan), q, axis=1)
+        return out
+
+    g_min = _masked_percentile(valid & (abs_v < 0.5), 25, 1e-12)
+    g_max = _masked_percentile(valid & (abs_v > 1.5), 75, 1e-6)
+
+    log_min = np.log10(g_min)
+    log_max = np.log10(g_max)
+    steps = np.linspace(0.0, 1.0, int(n_levels))
+    levels = 10.0 ** (log_min[:, None] + (log_max - log_min)[:, None] * steps[None, :])
+
+    return {
+        'g_min': g_min,
+        'g_max': g_max,
+        'on_off_ratio': g_max / g_min,
+        'levels': levels,
+    }
+
+
+def fit_variation_profile(params: Dict[str, np.ndarray],
+                          groups: np.ndarray,
+                          state: str = 'both') -> VariationProfile:
+    """
+    输入：
+    - `params`：extract_population_parameters 的输出。
+    - `groups`：[C] 分组编号（同一 die 为一组）。
+    - `state`：'g_max' / 'g_min' / 'both'（两个电导态的方差取平均）。
+
+    处理：
+    - 在 ln(G) 域做单因素随机效应方差分解（乘性变化在对数域是加性的）：
+      C2C² = 组内合并方差；
+      D2D² = 组均值的方差 - 平均 (C2C²/n_g)，扣除组均值本身的抽样误差，下限为 0。
+    - 只有一组时无法区分 D2D，全部方差记为 C2C，D2D=0。
+
+    输出：
+    - 返回值：VariationProfile(die_to_die, cell_to_cell)，与默认值同为相对标准差。
+
+    为什么：
+    - 直接用测得的总体统计替代手填的 5%/3%。
+    """
+    if state == 'both':
+        keys = ['g_max', 'g_min']
+    elif state in ('g_max', 'g_min'):
+        keys = [state]
+    else:
+        raise ValueError(f"unknown state: {state}")
+
+    groups = np.asarray(groups)
+    group_ids, counts = np.unique(groups, return_counts=True)
+    d2d_vars, c2c_vars = [], []
+    for key in keys:
+        x = np.log(np.asarray(params[key], dtype=np.float64))
+        means = np.array([x[groups == g].mean() for g in group_ids])
+        dof = counts.sum() - group_ids.size
+        if dof > 0:
+            within = sum(((x[groups == g] - means[k]) ** 2).sum() for k, g in enumerate(group_ids)) / dof
+        else:
+            within = 0.0
+        if group_ids.size > 1:
+            between = means.var(ddof=1)
+            d2d_var = max(0.0, between - float(np.mean(within / counts)))
+        else:
+            d2d_var = 0.0
+        d2d_vars.append(d2d_var)
+        c2c_vars.append(within)
+
+    return VariationProfile(
+        die_to_die=float(math.sqrt(np.mean(d2d_vars))),
+        cell_to_cell=float(math.sqrt(np.mean(c2c_vars))),
+    )
+
+
+def variation_from_iv_batch(path: str, state: str = 'both') -> VariationProfile:
+    """一步完成：加载批量 I-V → 提取参数 → 拟合 VariationProfile。"""
+    population = BatchIVLoader(path).population
+    params = extract_population_parameters(population)
+    return fit_variation_profile(params, population.groups, state=state)
+
+
 class NoiseGenerator:
     # 教学注释：
     # 专门管理噪声采样，避免主类里噪声逻辑过于分散。
@@ -677,6 +918,101 @@ class NoiseGenerator:
             total_var *= 1.6
         return torch.randn(shape, device=device) * total_var
 
+    def generate_state_dependent_noise(self,
+                                       conductance: torch.Tensor,
+                                       state_coeff: float) -> torch.Tensor:
+        # 教学注释：
+        # 读噪声幅度随电导态变化：高电导态电流大，涨落也大。
+        """
+        输入：
+        - `conductance`：当前电导图（任意形状）。
+        - `state_coeff`：电导相关系数 k，σ(G) = base_sigma + k·G。
+
+        处理：
+        - 逐单元计算 σ(G)，再采样零均值高斯噪声。
+
+        输出：
+        - 返回值：与 conductance 同形状的加性噪声。
+
+        为什么：
+        - 固定 base_sigma 会低估高电导单元的噪声、高估低电导单元的噪声。
+        """
+        sigma = self.base_sigma + float(state_coeff) * conductance.abs()
+        return torch.randn_like(conductance) * sigma
+
+
+class TelegraphNoiseStream:
+    # 教学注释：
+    # 随机电报噪声 (RTN)：单元内陷阱在"俘获/释放"两态间随机切换，
+    # 电导在两个水平之间跳变，时间上是相关的（不是每步独立的白噪声）。
+    """随机电报噪声流：每个单元一个两态 Markov 链，按子时间步推进"""
+
+    def __init__(self,
+                 shape: Tuple,
+                 p_capture: float = 0.05,
+                 p_emit: float = 0.05,
+                 amplitude: float = 0.02,
+                 active_fraction: float = 1.0,
+                 device: torch.device = torch.device('cpu'),
+                 generator: Optional[torch.Generator] = None):
+        """
+        输入：
+        - `shape`：单元张量形状，例如 [N, rows, cols]（每个样本独立一条链）。
+        - `p_capture`：每步从空态跳到俘获态的概率。
+        - `p_emit`：每步从俘获态跳回空态的概率。
+        - `amplitude`：俘获时的相对电导变化 ΔG/G。
+        - `active_fraction`：含活跃陷阱的单元比例，其余单元没有 RTN。
+        - `generator`：可选随机数发生器，便于复现。
+
+        处理：
+        - 按平稳分布 P(俘获) = p_capture / (p_capture + p_emit) 初始化链状态，
+          一开始就处于稳态，不需要预热。
+
+        输出：
+        - 无返回值；建立 occupied / amplitude_map 状态。
+
+        为什么：
+        - 两态 Markov 链的相关时间约为 1/(p_capture+p_emit) 步，
+          可以直接用切换概率控制噪声的时间相关性。
+        """
+        self.shape = tuple(shape)
+        self.p_capture = float(p_capture)
+        self.p_emit = float(p_emit)
+        self.device = torch.device(device)
+        self.generator = generator
+        total = self.p_capture + self.p_emit
+        self.stationary = self.p_capture / total if total > 0 else 0.0
+
+        active = self._rand() < float(active_fraction)
+        self.amplitude_map = active.float() * float(amplitude)
+        self.occupied = self._rand() < self.stationary
+
+    def _rand(self) -> torch.Tensor:
+        return torch.rand(self.shape, device=self.device, generator=self.generator)
+
+    def step(self) -> torch.Tensor:
+        """
+        输入：
+        - 无（使用内部链状态）。
+
+        处理：
+        - 所有单元一次张量运算推进一步：空态以 p_capture 俘获，俘获态以 p_emit 释放。
+
+        输出：
+        - 返回值：相对电导偏差 δ，形状 = shape，零均值（已减去稳态占据率）。
+          俘获态降低电导，所以 δ = -amplitude · (occupied - stationary)。
+
+        为什么：
+        - 逐单元 Python 循环在 8×T 个子时间步上不可接受，这里每步只有一次 rand + where。
+        """
+        u = self._rand()
+        self.occupied = torch.where(self.occupied, u >= self.p_emit, u < self.p_capture)
+        return -self.amplitude_map * (self.occupied.float() - self.stationary)
+
+    def perturb(self, conductance: torch.Tensor) -> torch.Tensor:
+        """推进一步并返回 G·(1+δ)；conductance 需能与 shape 广播。"""
+        return conductance * (1.0 + self.step())
+
 
 class IRDropSimulator:
     # 教学注释：
@@ -788,12 +1124,14 @@ class MemristorArraySimulator:
                  iv_data_path: Optional[str] = None,
                  device: str = 'cuda',
                  rows: int = 128,
-                 cols: int = 256):
+                 cols: int = 256,
+                 variation: Optional[VariationProfile] = None):
         """
         输入：
         - `self`：当前对象本身，表示“在这个类实例上操作”。
         - `iv_data_path`：由调用方传入的业务数据或控制参数。
         - `device`：由调用方传入的业务数据或控制参数。
+        - `variation`：可选 VariationProfile（如 variation_from_iv_batch 的拟合结果）。
         
         处理：
         - 第1步：读取并检查输入，处理默认值、边界值与兼容分支。
@@ -812,7 +1150,10 @@ class MemristorArraySimulator:
         # 硬件配置
         self.geometry = ArrayGeometry(rows=int(rows), cols=int(cols))
         self.precision = PrecisionConfig(n_bits=4)
-        self.variation = VariationProfile(die_to_die=0.05, cell_to_cell=0.03)
+        # 可传入由批量 I-V 拟合的变化性 (variation_from_iv_batch)，否则用默认 5%/3%
+        self.variation = variation if variation is not None else VariationProfile(
+            die_to_die=0.05, cell_to_cell=0.03
+        )
         self.temporal = TemporalParams(drift_coefficient=0.005)
         self.interconnect = InterconnectParams(
             wire_resistance=0.5,
@@ -842,6 +1183,8 @@ class MemristorArraySimulator:
         # 计算绝对噪声基准
         g_range = self.conductance_model.g_max - self.conductance_model.g_min
         self.noise_sigma = 0.0005 * g_range  # 0.05% of range
+        # 电导态相关读噪声系数: σ(G) = noise_sigma + k·G（默认 0，与旧行为一致）
+        self.read_noise_state_coeff = 0.0
         
         # 初始化子系统
         self.noise_gen = NoiseGenerator(self.noise_sigma, self.variation)
@@ -849,6 +1192,12 @@ class MemristorArraySimulator:
         
         # 初始化电导矩阵
         self.conductance_matrix = self._initialize_conductance_matrix()
+
+        # 编程状态（program()/program_conductance() 写入，read() 读取）
+        self.nominal_conductance = None
+        self.programmed_conductance = None
+        self.adc_full_scale = None
+        self.programming_time = None
         
         # 打印模型信息
         self._print_model_info()
@@ -1073,6 +1422,157 @@ class MemristorArraySimulator:
             
         return quantized
         
+    # ======================================================
+    # 编程一次 / 读取多次 接口
+    # ======================================================
+    # matrix_vector_multiply 每次调用都会重新量化并重新抽取非理想，
+    # 不符合真实阵列"写一次、读很多次"的行为。下面三个方法把阵列
+    # 当成有状态对象：program 时抽取静态偏差（D2D/C2C/漂移），
+    # read 时只叠加每次读取独立的读噪声与 ADC 量化。
+
+    def program(self,
+                weights: torch.Tensor,
+                apply_variation: bool = True,
+                add_drift: bool = True) -> torch.Tensor:
+        # 教学注释：
+        # 权重先按 quantize_weights 映射到离散电平，再写入阵列。
+        """
+        输入：
+        - `weights`：权重矩阵 [rows, cols]，或多个阵列 bank [B, rows, cols]。
+        - `apply_variation` / `add_drift`：是否在编程时抽取静态偏差与漂移。
+
+        处理：
+        - 第1步：quantize_weights 量化到器件电平表。
+        - 第2步：交给 program_conductance 写入并缓存。
+
+        输出：
+        - 返回值：写入后的电导图（含静态偏差）。
+        - 副作用：更新 self.programmed_conductance 等编程状态。
+
+        为什么：
+        - 量化只在编程时做一次，后续 read 不再有量化开销。
+        """
+        return self.program_conductance(
+            self.quantize_weights(weights),
+            apply_variation=apply_variation,
+            add_drift=add_drift,
+        )
+
+    def program_conductance(self,
+                            conductance: torch.Tensor,
+                            apply_variation: bool = True,
+                            add_drift: bool = True) -> torch.Tensor:
+        # 教学注释：
+        # 直接写入目标电导（调用方已自行量化，例如 snn_engine 的差分对）。
+        """
+        输入：
+        - `conductance`：目标电导 [rows, cols] 或 [B, rows, cols]（B 个 bank，如 G_pos/G_neg）。
+        - `apply_variation`：抽取 D2D（所有 bank 共享一个系数）与 C2C（逐单元）偏差。
+        - `add_drift`：按当前时间抽取一次漂移乘子。
+
+        处理：
+        - 第1步：记录名义电导，并据此固定 ADC 满量程（每个 bank 最大列电流）。
+        - 第2步：静态偏差只在这里抽取一次，之后每次 read 复用。
+        - 第3步：裁剪到 [g_min, g_max]。
+
+        输出：
+        - 返回值：写入后的电导图（与输入同形状）。
+        - 副作用：更新 programmed_conductance / nominal_conductance / adc_full_scale。
+
+        为什么：
+        - 静态偏差与读噪声分离后，同一次编程的多次读取共享同一组器件偏差，
+          和真实芯片一致。
+        """
+        g_nominal = conductance.detach().to(device=self.device, dtype=torch.float32)
+        g = g_nominal.clone()
+        if apply_variation:
+            d2d = 1.0 + torch.randn(1, device=g.device) * self.variation.die_to_die
+            c2c = 1.0 + torch.randn_like(g) * self.variation.cell_to_cell
+            g = g * d2d * c2c
+        if add_drift:
+            self.temporal.elapsed_time = time.time() - self.creation_time
+            g = g * self.noise_gen.generate_drift_noise(
+                g.shape, g.device, self.temporal.compute_drift_factor()
+            )
+        if apply_variation or add_drift:
+            g = torch.clamp(g, self.conductance_model.g_min, self.conductance_model.g_max)
+
+        self.nominal_conductance = g_nominal
+        self.programmed_conductance = g
+        # 满量程 = 所有输入为 1 时的最大输出电流（按 bank 分别固定）
+        self.adc_full_scale = g_nominal.sum(dim=-1).max(dim=-1)[0]
+        self.programming_time = time.time()
+        return g
+
+    def read(self,
+             inputs: torch.Tensor,
+             add_noise: bool = True,
+             adc_bits: Optional[int] = None,
+             chunk_size: int = 4096) -> torch.Tensor:
+        # 教学注释：
+        # 读取已编程阵列：IR drop 乘加 -> 读噪声 -> 可选固定量程 ADC。
+        """
+        输入：
+        - `inputs`：输入电压 [N, cols]，或 bit-plane 批量 [P, N, cols]。
+        - `add_noise`：叠加每次读取独立的读噪声。
+        - `adc_bits`：None 表示返回模拟电流；否则按 program 时固定的满量程量化。
+        - `chunk_size`：IR drop 分块大小，限制 [batch, rows, cols] 中间张量内存。
+
+        处理：
+        - 第1步：把 [P, N, cols] 展平成一批，逐 bank 计算乘加（含 IR drop）。
+        - 第2步：读噪声在输出域注入：单元噪声 N(0, σ²) 经输入 v 加权求和后
+          等价于 N(0, σ²·Σv²)，无需为每次读取生成整张噪声电导图；
+          read_noise_state_coeff > 0 时 σ_j = noise_sigma + k·G_j，方差为 Σ v_j²σ_j²。
+        - 第3步：可选 ADC 量化，并还原输入的前导维度。
+
+        输出：
+        - 返回值：[.., N, rows]；多 bank 时前面多一维 B。
+
+        为什么：
+        - 同一组 bit-plane 只需一次批量读取，调用方不必每帧重复量化和仿真。
+        """
+        if getattr(self, 'programmed_conductance', None) is None:
+            raise RuntimeError("阵列尚未编程，请先调用 program()/program_conductance()")
+
+        g = self.programmed_conductance
+        banked = g.dim() == 3
+        banks = g if banked else g.unsqueeze(0)
+
+        lead_shape = inputs.shape[:-1]
+        flat = inputs.reshape(-1, inputs.shape[-1]).to(device=banks.device, dtype=banks.dtype)
+
+        outputs = []
+        for g_bank in banks:
+            if self.interconnect.ir_drop_active:
+                parts = []
+                for start in range(0, flat.shape[0], max(1, int(chunk_size))):
+                    x = flat[start:start + int(chunk_size)]
+                    v_effective = self.ir_simulator.compute_effective_voltages(x, g_bank)
+                    parts.append((g_bank.unsqueeze(0) * v_effective).sum(dim=2))
+                out = torch.cat(parts, dim=0) if parts else flat.new_zeros(0, g_bank.shape[0])
+            else:
+                out = flat @ g_bank.t()
+            outputs.append(out)
+        out = torch.stack(outputs)  # [B, M, rows]
+
+        if add_noise:
+            if self.read_noise_state_coeff > 0:
+                # σ_j = noise_sigma + k·G_j，输出方差 = Σ v_j² σ_j²
+                cell_sigma = self.noise_sigma + self.read_noise_state_coeff * banks
+                var = torch.einsum('md,bod->bmo', flat.pow(2), cell_sigma.pow(2))
+                out = out + torch.randn_like(out) * var.sqrt()
+            else:
+                sigma = self.noise_sigma * flat.pow(2).sum(dim=1, keepdim=True).sqrt()
+                out = out + torch.randn_like(out) * sigma.unsqueeze(0)
+
+        if adc_bits is not None:
+            fs = self.adc_full_scale.reshape(-1, 1, 1).to(out.device)
+            step = fs.clamp(min=1e-30) / (2 ** int(adc_bits) - 1)
+            out = torch.minimum(torch.clamp(torch.round(out / step) * step, min=0.0), fs)
+
+        out = out.reshape(out.shape[0], *lead_shape, out.shape[-1])
+        return out if banked else out[0]
+
     def compute_hardware_loss(self, weights: torch.Tensor) -> torch.Tensor:
         # 教学注释：
         # 训练期可用的“硬件友好”正则：量化损失 + 漂移惩罚 + IR 惩罚。